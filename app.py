@@ -1,16 +1,180 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
-import pyodbc  # 替换sqlite3为pyodbc
+import time
+# 记录模块开始导入的时间, 用于统计worker启动耗时
+_boot_started = time.perf_counter()
+
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, session, g, has_app_context,
+                   stream_with_context)
 import os
 import json
+import csv
+import io
+import zlib
+import threading
+import atexit
+import tempfile
+import secrets
+import click
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 
+from db_pool import ConnectionPool, PooledConnection, PoolTimeoutError
+from cache import TTLCache, DataVersions
+from log_writer import AsyncLogWriter
+from background import PeriodicTask
+from timeseries import (METRICS, METRIC_NAMES, ROLLUP_RESOLUTIONS, build_reading_rows, floor_time,
+                        refresh_rollup, query_series)
+from retention import ChunkedPurger, build_retention_policies
+from migrations import migrate, explain_hot_queries
+from backends import create_backend
+from events import EventBroker
+from json_provider import FastJSONProvider
+from compression import compress_response
+from importer import ImportFormatError, load_records, plan_import, summarize_plan, apply_import
+from metrics import RequestStats, InstrumentedConnection, MetricsRegistry
+from querylog import QueryLog
+from dispatcher import CommandDispatcher, DispatcherClosedError, create_transport
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl, 不支持多进程部署
+    fcntl = None
+
 app = Flask(__name__)
 app.secret_key = 'jiaoshikongzhi_secret_key'  # 用于会话加密
 
 # ODBC数据库连接信息
 DSN_NAME = 'jiaoshi'  # 数据库DSN名称
 
+# 连接池配置(可通过环境变量覆盖)
+app.config.update(
+    # 数据库后端: mysql(通过ODBC数据源连接) / sqlite(本地文件, 用于单栋楼的边缘部署)
+    DB_BACKEND=os.environ.get('DB_BACKEND', 'mysql'),
+    DB_DSN=os.environ.get('DB_DSN', DSN_NAME),
+    # 默认放在实例目录(instance/, 不纳入版本控制)
+    SQLITE_PATH=os.environ.get('SQLITE_PATH', os.path.join(app.instance_path, 'jiaoshi.db')),
+    SQLITE_JOURNAL_MODE=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    SQLITE_SYNCHRONOUS=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    SQLITE_BUSY_TIMEOUT=int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # 等待写锁的毫秒数
+    DB_POOL_MIN_SIZE=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),  # 最少空闲连接数
+    DB_POOL_MAX_SIZE=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),  # 最大连接数
+    DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 10)),  # 获取连接的最长等待秒数
+    DB_POOL_MAX_LIFETIME=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),  # 连接最长存活秒数
+    DB_POOL_PING_INTERVAL=float(os.environ.get('DB_POOL_PING_INTERVAL', 30)),  # 空闲超过该秒数后复用前检查存活
+    # 是否使用增量维护的班级设备统计表(class_device_stats)读取班级汇总
+    CLASS_STATS_TABLE=os.environ.get('CLASS_STATS_TABLE', '0') == '1',
+    # 日志总数缓存的存活秒数(按筛选条件缓存)
+    LOG_COUNT_CACHE_TTL=float(os.environ.get('LOG_COUNT_CACHE_TTL', 30)),
+    # 是否在第一个请求到来时自动执行数据库迁移(默认需手动执行 flask init-db)
+    AUTO_INIT_DB=os.environ.get('AUTO_INIT_DB', '0') == '1',
+    # 批量控制设备时每批处理的设备数
+    BULK_COMMAND_BATCH_SIZE=int(os.environ.get('BULK_COMMAND_BATCH_SIZE', 500)),
+    # 操作日志异步写入
+    ASYNC_LOG_WRITER=os.environ.get('ASYNC_LOG_WRITER', '0') == '1',
+    LOG_WRITER_QUEUE_SIZE=int(os.environ.get('LOG_WRITER_QUEUE_SIZE', 10000)),  # 队列容量, 满时改为同步写入
+    LOG_WRITER_BATCH_SIZE=int(os.environ.get('LOG_WRITER_BATCH_SIZE', 200)),  # 每批写入的最大条数
+    LOG_WRITER_FLUSH_INTERVAL=float(os.environ.get('LOG_WRITER_FLUSH_INTERVAL', 1)),  # 最长写入间隔秒数
+    # 设备数据记录方式: request(读取设备数据时记录) / sampler(后台定时采样记录) / off(不记录)
+    DEVICE_DATA_RECORD_MODE=os.environ.get('DEVICE_DATA_RECORD_MODE', 'request'),
+    DEVICE_SAMPLER_INTERVAL=float(os.environ.get('DEVICE_SAMPLER_INTERVAL', 60)),  # 后台采样间隔秒数
+    # 批量插入时启用pyodbc的fast_executemany(部分ODBC驱动不支持时可关闭)
+    FAST_EXECUTEMANY=os.environ.get('FAST_EXECUTEMANY', '1') == '1',
+    # 时序读数汇总间隔秒数, 0表示不运行汇总任务
+    ROLLUP_INTERVAL=float(os.environ.get('ROLLUP_INTERVAL', 60)),
+    SERIES_MAX_POINTS=int(os.environ.get('SERIES_MAX_POINTS', 5000)),  # 时序查询单个指标的最大点数
+    # 数据保留天数, 0表示长期保留; 默认不删除任何数据, 需显式开启
+    # 建议值: 操作日志90天, 原始读数7天, 分钟汇总30天(按审计要求调整)
+    RETENTION_LOGS_DAYS=int(os.environ.get('RETENTION_LOGS_DAYS', 0)),
+    RETENTION_RAW_READINGS_DAYS=int(os.environ.get('RETENTION_RAW_READINGS_DAYS', 0)),
+    RETENTION_MINUTE_ROLLUPS_DAYS=int(os.environ.get('RETENTION_MINUTE_ROLLUPS_DAYS', 0)),
+    RETENTION_INTERVAL=float(os.environ.get('RETENTION_INTERVAL', 3600)),  # 清理任务间隔秒数, 0表示不自动清理
+    PURGE_CHUNK_SIZE=int(os.environ.get('PURGE_CHUNK_SIZE', 1000)),  # 每批删除的行数
+    PURGE_PAUSE=float(os.environ.get('PURGE_PAUSE', 0.1)),  # 批次之间暂停的秒数
+    # 设备和班级注册表缓存
+    REGISTRY_MAX_SIZE=int(os.environ.get('REGISTRY_MAX_SIZE', 20000)),  # 最大缓存条目数
+    REGISTRY_TTL=float(os.environ.get('REGISTRY_TTL', 30)),  # 缓存存活秒数, 兜底多进程之间的不一致
+    # 设备状态推送(Server-Sent Events)
+    EVENTS_HEARTBEAT=float(os.environ.get('EVENTS_HEARTBEAT', 15)),  # 没有事件时发送心跳的间隔秒数
+    EVENTS_QUEUE_SIZE=int(os.environ.get('EVENTS_QUEUE_SIZE', 100)),  # 每个订阅者最多缓存的事件数
+    # 列表接口的条件请求(ETag/304)
+    CONDITIONAL_GET=os.environ.get('CONDITIONAL_GET', '1') == '1',
+    # ETag的最长有效秒数, 兜底其他进程的修改(版本号只在本进程内递增), 0表示不限制
+    ETAG_MAX_AGE=float(os.environ.get('ETAG_MAX_AGE', 30)),
+    # JSON序列化: fast(安装了orjson时使用orjson) / default(Flask默认的json实现)
+    JSON_PROVIDER=os.environ.get('JSON_PROVIDER', 'fast'),
+    # 日期时间格式: http(与原接口一致) / iso(更快, 如2024-01-01T08:00:00)
+    JSON_DATETIME_FORMAT=os.environ.get('JSON_DATETIME_FORMAT', 'http'),
+    # /api/*响应压缩(gzip, 安装了brotli时优先br)
+    COMPRESS_RESPONSES=os.environ.get('COMPRESS_RESPONSES', '1') == '1',
+    COMPRESS_MIN_SIZE=int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),  # 小于该字节数的响应不压缩
+    COMPRESS_GZIP_LEVEL=int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)),
+    COMPRESS_BROTLI_QUALITY=int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4)),
+    LOG_EXPORT_CHUNK_SIZE=int(os.environ.get('LOG_EXPORT_CHUNK_SIZE', 1000)),  # 日志导出每次查询的行数
+    IMPORT_CHUNK_SIZE=int(os.environ.get('IMPORT_CHUNK_SIZE', 500)),  # 批量导入每个事务写入的行数
+    # 请求级统计: 获取连接、数据库、序列化耗时和查询数
+    SERVER_TIMING=os.environ.get('SERVER_TIMING', '1') == '1',  # 在响应中添加Server-Timing头
+    METRICS_ENABLED=os.environ.get('METRICS_ENABLED', '1') == '1',  # 按接口统计直方图, 在/metrics输出
+    # 访问/metrics需要Authorization: Bearer <token>, 未设置时/metrics返回404
+    METRICS_TOKEN=os.environ.get('METRICS_TOKEN', ''),
+    # 不设置METRICS_TOKEN也允许匿名访问/metrics(只在抓取网络与外部隔离时使用)
+    METRICS_PUBLIC=os.environ.get('METRICS_PUBLIC', '0') == '1',
+    # 慢查询日志和N+1检测(开发和灰度环境使用), 结果在/debug/queries查看
+    QUERY_DEBUG=os.environ.get('QUERY_DEBUG', '0') == '1',
+    QUERY_SLOW_MS=float(os.environ.get('QUERY_SLOW_MS', 100)),  # 慢查询阈值毫秒数
+    QUERY_REPEAT_THRESHOLD=int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5)),  # 同一语句模板执行次数达到该值记为N+1
+    # 为空时不写文件; 多进程部署时每个worker写入各自的文件(文件名加进程号, 如queries.12345.log)
+    QUERY_LOG_PATH=os.environ.get('QUERY_LOG_PATH', os.path.join(app.instance_path, 'queries.log')),
+    QUERY_LOG_MAX_BYTES=int(os.environ.get('QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)),  # 日志文件滚动大小
+    QUERY_LOG_BACKUPS=int(os.environ.get('QUERY_LOG_BACKUPS', 5)),  # 保留的历史日志文件数
+    QUERY_DEBUG_HISTORY=int(os.environ.get('QUERY_DEBUG_HISTORY', 200)),  # /debug/queries保留的请求数
+    # 生产环境服务(flask serve / gunicorn): 多进程 + 每个进程多线程
+    SERVE_BIND=os.environ.get('SERVE_BIND', '0.0.0.0:5000'),
+    SERVE_WORKERS=int(os.environ.get('SERVE_WORKERS', (os.cpu_count() or 1) * 2 + 1)),  # worker进程数
+    # 每个worker的线程数, 即同时处理的请求数(每个打开的事件推送流占用一个线程)
+    SERVE_THREADS=int(os.environ.get('SERVE_THREADS', 8)),
+    SERVE_TIMEOUT=int(os.environ.get('SERVE_TIMEOUT', 60)),  # worker无响应超过该秒数时重启
+    SERVE_GRACEFUL_TIMEOUT=int(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 30)),  # 平滑停止时等待进行中请求的秒数
+    SERVE_KEEPALIVE=int(os.environ.get('SERVE_KEEPALIVE', 5)),  # 长连接空闲秒数
+    SERVE_MAX_REQUESTS=int(os.environ.get('SERVE_MAX_REQUESTS', 0)),  # worker处理该数量的请求后重启, 0表示不重启
+    SERVE_MAX_REQUESTS_JITTER=int(os.environ.get('SERVE_MAX_REQUESTS_JITTER', 0)),
+    SERVE_PRELOAD=os.environ.get('SERVE_PRELOAD', '1') == '1',  # 主进程导入应用后再fork, worker启动更快
+    SERVE_ACCESS_LOG=os.environ.get('SERVE_ACCESS_LOG', ''),  # 访问日志路径, -表示标准输出, 为空时不记录
+    # 多进程部署时只有持有该文件锁的worker运行后台任务(采样、汇总、清理)
+    BACKGROUND_LOCK_PATH=os.environ.get('BACKGROUND_LOCK_PATH',
+                                        os.path.join(tempfile.gettempdir(), 'jiaoshi-background.lock')),
+    BACKGROUND_ELECTION_INTERVAL=float(os.environ.get('BACKGROUND_ELECTION_INTERVAL', 30)),  # 未持有锁的worker重试间隔
+    # ASGI部署(uvicorn asgi:application): 设备控制命令使用单独的有界线程池, 见asgi.py
+    ASGI_DB_THREADS=int(os.environ.get('ASGI_DB_THREADS', 8)),  # 执行设备控制命令的线程数
+    ASGI_MAX_PENDING=int(os.environ.get('ASGI_MAX_PENDING', 5000)),  # 同时进行的设备命令上限, 超过时返回503
+    ASGI_WSGI_THREADS=int(os.environ.get('ASGI_WSGI_THREADS', 16)),  # 运行其他请求(Flask)的线程数
+    # 设备命令下发(见dispatcher.py): 为空时只更新数据库, 不与设备通信;
+    # simulator为本地模拟网关; 或"模块:工厂函数", 以app.config为参数创建传输方式
+    DEVICE_TRANSPORT=os.environ.get('DEVICE_TRANSPORT', ''),
+    DISPATCH_CLASS_CONCURRENCY=int(os.environ.get('DISPATCH_CLASS_CONCURRENCY', 4)),  # 每个教室同时下发的命令数
+    DISPATCH_WORKERS=int(os.environ.get('DISPATCH_WORKERS', 32)),  # 下发线程数(所有教室共用)
+    DISPATCH_MAX_ATTEMPTS=int(os.environ.get('DISPATCH_MAX_ATTEMPTS', 5)),  # 每条命令最多下发的次数
+    DISPATCH_BACKOFF=float(os.environ.get('DISPATCH_BACKOFF', 0.5)),  # 第一次重试前等待的秒数, 之后每次翻倍
+    DISPATCH_BACKOFF_MAX=float(os.environ.get('DISPATCH_BACKOFF_MAX', 30)),  # 重试等待的最长秒数
+    SIMULATOR_LATENCY=float(os.environ.get('SIMULATOR_LATENCY', 0.05)),  # 模拟网关确认命令的秒数
+    SIMULATOR_FAILURE_RATE=float(os.environ.get('SIMULATOR_FAILURE_RATE', 0))  # 模拟网关下发失败的概率
+)
+
+# JSON序列化实现
+if app.config['JSON_PROVIDER'] == 'fast':
+    app.json = FastJSONProvider(app)
+    app.json.datetime_format = app.config['JSON_DATETIME_FORMAT']
+
+# 数据库后端
+db_backend = create_backend(app.config)
+
+# 启动耗时统计
+boot_stats = {
+    'pid': os.getpid(),
+    'import_seconds': None,  # 模块导入耗时
+    'first_request_seconds': None,  # 从开始导入到第一个请求开始处理的耗时
+    'init_db_seconds': None  # 自动初始化数据库耗时
+}
+
 # 登录所需的用户名和密码
 USERS = {
     'admin': 'admin123',
@@ -26,6 +190,45 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 建立新的数据库连接
+def open_db_connection():
+    """
+    建立一个新的数据库连接(不经过连接池)
+    
+    MySQL接口说明:
+    - DB_BACKEND=mysql时使用ODBC连接到MySQL数据库, DSN名称默认为'jiaoshi'(DB_DSN)
+    - 需要在系统中配置ODBC数据源
+    - DB_BACKEND=sqlite时打开SQLITE_PATH文件(WAL模式)
+    """
+    return db_backend.connect()
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+# 获取连接池
+def get_db_pool():
+    """
+    获取全局连接池, 首次调用时按app.config创建
+    """
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                pool = ConnectionPool(
+                    open_db_connection,
+                    min_size=app.config['DB_POOL_MIN_SIZE'],
+                    max_size=app.config['DB_POOL_MAX_SIZE'],
+                    timeout=app.config['DB_POOL_TIMEOUT'],
+                    max_lifetime=app.config['DB_POOL_MAX_LIFETIME'],
+                    ping_interval=app.config['DB_POOL_PING_INTERVAL']
+                )
+                try:
+                    pool.prefill()
+                except Exception as e:
+                    print(f"预热连接池时出错: {str(e)}")
+                _db_pool = pool
+    return _db_pool
+
 # 数据库连接函数
 def get_db_connection():
     """
@@ -35,12 +238,453 @@ def get_db_connection():
         conn: 数据库连接对象
     
     MySQL接口说明:
-    - 使用ODBC连接到MySQL数据库
-    - DSN名称为'jiaoshi'
-    - 需要在系统中配置ODBC数据源
+    - 请求内从连接池借出一个连接并保存在g上, 同一请求多次调用返回同一连接
+    - 路由中的conn.close()不会关闭连接, 请求结束时由teardown归还连接池
+    - 不在应用上下文中时(如初始化脚本)直接建立新连接
+    """
+    if not has_app_context():
+        return open_db_connection()
+    
+    if 'db_conn' not in g:
+        pool = get_db_pool()
+        stats = g.get('request_stats')
+        if stats is None:
+            g.db_conn = PooledConnection(pool, pool.acquire())
+        else:
+            started = time.perf_counter()
+            conn = PooledConnection(pool, pool.acquire())
+            stats.acquire += time.perf_counter() - started
+            # 统计本请求的查询数、读取行数和数据库耗时
+            g.db_conn = InstrumentedConnection(conn, stats)
+    return g.db_conn
+
+# 后台任务使用的数据库连接
+@contextmanager
+def pooled_connection():
+    """
+    在请求之外(后台线程、命令行)从连接池借出连接, 结束时归还
+    """
+    pool = get_db_pool()
+    conn = pool.acquire()
+    broken = False
+    try:
+        yield conn
+    except db_backend.Error:
+        broken = True
+        raise
+    finally:
+        pool.release(conn, broken=broken)
+
+def executemany(cursor, query, rows):
+    """
+    批量执行同一条语句, 驱动支持时启用fast_executemany(参数数组一次发送)
+    """
+    if not rows:
+        return
+    if app.config['FAST_EXECUTEMANY'] and hasattr(cursor, 'fast_executemany'):
+        cursor.fast_executemany = True
+    cursor.executemany(query, rows)
+
+# 请求结束时归还数据库连接
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        if isinstance(exception, db_backend.Error):
+            conn.mark_broken()
+        conn.release()
+
+_log_writer = None
+
+# 获取操作日志异步写入器
+def get_log_writer():
+    """
+    获取操作日志异步写入器, 未启用ASYNC_LOG_WRITER时返回None
+    """
+    global _log_writer
+    if not app.config['ASYNC_LOG_WRITER']:
+        return None
+    if _log_writer is None:
+        with _db_pool_lock:
+            if _log_writer is None:
+                writer = AsyncLogWriter(
+                    get_db_pool,
+                    queue_size=app.config['LOG_WRITER_QUEUE_SIZE'],
+                    batch_size=app.config['LOG_WRITER_BATCH_SIZE'],
+                    flush_interval=app.config['LOG_WRITER_FLUSH_INTERVAL'],
+                    on_written=lambda rows: data_versions.bump('logs')
+                )
+                # 进程退出时写入队列中剩余的日志
+                atexit.register(writer.close)
+                _log_writer = writer
+    return _log_writer
+
+def insert_operation_logs(cursor, entries):
+    """
+    同步写入操作日志, 每批一条多行INSERT
+    
+    Args:
+        entries: [(device_id, operation)] 或 [(device_id, operation, operation_time)]
+    """
+    batch_size = app.config['BULK_COMMAND_BATCH_SIZE']
+    for i in range(0, len(entries), batch_size):
+        chunk = entries[i:i + batch_size]
+        with_time = len(chunk[0]) == 3
+        columns = 'device_id, operation, operation_time' if with_time else 'device_id, operation'
+        row = '(?, ?, ?)' if with_time else '(?, ?)'
+        values = ', '.join([row] * len(chunk))
+        cursor.execute(f'INSERT INTO operation_logs ({columns}) VALUES {values}',
+                    [value for entry in chunk for value in entry])
+
+def log_operations(cursor, entries):
+    """
+    在事务中记录操作日志
+    
+    Returns:
+        pending: 启用异步写入时返回待提交的日志, 需在事务提交后调用submit_operation_logs;
+                 未启用时日志已在当前事务中写入, 返回空列表
+    """
+    if get_log_writer() is None:
+        insert_operation_logs(cursor, entries)
+        return []
+    return list(entries)
+
+def submit_operation_logs(conn, pending):
+    """
+    事务提交后将日志交给异步写入器, 队列已满时同步写入
+    """
+    if not pending:
+        # 未启用异步写入, 日志已随事务提交
+        data_versions.bump('logs')
+        return
+    rejected = get_log_writer().submit(pending)
+    if rejected:
+        cursor = conn.cursor()
+        insert_operation_logs(cursor, rejected)
+        conn.commit()
+
+# 日志总数缓存 - 键为筛选条件
+log_count_cache = TTLCache(max_size=256, ttl=app.config['LOG_COUNT_CACHE_TTL'])
+
+# 日志游标时间格式
+LOG_CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def parse_log_cursor(value):
+    """
+    解析日志游标"<operation_time>,<log_id>"
+    
+    Returns:
+        (operation_time, log_id), 格式不正确时抛出ValueError
+    """
+    operation_time, log_id = value.rsplit(',', 1)
+    return datetime.strptime(operation_time.strip(), LOG_CURSOR_TIME_FORMAT), int(log_id)
+
+def make_log_cursor(operation_time, log_id):
+    if isinstance(operation_time, datetime):
+        operation_time = operation_time.strftime(LOG_CURSOR_TIME_FORMAT)
+    return f'{operation_time},{log_id}'
+
+# 数据版本号 - 写操作提交后递增, 列表接口据此生成ETag
+data_versions = DataVersions(('classes', 'devices', 'logs'))
+# ETag中的进程标识, 不同worker的版本号互不相关
+_etag_token = f'{os.getpid():x}.{int(time.time()):x}'
+
+def conditional_listing(*collections):
+    """
+    列表接口的条件请求装饰器
+    
+    - 根据依赖的数据集合版本号生成弱ETag和Last-Modified
+    - 请求头If-None-Match与当前ETag一致时直接返回304, 不查询数据库也不序列化JSON
+    - ETag包含进程标识和ETAG_MAX_AGE时间片, 其他worker的修改最迟在ETAG_MAX_AGE秒后可见
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not app.config['CONDITIONAL_GET']:
+                return f(*args, **kwargs)
+            
+            # 先读取版本号再查询, 查询期间的修改只会让ETag偏旧, 下次请求时重新获取
+            versions, last_modified = data_versions.get(*collections)
+            etag = '-'.join([_etag_token] + [str(version) for version in versions])
+            max_age = app.config['ETAG_MAX_AGE']
+            if max_age > 0:
+                etag += f'-{int(time.time() // max_age)}'
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = int(last_modified)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# 日志查询的列和关联
+LOG_SELECT = ('SELECT l.log_id, l.device_id, d.device_name, l.operation, l.operation_time '
+              'FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id WHERE 1=1')
+
+def build_log_filters(args):
+    """
+    按请求参数device_id、operation、date生成日志筛选条件
+    
+    Returns:
+        (conditions, params): conditions为追加在WHERE 1=1之后的SQL片段
+    
+    Raises:
+        ValueError: 日期格式不正确
+    """
+    conditions = ''
+    params = []
+    device_id = args.get('device_id', '')
+    operation = args.get('operation', '')
+    date = args.get('date', '')
+    
+    if device_id:
+        conditions += ' AND l.device_id = ?'
+        params.append(device_id)
+    
+    if operation:
+        conditions += ' AND l.operation = ?'
+        params.append(operation)
+    
+    if date:
+        try:
+            day_start = datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError('日期格式不正确')
+        conditions += ' AND l.operation_time >= ? AND l.operation_time < ?'
+        params.append(day_start)
+        params.append(day_start + timedelta(days=1))
+    
+    return conditions, params
+
+# 设备和班级注册表缓存
+# - 设备/班级的写操作提交后使对应条目失效, 其他进程的修改在TTL到期后可见
+# - 只缓存存在的行, 查询不到的设备/班级每次都回源数据库
+device_cache = TTLCache(max_size=app.config['REGISTRY_MAX_SIZE'], ttl=app.config['REGISTRY_TTL'])
+class_cache = TTLCache(max_size=app.config['REGISTRY_MAX_SIZE'], ttl=app.config['REGISTRY_TTL'])
+_CLASS_NAMES_KEY = '__class_names__'
+
+def lookup_device(cursor, device_id, fresh=False):
+    """
+    按device_id获取设备行(devices表的全部列), 不存在时返回None
+    
+    Args:
+        fresh: 为True时跳过缓存直接查询数据库(写路径依赖当前状态时使用)
+    """
+    if not fresh:
+        device = device_cache.get(device_id)
+        if device is not None:
+            return device
+    
+    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
+    device = cursor.fetchone()
+    if device is None:
+        return None
+    device = tuple(device)
+    device_cache.set(device_id, device)
+    return device
+
+def lookup_class(cursor, class_id):
+    """按class_id获取班级行(classes表的全部列), 不存在时返回None"""
+    cls = class_cache.get(class_id)
+    if cls is not None:
+        return cls
+    
+    cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
+    cls = cursor.fetchone()
+    if cls is None:
+        return None
+    cls = tuple(cls)
+    class_cache.set(class_id, cls)
+    return cls
+
+def get_class_names(cursor):
+    """获取{class_id: class_name}映射, 设备列表用它补充班级名称而不再关联classes表"""
+    names = class_cache.get(_CLASS_NAMES_KEY)
+    if names is None:
+        cursor.execute('SELECT class_id, class_name FROM classes')
+        names = {row[0]: row[1] for row in cursor.fetchall()}
+        class_cache.set(_CLASS_NAMES_KEY, names)
+    return names
+
+def invalidate_devices(device_ids=None):
+    """使设备缓存失效并更新设备数据版本, device_ids为None时清空全部"""
+    data_versions.bump('devices')
+    if device_ids is None:
+        device_cache.clear()
+        return
+    for device_id in device_ids:
+        device_cache.delete(device_id)
+
+def invalidate_classes():
+    """班级的增删改很少, 直接清空班级缓存(包括班级名称映射)"""
+    data_versions.bump('classes')
+    class_cache.clear()
+
+def device_to_dict(device, class_names):
+    return {
+        'device_id': device[0],
+        'device_name': device[1],
+        'device_type': device[2],
+        'current_status': device[3],
+        'class_id': device[4],
+        'class_name': class_names.get(device[4], '') if device[4] is not None else ''
+    }
+
+# 设备变化推送(进程内, 只推送本进程提交的修改)
+event_broker = EventBroker(queue_size=app.config['EVENTS_QUEUE_SIZE'])
+
+def publish_device_status(devices, status):
+    """
+    提交后推送设备状态变化事件
+    
+    Args:
+        devices: [(device_id, class_id)]
+        status: 新状态
+    """
+    if not devices:
+        return
+    event_broker.publish('status', {
+        'status': status,
+        'devices': [{'device_id': device_id, 'class_id': class_id} for device_id, class_id in devices]
+    }, {class_id for _, class_id in devices})
+
+# 班级汇总查询 - 一次聚合查询得到每个班级的设备数量和开关状态分布
+CLASS_SUMMARY_QUERY = '''
+    SELECT c.class_id, c.class_name, c.class_room, c.description,
+           COUNT(d.device_id) AS device_count,
+           COALESCE(SUM(CASE WHEN d.current_status = 'ON' THEN 1 ELSE 0 END), 0) AS on_count,
+           COALESCE(SUM(CASE WHEN d.current_status = 'OFF' THEN 1 ELSE 0 END), 0) AS off_count
+    FROM classes c
+    LEFT JOIN devices d ON d.class_id = c.class_id
+'''
+CLASS_SUMMARY_GROUP_BY = ' GROUP BY c.class_id, c.class_name, c.class_room, c.description'
+
+# 班级汇总查询 - 直接读取统计表
+CLASS_SUMMARY_STATS_QUERY = '''
+    SELECT c.class_id, c.class_name, c.class_room, c.description,
+           COALESCE(s.device_count, 0) AS device_count,
+           COALESCE(s.on_count, 0) AS on_count,
+           COALESCE(s.off_count, 0) AS off_count
+    FROM classes c
+    LEFT JOIN class_device_stats s ON s.class_id = c.class_id
+'''
+
+def query_class_summary(cursor, class_id=None):
+    """
+    查询班级汇总信息
+    
+    MySQL接口说明:
+    - 启用CLASS_STATS_TABLE时关联class_device_stats表, 读取代价与设备数无关
+    - 否则对devices表做一次分组聚合, 不再逐个班级执行COUNT
+    """
+    if app.config['CLASS_STATS_TABLE']:
+        query = CLASS_SUMMARY_STATS_QUERY
+        group_by = ''
+    else:
+        query = CLASS_SUMMARY_QUERY
+        group_by = CLASS_SUMMARY_GROUP_BY
+    
+    params = []
+    if class_id is not None:
+        query += ' WHERE c.class_id = ?'
+        params.append(class_id)
+    cursor.execute(query + group_by, params)
+    return cursor.fetchall()
+
+def class_summary_to_dict(row):
+    return {
+        'class_id': row[0],
+        'class_name': row[1],
+        'class_room': row[2],
+        'description': row[3],
+        'device_count': int(row[4]),
+        'on_count': int(row[5]),
+        'off_count': int(row[6])
+    }
+
+def adjust_class_stats(cursor, class_id, old_status=None, new_status=None, device_delta=0):
+    """
+    增量更新班级设备统计
+    
+    MySQL接口说明:
+    - 仅在启用CLASS_STATS_TABLE时生效, 与设备写操作在同一事务中执行
+    - 设备加入班级: device_delta=1, new_status为设备状态
+    - 设备移出班级: device_delta=-1, old_status为设备状态
+    - 状态变化: old_status/new_status分别为变化前后的状态
+    """
+    on_delta = (new_status == 'ON') - (old_status == 'ON')
+    off_delta = (new_status == 'OFF') - (old_status == 'OFF')
+    apply_class_stats_delta(cursor, class_id, device_delta, on_delta, off_delta)
+
+def adjust_class_stats_bulk(cursor, devices, new_status):
+    """
+    批量状态变化后更新班级设备统计, 每个班级只执行一次更新
+    
+    Args:
+        devices: [(device_id, old_status, class_id)]
     """
-    conn = pyodbc.connect(f'DSN={DSN_NAME}')
-    return conn
+    if not app.config['CLASS_STATS_TABLE']:
+        return
+    
+    deltas = {}
+    for _, old_status, class_id in devices:
+        if not class_id:
+            continue
+        delta = deltas.setdefault(class_id, [0, 0])
+        delta[0] += (new_status == 'ON') - (old_status == 'ON')
+        delta[1] += (new_status == 'OFF') - (old_status == 'OFF')
+    
+    for class_id, (on_delta, off_delta) in deltas.items():
+        apply_class_stats_delta(cursor, class_id, 0, on_delta, off_delta)
+
+def apply_class_stats_delta(cursor, class_id, device_delta, on_delta, off_delta):
+    if not app.config['CLASS_STATS_TABLE'] or not class_id:
+        return
+    if not (device_delta or on_delta or off_delta):
+        return
+    
+    cursor.execute(db_backend.upsert_sql('class_device_stats',
+                                         ('class_id', 'device_count', 'on_count', 'off_count'), ('class_id',),
+                                         add=('device_count', 'on_count', 'off_count')),
+                   (class_id, device_delta, on_delta, off_delta))
+
+def rebuild_class_stats(cursor, class_ids=None):
+    """
+    按devices表重新计算班级设备统计
+    
+    MySQL接口说明:
+    - class_ids为None时重建全部班级, 否则只重建指定班级
+    - 用于批量改动(如分配设备)后以及首次启用统计表时
+    """
+    if class_ids is None:
+        cursor.execute('DELETE FROM class_device_stats')
+        where = 'WHERE class_id IS NOT NULL'
+        params = []
+    else:
+        class_ids = [cid for cid in set(class_ids) if cid]
+        if not class_ids:
+            return
+        placeholders = ', '.join('?' * len(class_ids))
+        cursor.execute(f'DELETE FROM class_device_stats WHERE class_id IN ({placeholders})', class_ids)
+        where = f'WHERE class_id IN ({placeholders})'
+        params = class_ids
+    
+    cursor.execute(f'''
+        INSERT INTO class_device_stats (class_id, device_count, on_count, off_count)
+        SELECT class_id,
+               COUNT(*),
+               SUM(CASE WHEN current_status = 'ON' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN current_status = 'OFF' THEN 1 ELSE 0 END)
+        FROM devices
+        {where}
+        GROUP BY class_id
+    ''', params)
 
 # 初始化数据库
 def init_db():
@@ -48,135 +692,335 @@ def init_db():
     初始化数据库表结构
     
     MySQL接口说明:
-    - 创建classes表: 存储教室信息
-    - 创建devices表: 存储设备信息
-    - 创建operation_logs表: 存储操作日志
-    - 创建data_records表: 存储设备数据记录
+    - 按版本顺序执行migrations.MIGRATIONS中尚未执行的迁移
+    - 已执行的版本记录在schema_version表中
     - 所有表使用相同的字符集(utf8mb4)和排序规则(utf8mb4_unicode_ci)
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 创建班级表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS classes (
-        class_id INT AUTO_INCREMENT PRIMARY KEY,
-        class_name VARCHAR(100) NOT NULL UNIQUE,
-        class_room VARCHAR(100),
-        description TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-    ''')
-    
-    # 创建设备表 - 确保device_id是VARCHAR(50)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS devices (
-        device_id VARCHAR(50) PRIMARY KEY,
-        device_name VARCHAR(100) NOT NULL,
-        device_type VARCHAR(50) NOT NULL,
-        current_status VARCHAR(20) DEFAULT 'OFF',
-        class_id INT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        FOREIGN KEY (class_id) REFERENCES classes (class_id) ON DELETE SET NULL
-    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-    ''')
-    
-    # 创建操作日志表 - 确保device_id也是VARCHAR(50)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS operation_logs (
-        log_id INT AUTO_INCREMENT PRIMARY KEY,
-        device_id VARCHAR(50) NOT NULL,
-        operation VARCHAR(50) NOT NULL,
-        operation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        FOREIGN KEY (device_id) REFERENCES devices (device_id) ON DELETE CASCADE
-    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci ENGINE=InnoDB
-    ''')
-    
-    # 创建数据记录表 - 确保device_id也是VARCHAR(50)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS data_records (
-        record_id INT AUTO_INCREMENT PRIMARY KEY,
-        device_id VARCHAR(50) NOT NULL,
-        data_type VARCHAR(50) NOT NULL,
-        data_value VARCHAR(100) NOT NULL,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        FOREIGN KEY (device_id) REFERENCES devices (device_id) ON DELETE CASCADE
-    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci ENGINE=InnoDB
-    ''')
+    try:
+        applied = migrate(conn, db_backend)
+        if applied:
+            print(f"已执行数据库迁移: {applied}")
+        
+        # 首次启用班级设备统计表时按devices表重建
+        if app.config['CLASS_STATS_TABLE']:
+            cursor = conn.cursor()
+            rebuild_class_stats(cursor)
+            conn.commit()
+    finally:
+        conn.close()
+
+# 命令行：初始化数据库
+@app.cli.command('init-db')
+def init_db_command():
+    """执行数据库迁移, 创建或升级表结构"""
+    try:
+        init_db()
+    except Exception as e:
+        print(f"初始化数据库时出错: {str(e)}")
+        print("请确保已正确配置'jiaoshi' ODBC数据源")
+        raise SystemExit(1)
+    print("数据库初始化完成")
+
+_first_request_lock = threading.Lock()
+_first_request_done = False
+
+# 第一个请求到来时记录启动耗时, 并按配置自动初始化数据库
+@app.before_request
+def on_first_request():
+    global _first_request_done
+    if _first_request_done:
+        return
+    with _first_request_lock:
+        if _first_request_done:
+            return
+        boot_stats['first_request_seconds'] = time.perf_counter() - _boot_started
+        if app.config['AUTO_INIT_DB']:
+            started = time.perf_counter()
+            try:
+                init_db()
+            except Exception as e:
+                print(f"初始化数据库时出错: {str(e)}")
+                print("请确保已正确配置'jiaoshi' ODBC数据源")
+            boot_stats['init_db_seconds'] = time.perf_counter() - started
+        start_background_tasks()
+        _first_request_done = True
+
+# 请求级统计
+metrics_registry = MetricsRegistry()
+query_log = None
+_query_log_lock = threading.Lock()
+
+def query_log_path():
+    """
+    慢查询日志文件路径
     
-    conn.commit()
-    conn.close()
+    滚动日志(RotatingFileHandler)不能由多个进程同时写入(各进程分别滚动会互相覆盖),
+    worker进程中在文件名后加进程号
+    """
+    path = app.config['QUERY_LOG_PATH']
+    if not path or not _worker_mode:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{os.getpid()}{ext}'
 
-# 在应用启动时初始化数据库
-try:
-    init_db()
-except Exception as e:
-    print(f"初始化数据库时出错: {str(e)}")
-    print("请确保已正确配置'jiaoshi' ODBC数据源")
-    print("尝试创建没有外键约束的表...")
+def get_query_log():
+    """获取慢查询日志, 首次调用时按app.config创建(未启用时返回None)"""
+    global query_log
+    if query_log is None and app.config['QUERY_DEBUG']:
+        with _query_log_lock:
+            if query_log is None:
+                query_log = QueryLog(slow_ms=app.config['QUERY_SLOW_MS'],
+                                     repeat_threshold=app.config['QUERY_REPEAT_THRESHOLD'],
+                                     history_size=app.config['QUERY_DEBUG_HISTORY'],
+                                     path=query_log_path(),
+                                     max_bytes=app.config['QUERY_LOG_MAX_BYTES'],
+                                     backup_count=app.config['QUERY_LOG_BACKUPS'])
+    return query_log
+
+def request_stats_enabled():
+    return app.config['SERVER_TIMING'] or app.config['METRICS_ENABLED'] or app.config['QUERY_DEBUG']
+
+@app.before_request
+def start_request_stats():
+    if request_stats_enabled():
+        g.request_stats = RequestStats()
+        if app.config['QUERY_DEBUG']:
+            g.request_stats.statements = []
+
+# 注册在压缩之前, 因此在压缩之后执行, 统计的耗时包含压缩
+@app.after_request
+def finish_request_stats(response):
+    stats = g.get('request_stats')
+    if stats is None:
+        return response
+    total = stats.elapsed()
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = stats.server_timing(total)
+    if app.config['METRICS_ENABLED'] and request.endpoint != 'get_metrics':
+        metrics_registry.observe(request.endpoint, request.method, response.status_code, stats, total,
+                                 used_db='db_conn' in g)
+    if stats.statements and get_query_log() is not None:
+        query_log.record(request.method, request.full_path.rstrip('?'), request.endpoint,
+                         response.status_code, stats.statements, total)
+    return response
+
+# 统计jsonify的序列化耗时
+_json_response = app.json.response
+
+def timed_json_response(*args, **kwargs):
+    stats = g.get('request_stats') if has_app_context() else None
+    if stats is None:
+        return _json_response(*args, **kwargs)
+    started = time.perf_counter()
+    try:
+        return _json_response(*args, **kwargs)
+    finally:
+        stats.serialize += time.perf_counter() - started
+
+app.json.response = timed_json_response
+
+# 压缩/api/*的响应(流式响应如事件推送不压缩)
+@app.after_request
+def compress_api_response(response):
+    if app.config['COMPRESS_RESPONSES'] and request.path.startswith('/api/'):
+        compress_response(response, request.accept_encodings,
+                          min_size=app.config['COMPRESS_MIN_SIZE'],
+                          gzip_level=app.config['COMPRESS_GZIP_LEVEL'],
+                          brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return response
+
+# 命令行：JSON序列化和压缩基准测试
+@app.cli.command('bench-json')
+@click.option('--devices', default=5000, help='设备列表中的设备数')
+@click.option('--logs', default=100, help='日志分页中的日志条数')
+@click.option('--repeat', default=20, help='每项测试的重复次数')
+def bench_json_command(devices, logs, repeat):
+    """对比JSON序列化实现和响应压缩的CPU耗时与字节数(不访问数据库)"""
+    from benchmarks import json_benchmark
+    
+    rows = json_benchmark(app, devices, logs, repeat)
+    encodings = [key[:-6] for key in rows[0] if key.endswith('_bytes')] if rows else []
+    header = f"{'payload':<10}{'provider':<14}{'cpu_ms':>10}{'bytes':>12}"
+    header += ''.join(f"{encoding + '_bytes':>14}{encoding + '_ms':>10}" for encoding in encodings)
+    print(header)
+    for row in rows:
+        line = f"{row['payload']:<10}{row['provider']:<14}{row['cpu_ms']:>10.3f}{row['bytes']:>12}"
+        line += ''.join(f"{row[encoding + '_bytes']:>14}{row[encoding + '_ms']:>10.3f}" for encoding in encodings)
+        print(line)
+
+# 命令行：写入接口基准测试数据
+@app.cli.command('bench-seed')
+@click.option('--classes', 'class_count', default=500, help='班级数')
+@click.option('--devices', 'device_count', default=20000, help='设备数')
+@click.option('--logs', 'log_count', default=1000000, help='操作日志条数(可设为10000000模拟生产规模)')
+@click.option('--batch-size', default=10000, help='每个事务写入的行数')
+def bench_seed_command(class_count, device_count, log_count, batch_size):
+    """
+    在本地SQLite替身数据库中写入基准测试数据
+    
+    用法: DB_BACKEND=sqlite SQLITE_PATH=bench.db flask bench-seed
+    """
+    from benchmarks import seed_database
+    
+    if db_backend.name != 'sqlite':
+        print('基准测试数据只能写入SQLite替身数据库, 请设置DB_BACKEND=sqlite和SQLITE_PATH')
+        raise SystemExit(1)
     
-    # 如果创建带外键约束的表失败，尝试创建没有外键约束的表
+    init_db()
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM devices')
+        if cursor.fetchone()[0]:
+            print(f"数据库{app.config['SQLITE_PATH']}中已有设备, 请使用新的SQLITE_PATH")
+            raise SystemExit(1)
         
-        # 创建班级表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS classes (
-            class_id INT AUTO_INCREMENT PRIMARY KEY,
-            class_name VARCHAR(100) NOT NULL UNIQUE,
-            class_room VARCHAR(100),
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        ''')
-        
-        # 创建设备表 - 没有外键约束
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_id VARCHAR(50) PRIMARY KEY,
-            device_name VARCHAR(100) NOT NULL,
-            device_type VARCHAR(50) NOT NULL,
-            current_status VARCHAR(20) DEFAULT 'OFF',
-            class_id INT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        ''')
-        
-        # 创建操作日志表 - 没有外键约束
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS operation_logs (
-            log_id INT AUTO_INCREMENT PRIMARY KEY,
-            device_id VARCHAR(50) NOT NULL,
-            operation VARCHAR(50) NOT NULL,
-            operation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        ''')
+        tables = []
         
-        # 创建数据记录表 - 没有外键约束
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS data_records (
-            record_id INT AUTO_INCREMENT PRIMARY KEY,
-            device_id VARCHAR(50) NOT NULL,
-            data_type VARCHAR(50) NOT NULL,
-            data_value VARCHAR(100) NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        ''')
+        def progress(table, written):
+            if table not in tables:
+                print('' if not tables else '\n', end='')
+                tables.append(table)
+            print(f'\r{table}: {written}', end='', flush=True)
         
+        seed_database(conn, class_count, device_count, log_count, batch_size=batch_size, progress=progress)
+        print()
+        if app.config['CLASS_STATS_TABLE']:
+            rebuild_class_stats(cursor)
         conn.commit()
+        # 更新统计信息, 让查询规划器按实际数据量选择索引
+        cursor.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    print('基准测试数据写入完成')
+
+# 命令行：接口基准测试
+@app.cli.command('bench-api')
+@click.option('--mode', type=click.Choice(['client', 'server', 'both']), default='both',
+              help='client: Flask测试客户端; server: 本机多线程WSGI服务器')
+@click.option('--requests', 'request_count', default=200, help='每个接口的请求数')
+@click.option('--concurrency', default=8, help='并发线程数')
+@click.option('--endpoint', 'endpoints', multiple=True, help='只压测指定接口(可重复), 默认全部')
+@click.option('--baseline', 'baseline_path', default=os.path.join(app.instance_path, 'bench-baseline.json'),
+              help='基线结果文件, 默认instance/bench-baseline.json')
+@click.option('--save-baseline', is_flag=True, help='把本次结果保存为基线(有出错请求时不保存)')
+@click.option('--tolerance', default=0.2, help='允许的退化比例')
+def bench_api_command(mode, request_count, concurrency, endpoints, baseline_path, save_baseline, tolerance):
+    """
+    并发请求各接口, 统计吞吐量、p50/p95/p99延迟和每个请求的查询数, 比基线退化时以非零状态退出
+    
+    需先执行flask bench-seed写入数据; 压测会修改设备状态、新建和删除班级/设备
+    """
+    from benchmarks import (ENDPOINTS, BenchContext, QueryCounter, endpoint_benchmark, compare_with_baseline,
+                            load_baseline, save_baseline as write_baseline)
+    
+    if db_backend.name != 'sqlite':
+        print('接口基准测试只能在SQLite替身数据库上运行, 请设置DB_BACKEND=sqlite和SQLITE_PATH')
+        raise SystemExit(1)
+    unknown = set(endpoints) - {name for name, _ in ENDPOINTS}
+    if unknown:
+        print(f"未知的接口: {', '.join(sorted(unknown))}")
+        raise SystemExit(1)
+    
+    # /metrics需要令牌, 未配置时本次压测使用临时令牌(由压测客户端发送)
+    if not app.config['METRICS_TOKEN'] and not app.config['METRICS_PUBLIC']:
+        app.config['METRICS_TOKEN'] = secrets.token_hex(16)
+    
+    # 按X-Bench-Request请求头统计每个请求的查询数, 压测客户端读完响应体后读取(包括流式响应中的查询)
+    counter = QueryCounter()
+    counter.install(db_backend)
+    
+    @app.before_request
+    def begin_query_count():
+        counter.begin(request.headers.get('X-Bench-Request'))
+    
+    conn = get_db_connection()
+    try:
+        ctx = BenchContext(conn.cursor())
+    finally:
+        conn.close()
+    
+    params = {'requests': request_count, 'concurrency': concurrency}
+    failed = False
+    for current in (['client', 'server'] if mode == 'both' else [mode]):
+        rows = endpoint_benchmark(app, ctx, current, request_count, concurrency, set(endpoints) or None,
+                                  counter=counter)
+        print(f'[{current}]')
+        print(f"{'endpoint':<20}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50_ms':>10}{'p95_ms':>10}"
+              f"{'p99_ms':>10}{'queries':>9}")
+        for row in rows:
+            queries = f"{row['queries']:.1f}" if row['queries'] is not None else '-'
+            print(f"{row['endpoint']:<20}{row['requests']:>9}{row['errors']:>8}{row['throughput']:>10.1f}"
+                  f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{queries:>9}")
+        
+        if save_baseline:
+            try:
+                write_baseline(baseline_path, current, rows, params)
+            except ValueError as e:
+                print(str(e))
+                failed = True
+            continue
+        baseline = load_baseline(baseline_path, current)
+        if baseline is None:
+            print(f'没有{current}模式的基线结果, 使用--save-baseline保存')
+            continue
+        regressions = compare_with_baseline(rows, baseline, tolerance)
+        for item in regressions:
+            print(f'[REGRESSION] {item}')
+        failed = failed or bool(regressions)
+    if failed:
+        raise SystemExit(1)
+
+# 命令行：生产环境服务
+@app.cli.command('serve')
+@click.option('--bind', help='监听地址, 默认SERVE_BIND')
+@click.option('--workers', type=int, help='worker进程数, 默认SERVE_WORKERS')
+@click.option('--threads', type=int, help='每个worker的线程数, 默认SERVE_THREADS')
+def serve_command(bind, workers, threads):
+    """使用gunicorn(多进程 + 多线程)启动生产环境服务, 见server.py"""
+    from server import gunicorn_options, run
+    
+    if fcntl is None:
+        print('当前平台不支持gunicorn, 请在Linux/macOS上部署')
+        raise SystemExit(1)
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print('未安装gunicorn, 请执行 pip install gunicorn')
+        raise SystemExit(1)
+    
+    options = gunicorn_options(app.config)
+    if bind:
+        options['bind'] = bind
+    if workers:
+        options['workers'] = workers
+    if threads:
+        options['threads'] = threads
+    if app.config['DB_POOL_MAX_SIZE'] < options['threads']:
+        print(f"提示: DB_POOL_MAX_SIZE({app.config['DB_POOL_MAX_SIZE']})小于每个worker的线程数"
+              f"({options['threads']}), 并发请求会等待数据库连接")
+    print(f"启动服务: {options['bind']}, {options['workers']}个worker, 每个worker {options['threads']}个线程")
+    run(app, options)
+
+# 命令行：检查高频查询的执行计划
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """对高频查询执行EXPLAIN, 未使用预期索引时以非零状态退出"""
+    conn = get_db_connection()
+    try:
+        results = explain_hot_queries(conn.cursor(), db_backend)
+    finally:
         conn.close()
-        print("成功创建没有外键约束的表")
-    except Exception as e2:
-        print(f"创建没有外键约束的表也失败: {str(e2)}")
+    
+    failed = False
+    for item in results:
+        status = 'OK' if item['ok'] else 'MISS'
+        failed = failed or not item['ok']
+        print(f"[{status}] {item['name']}: 预期索引 {item['expected']}, 实际 {item['key']} ({item['type']})")
+    if failed:
+        raise SystemExit(1)
 
 # 路由：首页
 @app.route('/')
@@ -193,34 +1037,20 @@ def logs():
 # 路由：获取所有班级
 @app.route('/api/classes', methods=['GET'])
 @login_required
+@conditional_listing('classes', 'devices')
 def get_classes():
     """
     获取所有班级信息
     
     MySQL接口说明:
-    - 查询classes表获取所有班级
-    - 对每个班级查询关联的设备数量
+    - 一次聚合查询获取所有班级及其设备数量、开关状态分布
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM classes')
-    classes = cursor.fetchall()
-    
-    result = []
-    for cls in classes:
-        # 获取班级中的设备数量
-        cursor.execute('SELECT COUNT(*) FROM devices WHERE class_id = ?', (cls[0],))
-        device_count = cursor.fetchone()[0]
-        
-        result.append({
-            'class_id': cls[0],
-            'class_name': cls[1],
-            'class_room': cls[2],
-            'description': cls[3],
-            'device_count': device_count
-        })
-    
+    classes = query_class_summary(cursor)
     conn.close()
+    
+    result = [class_summary_to_dict(cls) for cls in classes]
     return jsonify(result)
 
 # 路由：获取班级信息
@@ -231,32 +1061,17 @@ def get_class(class_id):
     获取特定班级信息
     
     MySQL接口说明:
-    - 根据class_id查询classes表
-    - 获取该班级关联的设备数量
+    - 根据class_id聚合查询班级信息及设备数量、开关状态分布
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-    cls = cursor.fetchone()
-    
-    if cls is None:
-        conn.close()
-        return jsonify({'error': '班级不存在'}), 404
-    
-    # 获取班级中的设备数量
-    cursor.execute('SELECT COUNT(*) FROM devices WHERE class_id = ?', (class_id,))
-    device_count = cursor.fetchone()[0]
+    rows = query_class_summary(cursor, class_id)
     conn.close()
     
-    result = {
-        'class_id': cls[0],
-        'class_name': cls[1],
-        'class_room': cls[2],
-        'description': cls[3],
-        'device_count': device_count
-    }
+    if not rows:
+        return jsonify({'error': '班级不存在'}), 404
     
-    return jsonify(result)
+    return jsonify(class_summary_to_dict(rows[0]))
 
 # 路由：添加班级
 @app.route('/api/classes', methods=['POST'])
@@ -291,15 +1106,16 @@ def add_class():
         conn.commit()
         
         # 获取新添加的班级ID
-        cursor.execute('SELECT LAST_INSERT_ID()')
+        cursor.execute(db_backend.last_insert_id_sql)
         class_id = cursor.fetchone()[0]
         conn.close()
+        invalidate_classes()
         
         return jsonify({'class_id': class_id, 'message': '班级添加成功'}), 201
     except Exception as e:
         conn.close()
         # 检查是否是唯一约束错误
-        if 'Duplicate entry' in str(e):
+        if db_backend.is_duplicate_error(e):
             return jsonify({'error': '班级名称已存在'}), 400
         return jsonify({'error': str(e)}), 500
 
@@ -328,8 +1144,7 @@ def update_class(class_id):
     cursor = conn.cursor()
     try:
         # 检查班级是否存在
-        cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-        cls = cursor.fetchone()
+        cls = lookup_class(cursor, class_id)
         if cls is None:
             conn.close()
             return jsonify({'error': '班级不存在'}), 404
@@ -347,12 +1162,13 @@ def update_class(class_id):
         
         conn.commit()
         conn.close()
+        invalidate_classes()
         
         return jsonify({'message': '班级更新成功'})
     except Exception as e:
         conn.close()
         # 检查是否是唯一约束错误
-        if 'Duplicate entry' in str(e):
+        if db_backend.is_duplicate_error(e):
             return jsonify({'error': '班级名称已存在'}), 400
         return jsonify({'error': str(e)}), 500
 
@@ -371,8 +1187,7 @@ def delete_class(class_id):
     cursor = conn.cursor()
     
     # 检查班级是否存在
-    cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-    cls = cursor.fetchone()
+    cls = lookup_class(cursor, class_id)
     if cls is None:
         conn.close()
         return jsonify({'error': '班级不存在'}), 404
@@ -383,8 +1198,12 @@ def delete_class(class_id):
         
         # 删除班级
         cursor.execute('DELETE FROM classes WHERE class_id = ?', (class_id,))
+        if app.config['CLASS_STATS_TABLE']:
+            cursor.execute('DELETE FROM class_device_stats WHERE class_id = ?', (class_id,))
         conn.commit()
         conn.close()
+        invalidate_classes()
+        invalidate_devices()
         
         return jsonify({'message': '班级删除成功'})
     except Exception as e:
@@ -394,60 +1213,42 @@ def delete_class(class_id):
 # 路由：获取班级的设备
 @app.route('/api/classes/<int:class_id>/devices', methods=['GET'])
 @login_required
+@conditional_listing('devices', 'classes')
 def get_class_devices(class_id):
     """
     获取班级关联的设备
     
     MySQL接口说明:
     - 根据class_id查询devices表
-    - 关联classes表获取班级名称
+    - 班级名称从注册表缓存获取, 不再关联classes表
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # 检查班级是否存在
     if class_id > 0:
-        cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-        cls = cursor.fetchone()
+        cls = lookup_class(cursor, class_id)
         if cls is None:
             conn.close()
             return jsonify({'error': '班级不存在'}), 404
         
-        cursor.execute('''
-            SELECT d.*, c.class_name 
-            FROM devices d 
-            LEFT JOIN classes c ON d.class_id = c.class_id 
-            WHERE d.class_id = ?
-        ''', (class_id,))
+        cursor.execute('SELECT * FROM devices WHERE class_id = ?', (class_id,))
         devices = cursor.fetchall()
     else:
         # 如果class_id为0或undefined，返回所有未分配班级的设备
-        cursor.execute('''
-            SELECT d.*, c.class_name 
-            FROM devices d 
-            LEFT JOIN classes c ON d.class_id = c.class_id
-            WHERE d.class_id IS NULL
-        ''')
+        cursor.execute('SELECT * FROM devices WHERE class_id IS NULL')
         devices = cursor.fetchall()
     
+    class_names = get_class_names(cursor)
     conn.close()
     
-    result = []
-    for device in devices:
-        result.append({
-            'device_id': device[0],
-            'device_name': device[1],
-            'device_type': device[2],
-            'current_status': device[3],
-            'class_id': device[4],
-            'class_name': device[6] if len(device) > 6 and device[6] else ''
-        })
-    
+    result = [device_to_dict(device, class_names) for device in devices]
     return jsonify(result)
 
 # 路由：获取未分配班级的设备
 @app.route('/api/classes/undefined/devices', methods=['GET'])
 @login_required
+@conditional_listing('devices')
 def get_unassigned_devices():
     """
     获取未分配班级的设备
@@ -458,61 +1259,111 @@ def get_unassigned_devices():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT d.*, c.class_name 
-        FROM devices d 
-        LEFT JOIN classes c ON d.class_id = c.class_id
-        WHERE d.class_id IS NULL
-    ''')
+    cursor.execute('SELECT * FROM devices WHERE class_id IS NULL')
     devices = cursor.fetchall()
     
     conn.close()
     
-    result = []
-    for device in devices:
-        result.append({
-            'device_id': device[0],
-            'device_name': device[1],
-            'device_type': device[2],
-            'current_status': device[3],
-            'class_id': device[4],
-            'class_name': device[6] if len(device) > 6 and device[6] else ''
-        })
-    
+    result = [device_to_dict(device, {}) for device in devices]
     return jsonify(result)
 
+# 设备列表可选择的字段(class_name不是devices表的列, 由班级名称缓存补充)
+DEVICE_COLUMNS = ('device_id', 'device_name', 'device_type', 'current_status', 'class_id', 'created_at', 'update_time')
+DEVICE_DEFAULT_FIELDS = ('device_id', 'device_name', 'device_type', 'current_status', 'class_id', 'class_name')
+
+def parse_list_arg(name):
+    """解析逗号分隔的查询参数, 未指定时返回空列表"""
+    value = request.args.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def escape_like(value):
+    """转义LIKE通配符, 配合ESCAPE '!'使用"""
+    return value.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+def rows_to_dicts(cursor, rows):
+    """按cursor.description中的列名把查询结果转换为字典"""
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
 # 路由：获取所有设备
 @app.route('/api/devices', methods=['GET'])
 @login_required
+@conditional_listing('devices', 'classes')
 def get_devices():
     """
-    获取所有设备
+    获取设备列表
+    
+    请求参数(均可选, 同时指定时取交集):
+    - fields: 返回的字段(逗号分隔), 可选devices表的列和class_name, 默认为
+      device_id, device_name, device_type, current_status, class_id, class_name
+    - status: 设备状态, 如ON或ON,OFF
+    - type: 设备类型(逗号分隔)
+    - class_id: 班级ID(逗号分隔), 0表示未分配班级
+    - q: 按设备名称或设备ID模糊搜索
     
     MySQL接口说明:
-    - 查询devices表获取所有设备
-    - 关联classes表获取班级名称
+    - 只查询需要的列, 筛选条件放在WHERE中由数据库过滤
+    - 按cursor.description中的列名组装结果
+    - 班级名称从注册表缓存获取, 不再关联classes表
     """
+    fields = parse_list_arg('fields') or list(DEVICE_DEFAULT_FIELDS)
+    unknown = [field for field in fields if field not in DEVICE_COLUMNS and field != 'class_name']
+    if unknown:
+        return jsonify({'error': f"不支持的字段: {', '.join(unknown)}"}), 400
+    fields = list(dict.fromkeys(fields))
+    
+    # class_name由class_id查缓存得到
+    columns = [field for field in fields if field != 'class_name']
+    if 'class_name' in fields and 'class_id' not in columns:
+        columns.append('class_id')
+    
+    conditions = []
+    params = []
+    statuses = parse_list_arg('status')
+    if statuses:
+        conditions.append(f"current_status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    device_types = parse_list_arg('type')
+    if device_types:
+        conditions.append(f"device_type IN ({', '.join('?' * len(device_types))})")
+        params.extend(device_types)
+    class_ids = parse_list_arg('class_id')
+    if class_ids:
+        try:
+            class_ids = [int(class_id) for class_id in class_ids]
+        except ValueError:
+            return jsonify({'error': '班级ID格式不正确'}), 400
+        assigned = [class_id for class_id in class_ids if class_id > 0]
+        class_conditions = []
+        if assigned:
+            class_conditions.append(f"class_id IN ({', '.join('?' * len(assigned))})")
+            params.extend(assigned)
+        if len(assigned) < len(class_ids):
+            class_conditions.append('class_id IS NULL')
+        conditions.append('(' + ' OR '.join(class_conditions) + ')')
+    keyword = request.args.get('q', '').strip()
+    if keyword:
+        conditions.append("(device_name LIKE ? ESCAPE '!' OR device_id LIKE ? ESCAPE '!')")
+        pattern = f'%{escape_like(keyword)}%'
+        params.extend([pattern, pattern])
+    
+    query = f"SELECT {', '.join(columns)} FROM devices"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT d.*, c.class_name 
-        FROM devices d 
-        LEFT JOIN classes c ON d.class_id = c.class_id
-    ''')
-    devices = cursor.fetchall()
+    cursor.execute(query, params)
+    devices = rows_to_dicts(cursor, cursor.fetchall())
+    class_names = get_class_names(cursor) if 'class_name' in fields else {}
     conn.close()
     
     result = []
     for device in devices:
-        result.append({
-            'device_id': device[0],
-            'device_name': device[1],
-            'device_type': device[2],
-            'current_status': device[3],
-            'class_id': device[4],
-            'class_name': device[6] if len(device) > 6 and device[6] else ''
-        })
-    
+        if 'class_name' in fields:
+            class_id = device['class_id']
+            device['class_name'] = class_names.get(class_id, '') if class_id is not None else ''
+        result.append({field: device[field] for field in fields})
     return jsonify(result)
 
 # 路由：获取设备信息
@@ -523,35 +1374,21 @@ def get_device(device_id):
     获取特定设备信息
     
     MySQL接口说明:
-    - 根据device_id查询devices表
-    - 关联classes表获取班级名称
+    - 根据device_id查询devices表(优先读取注册表缓存)
+    - 班级名称从注册表缓存获取
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT d.*, c.class_name 
-        FROM devices d 
-        LEFT JOIN classes c ON d.class_id = c.class_id 
-        WHERE d.device_id = ?
-    ''', (device_id,))
-    device = cursor.fetchone()
+    device = lookup_device(cursor, device_id)
     
     if device is None:
         conn.close()
         return jsonify({'error': '设备不存在'}), 404
     
+    class_names = get_class_names(cursor)
     conn.close()
     
-    result = {
-        'device_id': device[0],
-        'device_name': device[1],
-        'device_type': device[2],
-        'current_status': device[3],
-        'class_id': device[4],
-        'class_name': device[6] if len(device) > 6 and device[6] else ''
-    }
-    
-    return jsonify(result)
+    return jsonify(device_to_dict(device, class_names))
 
 # 路由：添加设备
 @app.route('/api/devices', methods=['POST'])
@@ -588,8 +1425,7 @@ def add_device():
         
         # 如果指定了班级ID，检查班级是否存在
         if class_id:
-            cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-            cls = cursor.fetchone()
+            cls = lookup_class(cursor, class_id)
             if cls is None:
                 conn.close()
                 return jsonify({'error': '指定的班级不存在'}), 400
@@ -602,8 +1438,10 @@ def add_device():
             INSERT INTO devices (device_id, device_name, device_type, current_status, class_id, update_time) 
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (device_id, device_name, device_type, current_status, class_id, current_time))
+        adjust_class_stats(cursor, class_id, new_status=current_status, device_delta=1)
         conn.commit()
         conn.close()
+        invalidate_devices([device_id])
         
         return jsonify({'message': '设备添加成功'}), 201
     except Exception as e:
@@ -636,8 +1474,7 @@ def update_device(device_id):
     cursor = conn.cursor()
     try:
         # 检查设备是否存在
-        cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-        device = cursor.fetchone()
+        device = lookup_device(cursor, device_id, fresh=True)
         if device is None:
             conn.close()
             return jsonify({'error': '设备不存在'}), 404
@@ -652,8 +1489,7 @@ def update_device(device_id):
                     class_id = int(class_id)
                     # 如果class_id > 0，检查班级是否存在
                     if class_id > 0:
-                        cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-                        cls = cursor.fetchone()
+                        cls = lookup_class(cursor, class_id)
                         if cls is None:
                             conn.close()
                             return jsonify({'error': '指定的班级不存在'}), 400
@@ -675,8 +1511,27 @@ def update_device(device_id):
             cursor.execute('UPDATE devices SET class_id = ? WHERE device_id = ?',
                         (class_id, device_id))
         
+        # 更新班级设备统计
+        old_class_id, old_status = device[4], device[3]
+        new_class_id = class_id if class_id is not None else old_class_id
+        new_status = current_status or old_status
+        if new_class_id != old_class_id:
+            adjust_class_stats(cursor, old_class_id, old_status=old_status, device_delta=-1)
+            adjust_class_stats(cursor, new_class_id, new_status=new_status, device_delta=1)
+        else:
+            adjust_class_stats(cursor, old_class_id, old_status, new_status)
+        
         conn.commit()
         conn.close()
+        invalidate_devices([device_id])
+        event_broker.publish('device', {
+            'device_id': device_id,
+            'device_name': device_name or device[1],
+            'device_type': device_type or device[2],
+            'current_status': new_status,
+            'class_id': new_class_id,
+            'previous_class_id': old_class_id
+        }, {old_class_id, new_class_id})
         
         return jsonify({'message': '设备更新成功'})
     except Exception as e:
@@ -698,8 +1553,7 @@ def delete_device(device_id):
     cursor = conn.cursor()
     
     # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
+    device = lookup_device(cursor, device_id, fresh=True)
     if device is None:
         conn.close()
         return jsonify({'error': '设备不存在'}), 404
@@ -713,51 +1567,159 @@ def delete_device(device_id):
         
         # 删除设备
         cursor.execute('DELETE FROM devices WHERE device_id = ?', (device_id,))
+        adjust_class_stats(cursor, device[4], old_status=device[3], device_delta=-1)
         conn.commit()
         conn.close()
+        invalidate_devices([device_id])
+        data_versions.bump('logs')
         
         return jsonify({'message': '设备删除成功'})
     except Exception as e:
         conn.close()
         return jsonify({'error': str(e)}), 500
 
-# 路由：连接设备
-@app.route('/api/devices/<device_id>/connect', methods=['POST'])
-@login_required
-def connect_device(device_id):
+# 设备控制命令: 命令 -> (操作日志中的操作名称, 目标状态, 成功提示)
+DEVICE_COMMANDS = {
+    'connect': ('连接设备', 'ON', '设备连接成功'),
+    'disconnect': ('断开设备', 'OFF', '设备断开成功'),
+    'turn-on': ('开启设备', 'ON', '设备开启成功'),
+    'turn-off': ('关闭设备', 'OFF', '设备关闭成功')
+}
+
+# 设备命令下发
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
     """
-    连接设备
+    获取命令调度器, 未配置DEVICE_TRANSPORT时返回None(命令直接更新数据库)
+    """
+    global _dispatcher
+    if not app.config['DEVICE_TRANSPORT']:
+        return None
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                dispatcher = CommandDispatcher(
+                    create_transport(app.config),
+                    on_ack=acknowledge_device_command,
+                    on_failed=report_failed_command,
+                    class_concurrency=app.config['DISPATCH_CLASS_CONCURRENCY'],
+                    workers=app.config['DISPATCH_WORKERS'],
+                    max_attempts=app.config['DISPATCH_MAX_ATTEMPTS'],
+                    backoff=app.config['DISPATCH_BACKOFF'],
+                    backoff_max=app.config['DISPATCH_BACKOFF_MAX']
+                )
+                # 进程退出时等待已提交的命令下发完成
+                atexit.register(dispatcher.close)
+                _dispatcher = dispatcher
+    return _dispatcher
+
+def acknowledge_device_command(command):
+    """
+    设备确认命令后调用(下发线程中)
     
     MySQL接口说明:
+    - 读取设备当前状态(不使用缓存), 下发期间设备已删除时忽略
+    - 记录操作日志到operation_logs表, 更新devices表中设备状态
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        device = lookup_device(cursor, command.device_id, fresh=True)
+        if device is None:
+            return
+        apply_device_command(conn, cursor, device, command.command)
+
+def report_failed_command(command, error):
+    """命令放弃重试后推送失败事件, 设备状态和操作日志保持不变"""
+    event_broker.publish('command_failed', {
+        'device_id': command.device_id,
+        'command': command.command,
+        'attempts': command.attempts,
+        'error': str(error)
+    }, {command.class_id})
+
+# 单个设备执行控制命令
+def run_device_command(conn, device_id, command):
+    """
+    对单个设备执行控制命令, 不依赖请求上下文
+    
+    Args:
+        conn: 数据库连接, 由调用方归还
+    
+    Returns:
+        (payload, status_code): 配置了DEVICE_TRANSPORT时命令交给调度器下发, 返回202,
+        设备确认后才更新状态和记录日志
+    
+    MySQL接口说明:
+    - 检查设备是否存在
     - 记录操作日志到operation_logs表
     - 更新devices表中设备状态
     """
-    conn = get_db_connection()
     cursor = conn.cursor()
+    dispatcher = get_dispatcher()
     
-    # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
+    # 检查设备是否存在(启用班级统计表时需要读取当前状态, 不使用缓存)
+    device = lookup_device(cursor, device_id, fresh=app.config['CLASS_STATS_TABLE'] and dispatcher is None)
     if device is None:
-        conn.close()
-        return jsonify({'error': '设备不存在'}), 404
+        return {'error': '设备不存在'}, 404
+    
+    if dispatcher is not None:
+        try:
+            result = dispatcher.submit(device_id, device[4], command, DEVICE_COMMANDS[command][1])
+        except DispatcherClosedError:
+            return {'error': '服务器繁忙，请稍后重试'}, 503
+        return {'message': '命令已提交, 等待设备确认', 'result': result}, 202
     
     try:
-        # 记录操作日志 - 使用正确的列名
-        cursor.execute('INSERT INTO operation_logs (device_id, operation) VALUES (?, ?)',
-                    (device_id, '连接设备'))
-        
-        # 更新设备状态
-        cursor.execute('UPDATE devices SET current_status = ? WHERE device_id = ?',
-                    ('ON', device_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'message': '设备连接成功'})
+        return {'message': apply_device_command(conn, cursor, device, command)}, 200
     except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+def apply_device_command(conn, cursor, device, command):
+    """
+    命令生效后更新设备状态并记录操作日志, 提交后推送状态变化
+    
+    Args:
+        device: devices表的设备行(启用CLASS_STATS_TABLE时须为数据库中的当前状态)
+    
+    Returns:
+        message: 命令的成功提示
+    """
+    operation, status, message = DEVICE_COMMANDS[command]
+    device_id = device[0]
+    
+    # 记录操作日志 - 使用正确的列名
+    pending_logs = log_operations(cursor, [(device_id, operation)])
+    
+    # 更新设备状态
+    cursor.execute('UPDATE devices SET current_status = ? WHERE device_id = ?',
+                (status, device_id))
+    adjust_class_stats(cursor, device[4], device[3], status)
+    
+    conn.commit()
+    invalidate_devices([device_id])
+    submit_operation_logs(conn, pending_logs)
+    publish_device_status([(device_id, device[4])], status)
+    return message
+
+def execute_device_command(device_id, command):
+    """在请求中对单个设备执行控制命令, 使用请求的数据库连接"""
+    payload, status_code = run_device_command(get_db_connection(), device_id, command)
+    return jsonify(payload), status_code
+
+# 路由：连接设备
+@app.route('/api/devices/<device_id>/connect', methods=['POST'])
+@login_required
+def connect_device(device_id):
+    """
+    连接设备
+    
+    MySQL接口说明:
+    - 记录操作日志到operation_logs表
+    - 更新devices表中设备状态
+    """
+    return execute_device_command(device_id, 'connect')
 
 # 路由：断开设备
 @app.route('/api/devices/<device_id>/disconnect', methods=['POST'])
@@ -770,32 +1732,7 @@ def disconnect_device(device_id):
     - 记录操作日志到operation_logs表
     - 更新devices表中设备状态
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
-    if device is None:
-        conn.close()
-        return jsonify({'error': '设备不存在'}), 404
-    
-    try:
-        # 记录操作日志 - 使用正确的列名
-        cursor.execute('INSERT INTO operation_logs (device_id, operation) VALUES (?, ?)',
-                    (device_id, '断开设备'))
-        
-        # 更新设备状态
-        cursor.execute('UPDATE devices SET current_status = ? WHERE device_id = ?',
-                    ('OFF', device_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'message': '设备断开成功'})
-    except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
+    return execute_device_command(device_id, 'disconnect')
 
 # 路由：开启设备
 @app.route('/api/devices/<device_id>/turn-on', methods=['POST'])
@@ -808,35 +1745,7 @@ def turn_on_device(device_id):
     - 记录操作日志到operation_logs表
     - 更新devices表中设备状态
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
-    if device is None:
-        conn.close()
-        return jsonify({'error': '设备不存在'}), 404
-    
-    try:
-        # 获取当前时间
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 记录操作日志 - 使用正确的列名
-        cursor.execute('INSERT INTO operation_logs (device_id, operation) VALUES (?, ?)',
-                    (device_id, '开启设备'))
-        
-        # 更新设备状态
-        cursor.execute('UPDATE devices SET current_status = ? WHERE device_id = ?',
-                    ('ON', device_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'message': '设备开启成功'})
-    except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
+    return execute_device_command(device_id, 'turn-on')
 
 # 路由：关闭设备
 @app.route('/api/devices/<device_id>/turn-off', methods=['POST'])
@@ -849,32 +1758,433 @@ def turn_off_device(device_id):
     - 记录操作日志到operation_logs表
     - 更新devices表中设备状态
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    return execute_device_command(device_id, 'turn-off')
+
+# 路由：批量控制设备
+@app.route('/api/devices/bulk-command', methods=['POST'])
+@login_required
+def bulk_device_command():
+    """
+    批量控制设备
     
-    # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
-    if device is None:
-        conn.close()
-        return jsonify({'error': '设备不存在'}), 404
+    请求参数:
+    - command: connect / disconnect / turn-on / turn-off
+    - device_ids: 设备ID列表
+    - class_id: 班级ID, 0表示未分配班级的设备
+    - device_type: 设备类型
+    以上筛选条件至少指定一个, 同时指定时取交集
+    
+    device_ids中不存在的设备结果为not_found, 存在但不符合class_id/device_type的设备结果为filtered(不执行命令)
+    
+    MySQL接口说明:
+    - 按批次(BULK_COMMAND_BATCH_SIZE)对设备执行一条UPDATE ... WHERE device_id IN (...)
+    - 每批的操作日志用一条多行INSERT写入operation_logs表(启用异步写入时提交后入队)
+    - 所有批次在同一个事务中提交, 失败时整体回滚
+    - 配置了DEVICE_TRANSPORT时只查询目标设备, 命令交给调度器按教室限流下发(返回202),
+      设备确认后逐个更新状态和记录日志
+    """
+    data = request.json
+    
+    if not data or data.get('command') not in DEVICE_COMMANDS:
+        return jsonify({'error': '命令只能为connect、disconnect、turn-on或turn-off'}), 400
+    
+    command = data['command']
+    device_ids = data.get('device_ids')
+    class_id = data.get('class_id')
+    device_type = data.get('device_type')
     
+    if device_ids is None and class_id is None and not device_type:
+        return jsonify({'error': '请指定设备ID列表、班级ID或设备类型'}), 400
+    if device_ids is not None and not isinstance(device_ids, list):
+        return jsonify({'error': '设备ID列表格式不正确'}), 400
+    if class_id is not None:
+        try:
+            class_id = int(class_id)
+        except (ValueError, TypeError):
+            return jsonify({'error': '班级ID格式不正确'}), 400
+    
+    operation, status, _ = DEVICE_COMMANDS[command]
+    batch_size = app.config['BULK_COMMAND_BATCH_SIZE']
+    dispatcher = get_dispatcher()
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
     try:
-        # 记录操作日志 - 使用正确的列名
-        cursor.execute('INSERT INTO operation_logs (device_id, operation) VALUES (?, ?)',
-                    (device_id, '关闭设备'))
+        # 查询目标设备
+        query = 'SELECT device_id, current_status, class_id FROM devices WHERE 1=1'
+        params = []
+        if class_id is not None:
+            if class_id > 0:
+                query += ' AND class_id = ?'
+                params.append(class_id)
+            else:
+                query += ' AND class_id IS NULL'
+        if device_type:
+            query += ' AND device_type = ?'
+            params.append(device_type)
         
-        # 更新设备状态
-        cursor.execute('UPDATE devices SET current_status = ? WHERE device_id = ?',
-                    ('OFF', device_id))
+        if device_ids is not None:
+            device_ids = list(dict.fromkeys(str(device_id) for device_id in device_ids))
+            devices = []
+            for i in range(0, len(device_ids), batch_size):
+                chunk = device_ids[i:i + batch_size]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(query + f' AND device_id IN ({placeholders})', params + chunk)
+                devices.extend(cursor.fetchall())
+        else:
+            cursor.execute(query, params)
+            devices = cursor.fetchall()
+        devices = [(device[0], device[1], device[2]) for device in devices]
         
-        conn.commit()
-        conn.close()
+        # 同时指定了筛选条件时, 区分不存在的设备和被筛选条件排除的设备
+        missing = []
+        filtered = set()
+        if device_ids is not None:
+            found = {device[0] for device in devices}
+            missing = [device_id for device_id in device_ids if device_id not in found]
+            if missing and (class_id is not None or device_type):
+                for i in range(0, len(missing), batch_size):
+                    chunk = missing[i:i + batch_size]
+                    placeholders = ', '.join('?' * len(chunk))
+                    cursor.execute(f'SELECT device_id FROM devices WHERE device_id IN ({placeholders})', chunk)
+                    filtered.update(row[0] for row in cursor.fetchall())
         
-        return jsonify({'message': '设备关闭成功'})
+        if dispatcher is not None:
+            # 交给调度器下发, 不在本事务中修改
+            conn.close()
+            submitted = [dispatcher.submit(device[0], device[2], command, status) for device in devices]
+        else:
+            # 分批更新状态
+            for i in range(0, len(devices), batch_size):
+                chunk = [device[0] for device in devices[i:i + batch_size]]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'UPDATE devices SET current_status = ? WHERE device_id IN ({placeholders})',
+                            [status] + chunk)
+            
+            # 写入操作日志(每批一条多行INSERT)
+            pending_logs = log_operations(cursor, [(device[0], operation) for device in devices])
+            
+            adjust_class_stats_bulk(cursor, devices, status)
+            conn.commit()
+            invalidate_devices([device[0] for device in devices])
+            submit_operation_logs(conn, pending_logs)
+            conn.close()
+            publish_device_status([(device[0], device[2]) for device in devices], status)
+    except DispatcherClosedError:
+        return jsonify({'error': '服务器繁忙，请稍后重试'}), 503
     except Exception as e:
+        conn.rollback()
         conn.close()
         return jsonify({'error': str(e)}), 500
+    
+    # 构建每个设备的执行结果
+    if dispatcher is not None:
+        # queued / coalesced(取代了该设备尚未下发的命令)
+        results = [{
+            'device_id': device_id,
+            'result': result,
+            'previous_status': old_status
+        } for (device_id, old_status, _), result in zip(devices, submitted)]
+    else:
+        results = [{
+            'device_id': device_id,
+            'result': 'ok',
+            'previous_status': old_status,
+            'current_status': status
+        } for device_id, old_status, _ in devices]
+    
+    results.extend({'device_id': device_id, 'result': 'filtered' if device_id in filtered else 'not_found'}
+                   for device_id in missing)
+    
+    if dispatcher is not None:
+        return jsonify({
+            'command': command,
+            'updated': 0,
+            'queued': len(devices),
+            'filtered': len(filtered),
+            'not_found': len(missing) - len(filtered),
+            'results': results
+        }), 202
+    
+    return jsonify({
+        'command': command,
+        'updated': len(devices),
+        'filtered': len(filtered),
+        'not_found': len(missing) - len(filtered),
+        'results': results
+    })
+
+# 模拟设备数据
+def simulate_device_data(device_type, now):
+    """
+    根据设备类型生成一次模拟读数
+    
+    Args:
+        device_type: 设备类型
+        now: 采样时间, 同一次采样的各项读数使用同一个时间
+    """
+    if '灯' in device_type or '照明' in device_type:
+        return {
+            '状态': 'ON',
+            '亮度': f"{now.second % 100}%",
+            '功率': f"{10 + now.second % 40}W"
+        }
+    elif '空调' in device_type or '温控' in device_type:
+        return {
+            '状态': 'ON',
+            '温度': f"{16 + now.second % 14}°C",
+            '模式': '制冷',
+            '风速': '中速'
+        }
+    elif '投影' in device_type or '显示' in device_type:
+        return {
+            '状态': 'ON',
+            '信号源': 'HDMI',
+            '亮度': f"{now.second % 100}%",
+            '对比度': f"{now.second % 100}%"
+        }
+    else:
+        return {
+            '状态': 'ON',
+            '运行时间': f"{1 + now.hour % 24}小时"
+        }
+
+# 记录设备数据
+def record_device_data(cursor, samples):
+    """
+    批量写入设备读数
+    
+    Args:
+        samples: [(device_id, data, timestamp)], data为simulate_device_data的返回值
+    
+    MySQL接口说明:
+    - 所有读数用一次executemany写入data_records表
+    - timestamp和update_time都使用采样时间
+    - 可解析为数值的读数同时写入device_readings表(数值+指标代码)
+    """
+    rows = []
+    for device_id, data, timestamp in samples:
+        for key, value in data.items():
+            rows.append((device_id, key, value, timestamp, timestamp))
+    
+    executemany(cursor, '''
+        INSERT INTO data_records (device_id, data_type, data_value, timestamp, update_time)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    
+    executemany(cursor,
+                db_backend.upsert_sql('device_readings', ('device_id', 'metric_code', 'ts', 'value'),
+                                      ('device_id', 'metric_code', 'ts'), replace=('value',)),
+                build_reading_rows(samples))
+
+# 后台汇总: 更新分钟和小时汇总
+def refresh_rollups():
+    """
+    从上次汇总到的时间开始重新计算各粒度汇总
+    
+    MySQL接口说明:
+    - rollup_state记录每个粒度已完成的时间, 当前未结束的桶在下一轮重新计算
+    - 首次运行时回补最近一天的读数
+    
+    Returns:
+        refreshed: {粒度: 本轮汇总的起始时间}
+    """
+    now = datetime.now().replace(microsecond=0)
+    refreshed = {}
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        for resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute('SELECT computed_until FROM rollup_state WHERE resolution = ?', (resolution,))
+            row = cursor.fetchone()
+            start = floor_time(row[0] if row else now - timedelta(days=1), resolution)
+            current_bucket = floor_time(now, resolution)
+            
+            refresh_rollup(cursor, db_backend, resolution, start, current_bucket + timedelta(seconds=resolution))
+            
+            if row:
+                cursor.execute('UPDATE rollup_state SET computed_until = ? WHERE resolution = ?',
+                            (current_bucket, resolution))
+            else:
+                cursor.execute('INSERT INTO rollup_state (resolution, computed_until) VALUES (?, ?)',
+                            (resolution, current_bucket))
+            conn.commit()
+            refreshed[resolution] = start.strftime('%Y-%m-%d %H:%M:%S')
+    return refreshed
+
+# 后台采样: 为所有开启状态的设备记录一次读数
+def sample_devices():
+    """
+    为所有开启状态的设备生成并记录读数
+    
+    Returns:
+        sampled: 本次采样的设备数
+    """
+    batch_size = app.config['BULK_COMMAND_BATCH_SIZE']
+    sampled = 0
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT device_id, device_type FROM devices WHERE current_status = 'ON'")
+        devices = cursor.fetchall()
+        
+        now = datetime.now().replace(microsecond=0)
+        for i in range(0, len(devices), batch_size):
+            chunk = devices[i:i + batch_size]
+            record_device_data(cursor, [(device[0], simulate_device_data(device[1], now), now) for device in chunk])
+            conn.commit()
+            sampled += len(chunk)
+    return sampled
+
+# 分批清理引擎: 保留策略清理和清空日志共用
+purger = ChunkedPurger(pooled_connection, db_backend,
+                       chunk_size=app.config['PURGE_CHUNK_SIZE'],
+                       pause=app.config['PURGE_PAUSE'])
+
+# 按保留策略清理过期数据
+def run_retention():
+    """
+    按RETENTION_*配置分批删除过期的日志、原始读数和分钟汇总
+    
+    Returns:
+        deleted: {表名: 删除行数}, 已有清理任务运行时返回None
+    """
+    deleted = purger.run('retention', build_retention_policies(app.config))
+    if deleted and deleted.get('operation_logs'):
+        log_count_cache.clear()
+        data_versions.bump('logs')
+    return deleted
+
+def start_purge_job(job, policies):
+    """
+    在后台线程中执行清理任务
+    
+    Returns:
+        started: 已有清理任务运行时返回False
+    """
+    def on_done():
+        log_count_cache.clear()
+        data_versions.bump('logs')
+    
+    return purger.try_start(job, policies, on_done=on_done)
+
+# 后台任务, 在第一个请求到来时启动(导入模块时不启动线程)
+background_tasks = {}
+
+def start_background_tasks():
+    # 多进程部署时后台任务只在一个worker中运行, 其他worker定期重试, 该worker退出后接手
+    if _worker_mode and not claim_background_lock():
+        if 'background-election' not in background_tasks:
+            background_tasks['background-election'] = PeriodicTask(
+                'background-election', app.config['BACKGROUND_ELECTION_INTERVAL'], start_background_tasks)
+        background_tasks['background-election'].start()
+        return
+    
+    if app.config['DEVICE_DATA_RECORD_MODE'] == 'sampler' and 'device-sampler' not in background_tasks:
+        background_tasks['device-sampler'] = PeriodicTask(
+            'device-sampler', app.config['DEVICE_SAMPLER_INTERVAL'], sample_devices)
+    if app.config['ROLLUP_INTERVAL'] > 0 and 'reading-rollups' not in background_tasks:
+        background_tasks['reading-rollups'] = PeriodicTask(
+            'reading-rollups', app.config['ROLLUP_INTERVAL'], refresh_rollups)
+    if app.config['RETENTION_INTERVAL'] > 0 and 'retention' not in background_tasks:
+        background_tasks['retention'] = PeriodicTask(
+            'retention', app.config['RETENTION_INTERVAL'], run_retention)
+    
+    for task in background_tasks.values():
+        task.start()
+
+def stop_background_tasks():
+    purger.cancel()
+    for task in background_tasks.values():
+        task.stop()
+
+atexit.register(stop_background_tasks)
+
+# 多进程部署时每个worker的资源生命周期(见server.py)
+_worker_mode = False
+_background_lock_file = None
+
+def claim_background_lock():
+    """
+    尝试获取后台任务文件锁(非阻塞), 持有锁的worker运行后台任务
+    
+    锁在进程退出时由操作系统释放; 不支持文件锁的平台(Windows)总是返回True
+    """
+    global _background_lock_file
+    if _background_lock_file is not None:
+        return True
+    if fcntl is None:
+        return True
+    lock_file = open(app.config['BACKGROUND_LOCK_PATH'], 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _background_lock_file = lock_file
+    return True
+
+def init_worker():
+    """
+    fork出worker进程后调用, 重新创建进程内资源
+    
+    - 主进程中创建的连接池/连接不能在子进程中使用, 也不能在子进程中关闭(会关闭与主进程共享的socket), 直接丢弃
+    - 锁可能在fork时处于持有状态, 全部重新创建
+    - 缓存、事件订阅、指标、慢查询记录、命令调度器和后台任务按进程重新创建
+    - ETag中的进程标识重新生成, 各worker的数据版本号互不相关
+    """
+    global _worker_mode, _db_pool, _db_pool_lock, _log_writer, query_log, _query_log_lock
+    global _first_request_lock, _first_request_done, _etag_token, _background_lock_file
+    global _dispatcher, _dispatcher_lock
+    global data_versions, device_cache, class_cache, log_count_cache, event_broker, metrics_registry, purger
+    
+    _worker_mode = True
+    _db_pool = None
+    _db_pool_lock = threading.Lock()
+    _log_writer = None
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+    query_log = None
+    _query_log_lock = threading.Lock()
+    _first_request_lock = threading.Lock()
+    _first_request_done = False
+    _background_lock_file = None
+    _etag_token = f'{os.getpid():x}.{int(time.time()):x}'
+    
+    data_versions = DataVersions(('classes', 'devices', 'logs'))
+    device_cache = TTLCache(max_size=app.config['REGISTRY_MAX_SIZE'], ttl=app.config['REGISTRY_TTL'])
+    class_cache = TTLCache(max_size=app.config['REGISTRY_MAX_SIZE'], ttl=app.config['REGISTRY_TTL'])
+    log_count_cache = TTLCache(max_size=256, ttl=app.config['LOG_COUNT_CACHE_TTL'])
+    event_broker = EventBroker(queue_size=app.config['EVENTS_QUEUE_SIZE'])
+    metrics_registry = MetricsRegistry()
+    purger = ChunkedPurger(pooled_connection, db_backend,
+                           chunk_size=app.config['PURGE_CHUNK_SIZE'],
+                           pause=app.config['PURGE_PAUSE'])
+    background_tasks.clear()
+    boot_stats['pid'] = os.getpid()
+
+def begin_drain():
+    """
+    worker开始平滑退出(停止或重启)时调用
+    
+    - 结束事件推送流, 否则长连接会让worker一直等到SERVE_GRACEFUL_TIMEOUT; 客户端会自动重连到其他worker
+    - 停止后台任务, 由其他worker接手
+    - 进行中的普通请求照常完成
+    """
+    event_broker.close()
+    stop_background_tasks()
+
+def shutdown_worker():
+    """worker退出前调用: 下发已提交的设备命令, 写入队列中剩余的日志, 关闭连接池, 释放后台任务锁"""
+    global _background_lock_file
+    stop_background_tasks()
+    if _dispatcher is not None:
+        _dispatcher.close()
+    if _log_writer is not None:
+        _log_writer.close()
+    if _db_pool is not None:
+        _db_pool.close()
+    if _background_lock_file is not None:
+        _background_lock_file.close()
+        _background_lock_file = None
 
 # 路由：获取设备数据
 @app.route('/api/devices/<device_id>/data', methods=['GET'])
@@ -886,15 +2196,14 @@ def get_device_data(device_id):
     MySQL接口说明:
     - 查询devices表获取设备信息
     - 模拟生成设备数据
-    - 记录数据到data_records表
+    - 记录数据到data_records表(一次批量插入; DEVICE_DATA_RECORD_MODE为sampler时不在请求中记录)
     - 查询历史数据记录
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # 检查设备是否存在
-    cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-    device = cursor.fetchone()
+    device = lookup_device(cursor, device_id)
     if device is None:
         conn.close()
         return jsonify({'error': '设备不存在'}), 404
@@ -902,49 +2211,17 @@ def get_device_data(device_id):
     # 获取设备类型
     device_type = device[2]  # device_type在第3列
     
-    # 模拟设备数据
-    data = {}
+    # 模拟设备数据, 同一次采样使用同一个时间
+    now = datetime.now().replace(microsecond=0)
+    data = simulate_device_data(device_type, now)
     
-    if '灯' in device_type or '照明' in device_type:
-        data = {
-            '状态': 'ON',
-            '亮度': f"{datetime.now().second % 100}%",
-            '功率': f"{10 + datetime.now().second % 40}W"
-        }
-    elif '空调' in device_type or '温控' in device_type:
-        data = {
-            '状态': 'ON',
-            '温度': f"{16 + datetime.now().second % 14}°C",
-            '模式': '制冷',
-            '风速': '中速'
-        }
-    elif '投影' in device_type or '显示' in device_type:
-        data = {
-            '状态': 'ON',
-            '信号源': 'HDMI',
-            '亮度': f"{datetime.now().second % 100}%",
-            '对比度': f"{datetime.now().second % 100}%"
-        }
-    else:
-        data = {
-            '状态': 'ON',
-            '运行时间': f"{1 + datetime.now().hour % 24}小时"
-        }
-    
-    # 记录数据
-    try:
-        # 获取当前时间
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        for key, value in data.items():
-            cursor.execute('''
-                INSERT INTO data_records (device_id, data_type, data_value, update_time) 
-                VALUES (?, ?, ?, ?)
-            ''', (device_id, key, value, current_time))
-        
-        conn.commit()
-    except Exception as e:
-        print(f"记录数据时出错: {str(e)}")
+    # 记录数据(后台采样模式下由采样任务记录)
+    if app.config['DEVICE_DATA_RECORD_MODE'] == 'request':
+        try:
+            record_device_data(cursor, [(device_id, data, now)])
+            conn.commit()
+        except Exception as e:
+            print(f"记录数据时出错: {str(e)}")
     
     # 获取历史数据记录
     cursor.execute('''
@@ -970,23 +2247,114 @@ def get_device_data(device_id):
         'history': history
     })
 
+# 解析时序查询的时间参数
+def parse_series_time(value):
+    """支持'YYYY-MM-DD HH:MM:SS'、'YYYY-MM-DDTHH:MM:SS'和'YYYY-MM-DD'"""
+    return datetime.fromisoformat(value.strip().replace(' ', 'T'))
+
+# 路由：获取设备时序数据
+@app.route('/api/devices/<device_id>/series', methods=['GET'])
+@login_required
+def get_device_series(device_id):
+    """
+    获取设备读数时序数据
+    
+    请求参数:
+    - from/to: 时间范围, 默认最近1小时
+    - step: 聚合间隔秒数, 默认按范围自动选择(不超过500个点)
+    - metric: 指标名称, 多个用逗号分隔, 默认全部
+    
+    MySQL接口说明:
+    - step为60的整数倍时读取分钟汇总, 为3600的整数倍时读取小时汇总
+    - 否则直接聚合device_readings原始读数
+    """
+    try:
+        end = parse_series_time(request.args['to']) if request.args.get('to') else datetime.now()
+        start = parse_series_time(request.args['from']) if request.args.get('from') else end - timedelta(hours=1)
+    except ValueError:
+        return jsonify({'error': '时间格式不正确'}), 400
+    if start >= end:
+        return jsonify({'error': '开始时间必须早于结束时间'}), 400
+    
+    span = int((end - start).total_seconds())
+    step = request.args.get('step', type=int)
+    if step is None:
+        # 默认不超过500个点, 并对齐到分钟/小时以便使用汇总
+        step = max(1, -(-span // 500))
+        for resolution in ROLLUP_RESOLUTIONS:
+            if step > resolution:
+                step = -(-step // resolution) * resolution
+    if step <= 0:
+        return jsonify({'error': 'step必须大于0'}), 400
+    if span // step > app.config['SERIES_MAX_POINTS']:
+        return jsonify({'error': '时间范围过大, 请增大step'}), 400
+    
+    metric_codes = []
+    if request.args.get('metric'):
+        for name in request.args['metric'].split(','):
+            if name.strip() not in METRICS:
+                return jsonify({'error': f'未知指标: {name.strip()}'}), 400
+            metric_codes.append(METRICS[name.strip()][0])
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if lookup_device(cursor, device_id) is None:
+        conn.close()
+        return jsonify({'error': '设备不存在'}), 404
+    
+    resolution, rows = query_series(cursor, db_backend, device_id, start, end, step, metric_codes)
+    conn.close()
+    
+    series = {}
+    for metric_code, bucket_time, min_value, max_value, sum_value, count in rows:
+        name = METRIC_NAMES.get(metric_code, str(metric_code))
+        item = series.setdefault(name, {'unit': METRICS[name][1] if name in METRICS else '', 'points': []})
+        item['points'].append({
+            't': bucket_time,
+            'min': min_value,
+            'max': max_value,
+            'avg': sum_value / count if count else None,
+            'count': int(count)
+        })
+    
+    return jsonify({
+        'device_id': device_id,
+        'from': start.strftime('%Y-%m-%d %H:%M:%S'),
+        'to': end.strftime('%Y-%m-%d %H:%M:%S'),
+        'step': step,
+        'source': {0: 'raw', 60: '1m', 3600: '1h'}.get(resolution, str(resolution)),
+        'series': series
+    })
+
 # 路由：分配设备到班级
 @app.route('/api/classes/<int:class_id>/assign-devices', methods=['POST'])
 @login_required
 def assign_devices_to_class(class_id):
     """
-    分配设备到班级
+    分配设备到班级(班级的设备列表替换为device_ids)
     
     MySQL接口说明:
-    - 将指定班级的所有设备的class_id设为NULL
-    - 然后为选中的设备设置新的class_id
+    - 先用IN (...)分批查询选中设备的当前班级, 以及该班级现有的设备(一致性读, 不加锁)
+    - 将该班级的所有设备的class_id设为NULL, 再按批次(BULK_COMMAND_BATCH_SIZE)用
+      UPDATE ... WHERE device_id IN (...)设置新的class_id
+    - 写语句数量与设备数无关(每批一条), 事务持有行锁的时间很短
+    
+    返回:
+    - assigned: 原来未分配班级的设备
+    - moved: 从其他班级移入的设备 [{device_id, from_class_id}]
+    - unchanged: 原来就属于该班级的设备
+    - removed: 原来属于该班级但不在列表中的设备(已取消分配)
+    - not_found: 不存在的设备ID
     """
     data = request.json
     
     if not data or 'device_ids' not in data:
         return jsonify({'error': '设备ID列表不能为空'}), 400
+    if not isinstance(data['device_ids'], list):
+        return jsonify({'error': '设备ID列表格式不正确'}), 400
     
-    device_ids = data['device_ids']
+    device_ids = list(dict.fromkeys(str(device_id) for device_id in data['device_ids']))
+    batch_size = app.config['BULK_COMMAND_BATCH_SIZE']
     
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -998,8 +2366,7 @@ def assign_devices_to_class(class_id):
             class_id = None
         else:
             # 检查班级是否存在
-            cursor.execute('SELECT * FROM classes WHERE class_id = ?', (class_id,))
-            cls = cursor.fetchone()
+            cls = lookup_class(cursor, class_id)
             if cls is None:
                 conn.close()
                 return jsonify({'error': '班级不存在'}), 404
@@ -1008,36 +2375,176 @@ def assign_devices_to_class(class_id):
         return jsonify({'error': '班级ID格式不正确'}), 400
     
     try:
-        # 开始事务 - 使用连接对象的方法
-        conn.autocommit = False
+        # 查询选中设备的当前班级
+        current = {}
+        for i in range(0, len(device_ids), batch_size):
+            chunk = device_ids[i:i + batch_size]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'SELECT device_id, class_id FROM devices WHERE device_id IN ({placeholders})', chunk)
+            current.update((row[0], row[1]) for row in cursor.fetchall())
         
-        # 如果class_id不为None，先将该班级的所有设备的class_id设为NULL
+        # 该班级现有的设备
+        removed = []
         if class_id is not None:
+            cursor.execute('SELECT device_id FROM devices WHERE class_id = ?', (class_id,))
+            removed = [row[0] for row in cursor.fetchall() if row[0] not in current]
+            
+            # 先将该班级的所有设备的class_id设为NULL
             cursor.execute('UPDATE devices SET class_id = NULL WHERE class_id = ?', (class_id,))
         
-        # 然后为选中的设备设置班级ID
-        for device_id in device_ids:
-            # 检查设备是否存在
-            cursor.execute('SELECT * FROM devices WHERE device_id = ?', (device_id,))
-            device = cursor.fetchone()
-            if device:
-                cursor.execute('UPDATE devices SET class_id = ? WHERE device_id = ?',
-                            (class_id, device_id))
+        # 然后分批为选中的设备设置班级ID
+        found = [device_id for device_id in device_ids if device_id in current]
+        for i in range(0, len(found), batch_size):
+            chunk = found[i:i + batch_size]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'UPDATE devices SET class_id = ? WHERE device_id IN ({placeholders})',
+                        [class_id] + chunk)
+        
+        # 重建受影响班级的设备统计
+        affected_class_ids = {class_id} | set(current.values())
+        if app.config['CLASS_STATS_TABLE']:
+            rebuild_class_stats(cursor, list(affected_class_ids))
         
         # 提交事务
         conn.commit()
         conn.close()
-        
-        return jsonify({'message': '设备分配成功'})
+        invalidate_devices(found + removed)
+        # 分配会同时改变多个班级的设备列表, 只推送受影响的班级, 由客户端重新加载
+        event_broker.publish('assigned', {
+            'class_id': class_id,
+            'affected_class_ids': sorted({cid or 0 for cid in affected_class_ids})
+        }, affected_class_ids)
     except Exception as e:
         # 回滚事务
         conn.rollback()
         conn.close()
         return jsonify({'error': str(e)}), 500
+    
+    result = {'message': '设备分配成功', 'assigned': [], 'moved': [], 'unchanged': [],
+              'removed': removed, 'not_found': []}
+    for device_id in device_ids:
+        if device_id not in current:
+            result['not_found'].append(device_id)
+        elif current[device_id] == class_id:
+            result['unchanged'].append(device_id)
+        elif current[device_id] is None:
+            result['assigned'].append(device_id)
+        else:
+            result['moved'].append({'device_id': device_id, 'from_class_id': current[device_id]})
+    return jsonify(result)
+
+# 批量导入班级和设备
+def run_import(content, file_format, kind=None, mode='insert', dry_run=False):
+    """
+    校验并导入班级和设备, dry_run为True时只返回差异不写入
+    
+    Raises:
+        ImportFormatError: 文件无法解析
+    """
+    classes, devices = load_records(content, file_format, kind)
+    chunk_size = app.config['IMPORT_CHUNK_SIZE']
+    
+    conn = get_db_connection()
+    try:
+        plan = plan_import(conn.cursor(), classes, devices, mode, chunk_size)
+        if dry_run:
+            result = summarize_plan(plan)
+            result['dry_run'] = True
+            return result
+        
+        result = apply_import(conn, plan, executemany, chunk_size)
+        class_ids = result.pop('class_ids')
+        device_ids = result.pop('device_ids')
+        if app.config['CLASS_STATS_TABLE'] and class_ids:
+            cursor = conn.cursor()
+            rebuild_class_stats(cursor, list(class_ids))
+            conn.commit()
+    finally:
+        conn.close()
+    
+    if result['classes']['created'] or result['classes']['updated']:
+        invalidate_classes()
+    if device_ids:
+        invalidate_devices(device_ids)
+        event_broker.publish('assigned', {
+            'class_id': None,
+            'affected_class_ids': sorted({class_id or 0 for class_id in class_ids})
+        }, class_ids)
+    result['dry_run'] = False
+    return result
+
+# API：批量导入班级和设备
+@app.route('/api/import', methods=['POST'])
+@login_required
+def import_data():
+    """
+    从CSV或JSON文件批量导入班级和设备
+    
+    请求参数:
+    - file: 上传的文件(multipart/form-data), 也可以直接把文件内容作为请求体
+    - format: csv / json, 不指定时按文件扩展名或Content-Type判断
+    - kind: CSV文件的记录类型classes / devices, 不指定时按表头判断
+    - mode: insert(默认, 已存在的班级/设备报错) / upsert(更新已存在的记录)
+      upsert时设备的状态和班级为空表示保持不变, class_id为0表示取消分配班级
+    - dry_run: 为1时只校验并返回将要新增/更新的记录, 不写入数据库
+    
+    MySQL接口说明:
+    - 先在内存中校验所有记录, 再用IN (...)批量查询已有的班级和设备
+    - 用executemany分批写入(IMPORT_CHUNK_SIZE行一个事务), 整批失败时逐行重试并报告出错的行
+    - 新建班级的ID在写入后一次查询得到, 不再逐个读取LAST_INSERT_ID()
+    """
+    upload = request.files.get('file')
+    content = upload.read() if upload is not None else request.get_data()
+    if not content:
+        return jsonify({'error': '导入文件不能为空'}), 400
+    
+    file_format = request.args.get('format')
+    if not file_format:
+        filename = (upload.filename or '') if upload is not None else ''
+        if filename.lower().endswith('.csv') or request.mimetype == 'text/csv':
+            file_format = 'csv'
+        else:
+            file_format = 'json'
+    kind = request.args.get('kind') or None
+    mode = request.args.get('mode', 'insert')
+    if kind not in (None, 'classes', 'devices'):
+        return jsonify({'error': 'kind只能为classes或devices'}), 400
+    if mode not in ('insert', 'upsert'):
+        return jsonify({'error': 'mode只能为insert或upsert'}), 400
+    dry_run = request.args.get('dry_run', '0') == '1'
+    
+    try:
+        result = run_import(content, file_format, kind, mode, dry_run)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+# 命令行：批量导入班级和设备
+@app.cli.command('import-data')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'json']), help='文件格式, 默认按扩展名判断')
+@click.option('--kind', type=click.Choice(['classes', 'devices']), help='CSV文件的记录类型, 默认按表头判断')
+@click.option('--mode', type=click.Choice(['insert', 'upsert']), default='insert', help='已存在的记录报错或更新')
+@click.option('--dry-run', is_flag=True, help='只显示将要新增/更新的记录, 不写入数据库')
+def import_data_command(path, file_format, kind, mode, dry_run):
+    """从CSV或JSON文件批量导入班级和设备"""
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'json'
+    with open(path, 'rb') as f:
+        content = f.read()
+    try:
+        result = run_import(content, file_format, kind, mode, dry_run)
+    except ImportFormatError as e:
+        print(f"导入失败: {str(e)}")
+        raise SystemExit(1)
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    if result['errors']:
+        raise SystemExit(1)
 
 # API：获取操作日志
 @app.route('/api/logs', methods=['GET'])
 @login_required
+@conditional_listing('logs', 'devices')
 def get_logs():
     """
     获取操作日志
@@ -1045,58 +2552,88 @@ def get_logs():
     MySQL接口说明:
     - 查询operation_logs表获取日志记录
     - 支持分页和筛选
-    - 关联devices表获取设备名称
-    - 使用BINARY关键字确保字符集排序规则一致
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    - 关联devices表获取设备名称, 两表排序规则一致, 直接按device_id关联
+    - 日期筛选转换为operation_time范围条件, 可以使用索引
     
+    分页参数:
+    - page/page_size: 偏移分页
+    - after: 游标分页"<operation_time>,<log_id>", 按(operation_time, log_id)倒序定位, 不再跳过前面的行
+    - total: exact(精确计数) / cached(默认, 按筛选条件短时缓存) / none(不计数)
+    """
     # 获取查询参数
     page = request.args.get('page', 1, type=int)
     page_size = request.args.get('page_size', 10, type=int)
     device_id = request.args.get('device_id', '')
     operation = request.args.get('operation', '')
     date = request.args.get('date', '')
+    after = request.args.get('after', '')
+    total_mode = request.args.get('total', 'cached')
     
-    # 构建查询条件
-    query = 'SELECT l.log_id, l.device_id, d.device_name, l.operation, l.operation_time FROM operation_logs l LEFT JOIN devices d ON BINARY l.device_id = BINARY d.device_id WHERE 1=1'
-    params = []
+    if page < 1 or page_size < 1:
+        return jsonify({'error': '分页参数不正确'}), 400
+    if total_mode not in ('exact', 'cached', 'none'):
+        return jsonify({'error': 'total参数只能为exact、cached或none'}), 400
     
-    if device_id:
-        query += ' AND BINARY l.device_id = ?'
-        params.append(device_id)
+    cursor_time = cursor_log_id = None
+    if after:
+        try:
+            cursor_time, cursor_log_id = parse_log_cursor(after)
+        except ValueError:
+            return jsonify({'error': '游标格式不正确'}), 400
     
-    if operation:
-        query += ' AND l.operation = ?'
-        params.append(operation)
+    # 构建查询条件
+    try:
+        conditions, params = build_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = LOG_SELECT + conditions
     
-    if date:
-        query += ' AND DATE(l.operation_time) = ?'
-        params.append(date)
+    conn = get_db_connection()
+    cursor = conn.cursor()
     
-    # 计算总记录数
-    count_query = query.replace('SELECT l.log_id, l.device_id, d.device_name, l.operation, l.operation_time', 'SELECT COUNT(*)')
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()[0]
+    # 计算总记录数(可选缓存)
+    total_count = None
+    if total_mode != 'none':
+        count_key = (device_id, operation, date)
+        if total_mode == 'cached':
+            total_count = log_count_cache.get(count_key)
+        if total_count is None:
+            count_query = query.replace('SELECT l.log_id, l.device_id, d.device_name, l.operation, l.operation_time', 'SELECT COUNT(*)')
+            cursor.execute(count_query, params)
+            total_count = cursor.fetchone()[0]
+            log_count_cache.set(count_key, total_count)
     
     # 添加排序和分页
-    query += ' ORDER BY l.operation_time DESC LIMIT ? OFFSET ?'
-    params.append(page_size)
-    params.append((page - 1) * page_size)
+    if after:
+        # 游标分页: 从上一页最后一条记录之后继续
+        query += ' AND (l.operation_time < ? OR (l.operation_time = ? AND l.log_id < ?))'
+        params.extend([cursor_time, cursor_time, cursor_log_id])
+        query += ' ORDER BY l.operation_time DESC, l.log_id DESC LIMIT ?'
+        params.append(page_size)
+    else:
+        query += ' ORDER BY l.operation_time DESC, l.log_id DESC LIMIT ? OFFSET ?'
+        params.append(page_size)
+        params.append((page - 1) * page_size)
     
     # 执行查询
     cursor.execute(query, params)
     logs = cursor.fetchall()
     
     # 计算总页数
-    total_pages = (total_count + page_size - 1) // page_size
+    total_pages = (total_count + page_size - 1) // page_size if total_count is not None else None
+    
+    # 下一页游标
+    next_cursor = None
+    if len(logs) == page_size:
+        next_cursor = make_log_cursor(logs[-1][4], logs[-1][0])
     
     # 构建结果
     result = {
         'logs': [],
         'total_count': total_count,
         'total_pages': total_pages,
-        'current_page': page
+        'current_page': page,
+        'next_cursor': next_cursor
     }
     
     for log in logs:
@@ -1111,6 +2648,131 @@ def get_logs():
     conn.close()
     return jsonify(result)
 
+# API：导出操作日志
+@app.route('/api/logs/export', methods=['GET'])
+@login_required
+def export_logs():
+    """
+    流式导出操作日志
+    
+    请求参数:
+    - format: csv(默认, 带UTF-8 BOM和表头) / ndjson(每行一个JSON对象)
+    - device_id/operation/date: 与获取操作日志接口相同的筛选条件
+    - after: 从游标"<operation_time>,<log_id>"之后继续导出(断点续传, 不输出BOM和表头),
+             游标取已收到的最后一行的operation_time和log_id
+    
+    导出中途出错时先输出一行错误标记再中断传输(响应不完整, gzip也没有结尾):
+    - csv: #ERROR,<错误信息>,<续传游标>
+    - ndjson: {"error": <错误信息>, "next_cursor": <续传游标>}
+    续传游标为空时从头导出
+    
+    MySQL接口说明:
+    - 按(operation_time, log_id)倒序, 每次查询LOG_EXPORT_CHUNK_SIZE行, 下一批从上一批最后一行之后开始,
+      使用idx_logs_*索引定位, 不使用OFFSET
+    - 每批查询完成后立即归还连接, 内存占用与导出总行数无关
+    - 客户端接受gzip时边查询边压缩(Content-Encoding: gzip)
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': '导出格式只能为csv或ndjson'}), 400
+    
+    try:
+        conditions, params = build_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    after = request.args.get('after', '')
+    cursor_time = cursor_log_id = None
+    if after:
+        try:
+            cursor_time, cursor_log_id = parse_log_cursor(after)
+        except ValueError:
+            return jsonify({'error': '游标格式不正确'}), 400
+    
+    chunk_size = app.config['LOG_EXPORT_CHUNK_SIZE']
+    use_gzip = (app.config['COMPRESS_RESPONSES']
+                and request.accept_encodings.best_match(['gzip']) is not None)
+    
+    def fetch_chunks():
+        last_time, last_log_id = cursor_time, cursor_log_id
+        while True:
+            query = LOG_SELECT + conditions
+            chunk_params = list(params)
+            if last_log_id is not None:
+                query += ' AND (l.operation_time < ? OR (l.operation_time = ? AND l.log_id < ?))'
+                chunk_params.extend([last_time, last_time, last_log_id])
+            query += ' ORDER BY l.operation_time DESC, l.log_id DESC LIMIT ?'
+            chunk_params.append(chunk_size)
+            
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, chunk_params)
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_time, last_log_id = rows[-1][4], rows[-1][0]
+    
+    def format_time(value):
+        return value.strftime(LOG_CURSOR_TIME_FORMAT) if isinstance(value, datetime) else value
+    
+    # 已输出的最后一行的游标, 出错时告知客户端从哪里续传
+    last_cursor = {'value': after or None}
+    
+    def encode_chunks():
+        columns = ('log_id', 'device_id', 'device_name', 'operation', 'operation_time')
+        if export_format == 'csv' and not after:
+            yield ('\ufeff' + ','.join(columns) + '\r\n').encode('utf-8')
+        for rows in fetch_chunks():
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(row[:4] + (format_time(row[4]),) for row in rows)
+                yield buffer.getvalue().encode('utf-8')
+            else:
+                yield b''.join(app.json.dumps(dict(zip(columns, row[:4] + (format_time(row[4]),))))
+                               .encode('utf-8') + b'\n' for row in rows)
+            last_cursor['value'] = f'{format_time(rows[-1][4])},{rows[-1][0]}'
+    
+    def generate():
+        compressor = zlib.compressobj(app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31) if use_gzip else None
+        
+        def encode(data):
+            # 每批同步刷新, 客户端可以及时收到数据
+            return data if compressor is None else compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        
+        try:
+            for data in encode_chunks():
+                yield encode(data)
+        except Exception as e:
+            # 响应头已发送, 无法再返回错误状态码: 重新抛出异常, 由服务器中断分块传输,
+            # 客户端收到不完整的响应(gzip也没有结尾), 不会误认为导出完整; 可用最后一行的游标续传
+            print(f"导出操作日志时出错: {str(e)}")
+            if export_format == 'ndjson':
+                yield encode(app.json.dumps({'error': str(e), 'next_cursor': last_cursor['value']})
+                             .encode('utf-8') + b'\n')
+            else:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(['#ERROR', str(e), last_cursor['value'] or ''])
+                yield encode(buffer.getvalue().encode('utf-8'))
+            raise
+        if compressor is not None:
+            yield compressor.flush()
+    
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    headers = {
+        'Content-Disposition': f'attachment; filename=operation_logs.{extension}',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'Vary': 'Accept-Encoding'
+    }
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
 # API：清空操作日志
 @app.route('/api/logs', methods=['DELETE'])
 @login_required
@@ -1119,15 +2781,13 @@ def clear_logs():
     清空操作日志
     
     MySQL接口说明:
-    - 删除operation_logs表中的所有记录
+    - 在后台按主键分批删除operation_logs表中的所有记录, 批次之间暂停, 不长时间锁表
+    - 进度通过/api/system/retention查询
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM operation_logs')
-    conn.commit()
-    conn.close()
+    if not start_purge_job('clear-logs', [{'table': 'operation_logs', 'pk': 'log_id'}]):
+        return jsonify({'error': '已有清理任务正在运行，请稍后重试'}), 409
     
-    return jsonify({'message': 'All logs have been cleared'})
+    return jsonify({'message': '日志清空任务已启动', 'progress': purger.progress()}), 202
 
 # API：获取日志详情
 @app.route('/api/logs/<int:log_id>', methods=['GET'])
@@ -1139,11 +2799,10 @@ def get_log_detail(log_id):
     MySQL接口说明:
     - 根据log_id查询operation_logs表
     - 关联devices表获取设备名称
-    - 使用BINARY关键字确保字符集排序规则一致
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT l.*, d.device_name FROM operation_logs l LEFT JOIN devices d ON BINARY l.device_id = BINARY d.device_id WHERE l.log_id = ?', 
+    cursor.execute('SELECT l.*, d.device_name FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id WHERE l.log_id = ?', 
                   (log_id,))
     log = cursor.fetchone()
     conn.close()
@@ -1159,6 +2818,230 @@ def get_log_detail(log_id):
         'operation_time': log[3]
     })
 
+# API：设备变化推送
+@app.route('/api/events', methods=['GET'])
+@login_required
+def device_events():
+    """
+    以Server-Sent Events推送设备变化, 替代每次操作后重新获取设备列表
+    
+    请求参数:
+    - class_id: 只接收这些班级的事件(逗号分隔, 0表示未分配班级), 不指定时接收全部事件
+    
+    事件类型:
+    - status: 设备开关/连接状态变化, {status, devices: [{device_id, class_id}]}
+    - device: 设备信息被修改, 包含修改后的字段和previous_class_id
+    - assigned: 班级的设备分配发生变化, {class_id, affected_class_ids}
+    
+    说明:
+    - 每隔EVENTS_HEARTBEAT秒没有事件时发送注释行作为心跳, 防止代理断开空闲连接
+    - 不占用数据库连接; 事件只在本进程内分发, 多进程部署时需配合粘性会话或外部消息通道
+    """
+    class_ids = None
+    value = request.args.get('class_id')
+    if value:
+        try:
+            class_ids = {int(item) for item in value.split(',') if item.strip()}
+        except ValueError:
+            return jsonify({'error': '班级ID格式不正确'}), 400
+    
+    subscriber = event_broker.subscribe(class_ids)
+    
+    def generate():
+        try:
+            yield from event_broker.stream(subscriber, heartbeat=app.config['EVENTS_HEARTBEAT'])
+        finally:
+            event_broker.unsubscribe(subscriber)
+    
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# API：获取推送订阅状态
+@app.route('/api/system/events', methods=['GET'])
+@login_required
+def get_event_stats():
+    """
+    获取当前worker的推送订阅者数量、已发布事件数和因客户端过慢丢弃的事件数
+    """
+    return jsonify(event_broker.stats())
+
+# 连接池耗尽时返回503, 便于前端重试
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e):
+    return jsonify({'error': '服务器繁忙，请稍后重试'}), 503
+
+# API：获取连接池状态
+@app.route('/api/db/pool-stats', methods=['GET'])
+@login_required
+def get_pool_stats():
+    """
+    获取连接池状态
+    
+    - 空闲/借出连接数、累计创建/回收次数
+    - 等待次数、等待时间(平均/最大)和等待超时次数
+    """
+    return jsonify(get_db_pool().stats())
+
+# API：获取操作日志写入器状态
+@app.route('/api/system/log-writer', methods=['GET'])
+@login_required
+def get_log_writer_stats():
+    """
+    获取操作日志异步写入器状态
+    
+    - queue_depth: 队列中等待写入的日志数
+    - flush_time_avg/flush_time_max/last_flush_seconds: 批量写入耗时
+    - rejected: 队列已满改为同步写入的日志数
+    """
+    writer = get_log_writer()
+    if writer is None:
+        return jsonify({'enabled': False})
+    result = writer.stats()
+    result['enabled'] = True
+    return jsonify(result)
+
+# API：获取设备命令调度器状态
+@app.route('/api/system/dispatcher', methods=['GET'])
+@login_required
+def get_dispatcher_stats():
+    """
+    获取设备命令调度器状态
+    
+    - pending/in_flight: 等待下发和正在下发的命令数
+    - coalesced: 被新命令取代而未下发(或不再重试)的命令数
+    - retries/failed: 重试次数和放弃重试的命令数, recent_failures为最近的失败记录
+    """
+    dispatcher = get_dispatcher()
+    if dispatcher is None:
+        return jsonify({'enabled': False})
+    result = dispatcher.stats()
+    result['enabled'] = True
+    return jsonify(result)
+
+# API：获取后台任务状态
+@app.route('/api/system/background-tasks', methods=['GET'])
+@login_required
+def get_background_tasks():
+    """
+    获取后台任务(如设备数据采样)的运行状态
+    """
+    return jsonify([task.stats() for task in background_tasks.values()])
+
+# API：获取数据清理进度
+@app.route('/api/system/retention', methods=['GET'])
+@login_required
+def get_retention_progress():
+    """
+    获取数据清理任务进度
+    
+    - running/job/table: 是否正在运行、任务名称、正在清理的表
+    - deleted: 每个表已删除的行数
+    - policies: 当前保留策略
+    """
+    result = purger.progress()
+    result['policies'] = [{
+        'table': policy['table'],
+        'cutoff': policy['cutoff'].strftime('%Y-%m-%d %H:%M:%S')
+    } for policy in build_retention_policies(app.config)]
+    return jsonify(result)
+
+# API：立即执行数据清理
+@app.route('/api/system/retention', methods=['POST'])
+@login_required
+def run_retention_now():
+    """
+    在后台立即按保留策略执行一次清理
+    """
+    if not start_purge_job('retention', build_retention_policies(app.config)):
+        return jsonify({'error': '已有清理任务正在运行，请稍后重试'}), 409
+    return jsonify({'message': '清理任务已启动', 'progress': purger.progress()}), 202
+
+# API：获取注册表缓存状态
+@app.route('/api/system/registry', methods=['GET'])
+@login_required
+def get_registry_stats():
+    """
+    获取设备和班级注册表缓存的条目数和命中率, 以及列表接口使用的数据版本号
+    """
+    return jsonify({
+        'devices': device_cache.stats(),
+        'classes': class_cache.stats(),
+        'data_versions': data_versions.stats()
+    })
+
+# API：Prometheus指标
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    以Prometheus文本格式输出按接口统计的直方图
+    
+    - http_request_duration_seconds / db_queries_per_request / db_rows_fetched_per_request /
+      db_connection_acquire_seconds: 按endpoint和method统计
+    - db_pool_*: 连接池当前状态
+    - 不需要登录(供Prometheus抓取), 需要Authorization: Bearer <METRICS_TOKEN>
+    - 未设置METRICS_TOKEN时返回404, 除非显式设置METRICS_PUBLIC=1允许匿名访问
+    """
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': '指标统计未启用'}), 404
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        if not app.config['METRICS_PUBLIC']:
+            return jsonify({'error': '指标接口未配置METRICS_TOKEN'}), 404
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': '未授权'}), 401
+    
+    gauges = {}
+    if _db_pool is not None:
+        pool_stats = _db_pool.stats()
+        gauges = {
+            ('db_pool_in_use', '借出的连接数'): pool_stats['in_use'],
+            ('db_pool_idle', '空闲的连接数'): pool_stats['idle'],
+            ('db_pool_size', '连接总数'): pool_stats['size']
+        }
+    return app.response_class(metrics_registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# 页面：SQL诊断
+@app.route('/debug/queries', methods=['GET', 'DELETE'])
+@login_required
+def debug_queries():
+    """
+    查看慢查询和N+1检测结果(需设置QUERY_DEBUG=1)
+    
+    请求参数:
+    - format: html(默认) / json
+    - DELETE: 清空已记录的结果
+    
+    说明:
+    - 只分析请求内通过get_db_connection()执行的语句, 后台任务和流式导出不在统计范围内
+    - 结果保存在当前进程内, 多进程部署时每个worker分别统计; 日志文件记录所有worker的结果
+    """
+    log = get_query_log()
+    if log is None:
+        return jsonify({'error': 'SQL诊断未启用, 请设置QUERY_DEBUG=1'}), 404
+    if request.method == 'DELETE':
+        log.clear()
+        return jsonify({'message': '已清空'})
+    
+    totals, templates = log.summary(limit=request.args.get('limit', 50, type=int))
+    recent = log.recent()
+    if request.args.get('format') == 'json':
+        return jsonify({'totals': totals, 'templates': templates, 'recent': recent})
+    return render_template('debug_queries.html', totals=totals, templates=templates, recent=recent)
+
+# API：获取启动耗时
+@app.route('/api/system/boot', methods=['GET'])
+@login_required
+def get_boot_stats():
+    """
+    获取当前worker的启动耗时
+    
+    - import_seconds: 导入app模块的耗时(不包含任何数据库操作)
+    - first_request_seconds: 从开始导入到处理第一个请求的耗时
+    """
+    return jsonify(boot_stats)
+
 # 路由：登录页面
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -1188,5 +3071,7 @@ def logout():
     session.pop('username', None)
     return redirect(url_for('login'))
 
+boot_stats['import_seconds'] = time.perf_counter() - _boot_started
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
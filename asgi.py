@@ -0,0 +1,225 @@
+"""
+ASGI入口: 设备控制命令(连接/断开/开启/关闭)使用单独的有界线程池, 其余请求交给Flask处理
+
+用法:
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+设备控制命令:
+- 在事件循环中按Flask的路由规则匹配, 排队中的命令只占用一个协程, 不占用线程;
+  请求交给ASGI_DB_THREADS个线程的线程池执行, 上千个同时进行的命令共用少量线程和数据库连接
+- 在线程池中运行完整的Flask应用(会话校验、before_request/after_request钩子、压缩、Server-Timing、
+  接口指标和慢查询日志), 响应与同步部署完全一致
+- 同时进行的命令超过ASGI_MAX_PENDING时直接返回503, 不无限堆积
+- 不占用运行其他请求的线程, 大量设备命令不会让页面和事件推送流等待
+
+其余请求:
+- 通过a2wsgi在ASGI_WSGI_THREADS个线程中运行Flask应用, 每个打开的事件推送流占用一个线程
+
+MySQL没有可用的异步ODBC驱动(aioodbc也是在线程池中调用pyodbc), 因此使用有界线程池;
+DB_POOL_MAX_SIZE不小于ASGI_DB_THREADS时设备命令不会等待数据库连接
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify
+from werkzeug.exceptions import HTTPException
+
+import app as core
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+flask_app = core.app
+
+# 走设备命令线程池的接口(Flask endpoint名称)
+ASYNC_ENDPOINTS = {'connect_device', 'disconnect_device', 'turn_on_device', 'turn_off_device'}
+
+BUSY_ERROR = '服务器繁忙，请稍后重试'
+
+
+def build_environ(scope, body):
+    """按ASGI的HTTP scope和完整的请求体构造WSGI environ"""
+    script_name = scope.get('root_path', '')
+    path_info = scope['path']
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path_info.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+def run_wsgi(environ):
+    """
+    在线程池中执行Flask应用
+
+    Returns:
+        (status_code, headers, body)
+    """
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split(' ', 1)[0])
+        result['headers'] = headers
+
+    chunks = flask_app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return result['status'], result['headers'], body
+
+
+def busy_response(environ):
+    """命令过多时的503响应, 同样经过after_request钩子(压缩、接口指标等)"""
+    with flask_app.request_context(environ):
+        core.start_request_stats()
+        response = jsonify({'error': BUSY_ERROR})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        response = flask_app.process_response(response)
+        return response.status_code, list(response.headers.items()), response.get_data()
+
+
+class DeviceCommandApp:
+    """
+    ASGI应用: 设备控制命令在有界线程池中执行, 其余请求交给fallback
+
+    Args:
+        fallback: 处理其他请求的ASGI应用
+        db_threads: 执行设备命令的线程数
+        max_pending: 同时进行(执行中和排队中)的设备命令上限
+    """
+
+    def __init__(self, fallback, db_threads=8, max_pending=5000):
+        self.fallback = fallback
+        self.max_pending = max_pending
+        self.pending = 0  # 只在事件循环线程中修改, 不需要加锁
+        self.executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix='device-command')
+        self._urls = flask_app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'POST' and self.match(scope):
+            return await self.handle(scope, receive, send)
+        return await self.fallback(scope, receive, send)
+
+    def match(self, scope):
+        """按Flask的路由规则判断是否为设备控制命令"""
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        try:
+            endpoint, _ = self._urls.match(path, method='POST')
+        except HTTPException:
+            return False
+        return endpoint in ASYNC_ENDPOINTS
+
+    async def handle(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        if self.pending >= self.max_pending:
+            response = busy_response(build_environ(scope, b''))
+            return await self.send_response(send, response)
+
+        self.pending += 1
+        try:
+            body = await self.read_body(receive)
+            # 客户端断开时命令仍会执行完成, 与同步部署一致
+            response = await loop.run_in_executor(self.executor, run_wsgi, build_environ(scope, body))
+        finally:
+            self.pending -= 1
+        await self.send_response(send, response)
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def send_response(self, send, response):
+        status_code, headers, body = response
+        await send({
+            'type': 'http.response.start',
+            'status': status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        """
+        启动时按worker进程初始化(多个uvicorn worker之间选举运行后台任务的进程);
+        停止时等待进行中的命令, 写入剩余日志并关闭连接池
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                core.init_worker()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await loop.run_in_executor(None, self.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        core.begin_drain()
+        self.executor.shutdown(wait=True)
+        core.shutdown_worker()
+
+
+def create_application():
+    if WSGIMiddleware is None:
+        raise RuntimeError('未安装ASGI部署的依赖, 请执行 pip install -r requirements-asgi.txt')
+    config = flask_app.config
+    if config['DB_POOL_MAX_SIZE'] < config['ASGI_DB_THREADS']:
+        print(f"提示: DB_POOL_MAX_SIZE({config['DB_POOL_MAX_SIZE']})小于ASGI_DB_THREADS"
+              f"({config['ASGI_DB_THREADS']}), 设备命令会等待数据库连接")
+    return DeviceCommandApp(WSGIMiddleware(flask_app, workers=config['ASGI_WSGI_THREADS']),
+                            db_threads=config['ASGI_DB_THREADS'],
+                            max_pending=config['ASGI_MAX_PENDING'])
+
+
+application = create_application()
@@ -0,0 +1,206 @@
+"""
+数据库后端
+
+- MySQLBackend: 通过ODBC数据源连接MySQL(默认)
+- SQLiteBackend: 本地SQLite文件, 用于每栋楼单独部署的边缘控制器, 没有网络往返
+
+后端负责建立连接, 并生成各数据库写法不同的SQL(upsert、时间分桶、带LIMIT的删除、
+自增ID、建表语句、索引检查和执行计划), 其余SQL两种后端通用(参数占位符都是?)
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    def __init__(self, dsn='jiaoshi'):
+        self.dsn = dsn
+        import pyodbc  # 只有使用MySQL后端时才需要安装pyodbc
+        self._pyodbc = pyodbc
+        self.Error = pyodbc.Error
+
+    def connect(self):
+        return self._pyodbc.connect(f'DSN={self.dsn}')
+
+    def upsert_sql(self, table, columns, keys, replace=(), add=(), select=None):
+        """
+        插入一行(或INSERT ... SELECT的结果), 主键/唯一键冲突时更新
+
+        Args:
+            keys: 冲突判断使用的键列
+            replace: 冲突时用新值替换的列
+            add: 冲突时在原值上累加新值的列
+            select: 提供时使用INSERT ... SELECT, 否则使用VALUES (?, ...)
+        """
+        updates = [f'{column} = VALUES({column})' for column in replace]
+        updates += [f'{column} = {column} + VALUES({column})' for column in add]
+        source = select if select is not None else f"VALUES ({', '.join('?' * len(columns))})"
+        return (f"INSERT INTO {table} ({', '.join(columns)}) {source} "
+                f"ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+
+    def bucket_expr(self, column, seconds):
+        """按seconds秒分桶的SQL表达式"""
+        return f'FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP({column}) / {int(seconds)}) * {int(seconds)})'
+
+    def delete_limit_sql(self, table, where_sql):
+        """删除最多?行(最后一个参数为行数)"""
+        return f'DELETE FROM {table}{where_sql} LIMIT ?'
+
+    last_insert_id_sql = 'SELECT LAST_INSERT_ID()'
+
+    def is_duplicate_error(self, error):
+        return 'Duplicate entry' in str(error)
+
+    def create_table(self, cursor, ddl):
+        cursor.execute(ddl)
+
+    def index_exists(self, cursor, table, name):
+        # MySQL不支持CREATE INDEX IF NOT EXISTS, 先查询information_schema
+        cursor.execute('''
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = ? AND index_name = ?
+        ''', (table, name))
+        return cursor.fetchone()[0] > 0
+
+    def explain(self, cursor, query, params, table):
+        """
+        Returns:
+            (key, type): table使用的索引和访问方式
+        """
+        cursor.execute('EXPLAIN ' + query, params)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        plan = next((row for row in rows if row.get('table') == table), rows[0] if rows else {})
+        return plan.get('key'), plan.get('type')
+
+
+# SQLite的日期时间按本地时间的文本"YYYY-MM-DD HH:MM:SS"存储, 读取声明为DATETIME/TIMESTAMP的列时转换为datetime
+def _adapt_datetime(value):
+    return value.isoformat(' ')
+
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter('DATETIME', _convert_datetime)
+sqlite3.register_converter('TIMESTAMP', _convert_datetime)
+
+_SQLITE_NOW = "(datetime('now', 'localtime'))"
+
+
+class SQLiteBackend:
+    """
+    SQLite后端
+
+    - journal_mode=WAL: 读不阻塞写, 写不阻塞读
+    - synchronous=NORMAL: WAL模式下只在检查点时fsync, 断电最多丢失最近提交的事务, 不会损坏数据库
+    - busy_timeout: 写锁被占用时等待的毫秒数, 而不是立即报错
+    - 事务以BEGIN IMMEDIATE开始, 在第一条写语句时就取得写锁, 避免读事务升级为写事务时的死锁
+    """
+    name = 'sqlite'
+    Error = sqlite3.Error
+    last_insert_id_sql = 'SELECT last_insert_rowid()'
+
+    def __init__(self, path, journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000):
+        self.path = path
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000,
+                               detect_types=sqlite3.PARSE_DECLTYPES,
+                               isolation_level='IMMEDIATE', check_same_thread=False)
+        conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute('PRAGMA foreign_keys = ON')
+        return conn
+
+    def upsert_sql(self, table, columns, keys, replace=(), add=(), select=None):
+        updates = [f'{column} = excluded.{column}' for column in replace]
+        updates += [f'{column} = {column} + excluded.{column}' for column in add]
+        source = select if select is not None else f"VALUES ({', '.join('?' * len(columns))})"
+        return (f"INSERT INTO {table} ({', '.join(columns)}) {source} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(updates)}")
+
+    def bucket_expr(self, column, seconds):
+        return (f"datetime(CAST(strftime('%s', {column}) AS INTEGER) / {int(seconds)} * {int(seconds)}, "
+                f"'unixepoch')")
+
+    def delete_limit_sql(self, table, where_sql):
+        # SQLite默认不支持DELETE ... LIMIT, 按rowid删除
+        return f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table}{where_sql} LIMIT ?)'
+
+    def is_duplicate_error(self, error):
+        return isinstance(error, sqlite3.IntegrityError) and 'UNIQUE' in str(error)
+
+    def create_table(self, cursor, ddl):
+        """
+        把MySQL建表语句转换为SQLite写法后执行
+
+        - INT AUTO_INCREMENT PRIMARY KEY -> INTEGER PRIMARY KEY AUTOINCREMENT
+        - DEFAULT CURRENT_TIMESTAMP -> 本地时间; ON UPDATE CURRENT_TIMESTAMP改为触发器
+        - 表内的KEY定义改为单独的CREATE INDEX; 去掉字符集和存储引擎选项
+        """
+        table = re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', ddl).group(1)
+        indexes = re.findall(r',\s*KEY (\w+) \(([^)]*)\)', ddl)
+        ddl = re.sub(r',\s*KEY \w+ \([^)]*\)', '', ddl)
+        on_update = re.findall(r'(\w+) TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP', ddl)
+        ddl = ddl.replace(' ON UPDATE CURRENT_TIMESTAMP', '')
+        ddl = ddl.replace('DEFAULT CURRENT_TIMESTAMP', f'DEFAULT {_SQLITE_NOW}')
+        ddl = ddl.replace('INT AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+        ddl = re.sub(r'\)\s*CHARACTER SET \w+ COLLATE \w+(\s+ENGINE=\w+)?\s*$', ')', ddl.strip())
+        cursor.execute(ddl)
+
+        for name, columns in indexes:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+        for column in on_update:
+            # 更新时没有显式修改该列才自动设置为当前时间(与MySQL行为一致)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}
+                AFTER UPDATE ON {table} FOR EACH ROW WHEN NEW.{column} IS OLD.{column}
+                BEGIN
+                    UPDATE {table} SET {column} = {_SQLITE_NOW} WHERE rowid = NEW.rowid;
+                END
+            ''')
+
+    def index_exists(self, cursor, table, name):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name = ?",
+                       (table, name))
+        return cursor.fetchone()[0] > 0
+
+    def explain(self, cursor, query, params, table):
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        details = [row[-1] for row in cursor.fetchall()]
+        plan = next((detail for detail in details if re.match(rf'(SEARCH|SCAN) {table}\b', detail)),
+                    details[0] if details else '')
+        match = re.search(r'USING (?:COVERING )?INDEX (\w+)', plan)
+        if match and not match.group(1).startswith('sqlite_autoindex_'):
+            key = match.group(1)
+        elif match or 'PRIMARY KEY' in plan:
+            # 非整数主键由sqlite_autoindex_*实现, 与MySQL的PRIMARY对应
+            key = 'PRIMARY'
+        else:
+            key = None
+        return key, plan.split(' ')[0] if plan else None
+
+
+def create_backend(config):
+    """按DB_BACKEND配置创建后端"""
+    if config['DB_BACKEND'] == 'sqlite':
+        return SQLiteBackend(config['SQLITE_PATH'],
+                             journal_mode=config['SQLITE_JOURNAL_MODE'],
+                             synchronous=config['SQLITE_SYNCHRONOUS'],
+                             busy_timeout=config['SQLITE_BUSY_TIMEOUT'])
+    if config['DB_BACKEND'] == 'mysql':
+        return MySQLBackend(config['DB_DSN'])
+    raise ValueError(f"不支持的数据库后端: {config['DB_BACKEND']}")
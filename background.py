@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class PeriodicTask:
+    """
+    后台周期任务
+
+    - 每隔interval秒在后台线程中调用一次func
+    - func抛出的异常会被记录, 不会终止线程
+    - stop()后线程在当前一轮结束后退出
+    """
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self._func = func
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+        self.last_run_seconds = None
+        self.last_error = None
+        self.last_result = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stopping(self):
+        """供func内部的长时间循环检查是否需要提前结束"""
+        return self._stop.is_set()
+
+    def run_once(self):
+        started = time.perf_counter()
+        try:
+            self.last_result = self._func()
+            self.last_error = None
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            print(f"后台任务{self.name}执行出错: {str(e)}")
+        self.runs += 1
+        self.last_run_at = time.time()
+        self.last_run_seconds = time.perf_counter() - started
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run_at': self.last_run_at,
+            'last_run_seconds': self.last_run_seconds,
+            'last_error': self.last_error,
+            'last_result': self.last_result
+        }
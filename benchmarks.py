@@ -0,0 +1,571 @@
+"""
+性能基准测试
+
+- json_benchmark: 对比JSON序列化实现和响应压缩在典型接口数据上的CPU耗时和字节数
+- seed_database / endpoint_benchmark: 在本地替身数据库(SQLite)中写入接近生产规模的数据,
+  通过Flask测试客户端或真实的WSGI服务器并发请求各接口, 统计吞吐量、延迟分位数和每个请求的查询数
+- compare_with_baseline: 与保存的基线结果比较, 找出性能退化的接口
+"""
+import http.client
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from flask.json.provider import DefaultJSONProvider
+
+from compression import ENCODINGS, compress
+from json_provider import FastJSONProvider
+
+
+def sample_payloads(device_count=5000, log_count=100):
+    """
+    按接口的返回结构生成测试数据(不访问数据库)
+
+    - /api/devices: device_count个设备
+    - /api/logs: 一页log_count条日志(operation_time为datetime)
+    - /api/classes: 班级汇总(MySQL的SUM返回Decimal)
+    """
+    types = ['projector', 'computer', 'airConditioner', 'light']
+    devices = [{
+        'device_id': f'192.168.{i // 250}.{i % 250 + 1}',
+        'device_name': f'{i % 40 + 1}号教室设备{i}',
+        'device_type': types[i % len(types)],
+        'current_status': 'ON' if i % 3 else 'OFF',
+        'class_id': i % 40 + 1,
+        'class_name': f'{i % 40 + 1}班'
+    } for i in range(device_count)]
+
+    now = datetime(2024, 1, 1, 8, 0, 0)
+    logs = {
+        'logs': [{
+            'log_id': 100000 - i,
+            'device_id': devices[i % len(devices)]['device_id'] if devices else '',
+            'device_name': devices[i % len(devices)]['device_name'] if devices else '',
+            'operation': '开启设备' if i % 2 else '关闭设备',
+            'operation_time': now - timedelta(seconds=i * 37)
+        } for i in range(log_count)],
+        'total': 100000,
+        'page': 1,
+        'page_size': log_count,
+        'total_pages': 100000 // max(log_count, 1),
+        'next_cursor': '2024-01-01 07:00:00,99900'
+    }
+
+    classes = [{
+        'class_id': i + 1,
+        'class_name': f'{i + 1}班',
+        'class_room': f'教学楼{i // 10 + 1}-{i % 10 + 101}',
+        'description': '',
+        'device_count': device_count // 40,
+        'on_count': Decimal(device_count // 60),
+        'off_count': Decimal(device_count // 120)
+    } for i in range(40)]
+
+    return {'devices': devices, 'logs': logs, 'classes': classes}
+
+
+def _measure(func, repeat):
+    """返回每次调用的平均CPU秒数和最后一次的结果"""
+    started = time.process_time()
+    for _ in range(repeat):
+        result = func()
+    return (time.process_time() - started) / repeat, result
+
+
+def json_benchmark(app, device_count=5000, log_count=100, repeat=20):
+    """
+    Returns:
+        rows: [{'payload', 'provider', 'cpu_ms', 'bytes', '<encoding>_bytes', '<encoding>_ms'}]
+    """
+    providers = [('json', DefaultJSONProvider(app))]
+    for datetime_format in ('http', 'iso'):
+        provider = FastJSONProvider(app)
+        provider.datetime_format = datetime_format
+        providers.append((f'{provider.backend}-{datetime_format}', provider))
+
+    rows = []
+    with app.app_context():
+        for name, payload in sample_payloads(device_count, log_count).items():
+            for provider_name, provider in providers:
+                if isinstance(provider, FastJSONProvider):
+                    cpu, data = _measure(lambda: provider.dumps_bytes(payload), repeat)
+                else:
+                    cpu, data = _measure(
+                        lambda: provider.dumps(payload, separators=(',', ':')).encode('utf-8'), repeat)
+                row = {'payload': name, 'provider': provider_name, 'cpu_ms': cpu * 1000, 'bytes': len(data)}
+                for encoding in ENCODINGS:
+                    encode_cpu, compressed = _measure(
+                        lambda: compress(data, encoding, app.config['COMPRESS_GZIP_LEVEL'],
+                                         app.config['COMPRESS_BROTLI_QUALITY']), repeat)
+                    row[f'{encoding}_bytes'] = len(compressed)
+                    row[f'{encoding}_ms'] = encode_cpu * 1000
+                rows.append(row)
+    return rows
+
+
+DEVICE_TYPES = ('projector', 'computer', 'airConditioner', 'light')
+LOG_OPERATIONS = ('开启设备', '关闭设备', '连接设备', '断开设备')
+
+
+def seed_database(conn, class_count=500, device_count=20000, log_count=1000000,
+                  batch_size=10000, days=90, progress=None):
+    """
+    向已执行迁移的空数据库写入基准测试数据
+
+    - 班级: class_count个, 每个班级一间教室
+    - 设备: device_count个, 约5%未分配班级, 约1/3为开启状态
+    - 操作日志: log_count条, 时间均匀分布在最近days天内
+    - 随机数种子固定, 相同参数生成的数据相同
+
+    Args:
+        progress: 每提交一批后调用progress(表名, 已写入行数)
+    """
+    rng = random.Random(20240101)
+    cursor = conn.cursor()
+
+    def write(table, query, rows):
+        batch = []
+        written = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(query, batch)
+                conn.commit()
+                written += len(batch)
+                batch = []
+                if progress:
+                    progress(table, written)
+        if batch:
+            cursor.executemany(query, batch)
+            conn.commit()
+            written += len(batch)
+            if progress:
+                progress(table, written)
+
+    write('classes', 'INSERT INTO classes (class_id, class_name, class_room, description) VALUES (?, ?, ?, ?)',
+          ((i, f'基准{i}班', f'教学楼{(i - 1) // 50 + 1}-{(i - 1) % 50 + 101}', '')
+           for i in range(1, class_count + 1)))
+
+    device_ids = [f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(device_count)]
+    write('devices', """
+        INSERT INTO devices (device_id, device_name, device_type, current_status, class_id)
+        VALUES (?, ?, ?, ?, ?)
+    """, ((device_id, f'设备{i}', DEVICE_TYPES[i % len(DEVICE_TYPES)], 'ON' if i % 3 == 0 else 'OFF',
+           None if i % 20 == 19 or not class_count else i % class_count + 1)
+          for i, device_id in enumerate(device_ids)))
+
+    if device_ids:
+        start = datetime.now().replace(microsecond=0) - timedelta(days=days)
+        step = days * 86400 / max(log_count, 1)
+        write('operation_logs', 'INSERT INTO operation_logs (device_id, operation, operation_time) VALUES (?, ?, ?)',
+              ((rng.choice(device_ids), rng.choice(LOG_OPERATIONS), start + timedelta(seconds=int(i * step)))
+               for i in range(log_count)))
+
+
+class QueryCounter:
+    """
+    按请求统计执行的SQL语句数(不含BEGIN/COMMIT/ROLLBACK)
+
+    请求开始时在处理请求的线程中调用begin(key), 之后该线程执行的查询都计入key, 直到下一个请求开始;
+    流式响应(如日志导出)在发送响应体时仍在同一线程中查询, 因此压测客户端读完响应体后再调用pop(key)读取查询数。
+    触发器每处理一行都会重复报告所在的语句, 因此连续相同的语句只计一次
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._keys = itertools.count(1)
+
+    def new_key(self):
+        """生成请求标识, 由压测客户端通过X-Bench-Request请求头发送"""
+        return str(next(self._keys))
+
+    def begin(self, key):
+        self._local.key = key
+        self._local.last = None
+        if key is not None:
+            with self._lock:
+                self._counts[key] = 0
+
+    def pop(self, key):
+        """返回key的查询数并停止统计, 没有记录时返回None"""
+        with self._lock:
+            return self._counts.pop(key, None)
+
+    def trace(self, statement):
+        key = getattr(self._local, 'key', None)
+        if key is None:
+            return
+        keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+        if keyword in ('BEGIN', 'COMMIT', 'ROLLBACK') or statement.startswith('--'):
+            return
+        if statement == self._local.last:
+            return
+        self._local.last = statement
+        with self._lock:
+            if key in self._counts:
+                self._counts[key] += 1
+
+    def install(self, backend):
+        """让backend之后建立的连接都报告执行的语句(只支持sqlite3连接)"""
+        connect = backend.connect
+
+        def traced_connect():
+            conn = connect()
+            conn.set_trace_callback(self.trace)
+            return conn
+        backend.connect = traced_connect
+
+
+class BenchContext:
+    """
+    生成请求所需的数据: 从数据库中抽样的班级/设备/日志ID, 以及压测过程中新建、待删除的记录
+    """
+
+    def __init__(self, cursor, sample_size=1000, seed=1):
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self.created = {'classes': deque(), 'devices': deque()}
+
+        cursor.execute('SELECT class_id FROM classes ORDER BY class_id LIMIT ?', (sample_size,))
+        self.class_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT device_id FROM devices ORDER BY device_id LIMIT ?', (sample_size,))
+        self.device_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT log_id FROM operation_logs ORDER BY log_id DESC LIMIT ?', (sample_size,))
+        self.log_ids = [row[0] for row in cursor.fetchall()]
+        self.class_devices = {}
+        for class_id in self.class_ids[:50]:
+            cursor.execute('SELECT device_id FROM devices WHERE class_id = ?', (class_id,))
+            self.class_devices[class_id] = [row[0] for row in cursor.fetchall()]
+        if not (self.class_ids and self.device_ids):
+            raise ValueError('数据库中没有班级或设备, 请先执行 flask bench-seed')
+
+    def pick(self, name):
+        with self._lock:
+            return self.rng.choice(getattr(self, name))
+
+    def sequence(self):
+        with self._lock:
+            self._sequence += 1
+            return f'{int(time.time())}-{self._sequence}'
+
+    def remember(self, kind, value):
+        self.created[kind].append(value)
+
+    def take(self, kind):
+        try:
+            return self.created[kind].popleft()
+        except IndexError:
+            return None
+
+
+def _assign_request(ctx):
+    # 按班级现有设备重新分配, 不改变数据
+    class_id = ctx.rng.choice(list(ctx.class_devices))
+    return 'POST', f'/api/classes/{class_id}/assign-devices', {'device_ids': ctx.class_devices[class_id]}
+
+
+def _import_body(ctx):
+    return {'classes': [{'class_name': f'导入{ctx.sequence()}班', 'class_room': '教学楼1-101'}],
+            'devices': [{'device_id': f'import-{ctx.sequence()}', 'device_name': '导入设备',
+                         'device_type': 'light'}]}
+
+
+# 接口列表: (名称, 生成请求的函数), 函数返回(方法, 路径, JSON请求体)
+# 未包含的接口: DELETE /api/logs和POST /api/system/retention(会清空基准数据),
+# /api/events(不会结束的事件流), /logout(会清除登录状态),
+# HTML页面(/、/logs、/login: 模板文件不在templates目录中, 当前部署方式下只会返回500)
+ENDPOINTS = [
+    ('classes', lambda ctx: ('GET', '/api/classes', None)),
+    ('class_detail', lambda ctx: ('GET', f"/api/classes/{ctx.pick('class_ids')}", None)),
+    ('class_devices', lambda ctx: ('GET', f"/api/classes/{ctx.pick('class_ids')}/devices", None)),
+    ('undefined_devices', lambda ctx: ('GET', '/api/classes/undefined/devices', None)),
+    ('devices', lambda ctx: ('GET', '/api/devices', None)),
+    ('devices_filtered', lambda ctx: (
+        'GET', '/api/devices?' + urlencode({'type': ctx.rng.choice(DEVICE_TYPES), 'status': 'ON',
+                                            'fields': 'device_id,device_name,current_status'}), None)),
+    ('device_detail', lambda ctx: ('GET', f"/api/devices/{ctx.pick('device_ids')}", None)),
+    ('device_data', lambda ctx: ('GET', f"/api/devices/{ctx.pick('device_ids')}/data", None)),
+    ('device_series', lambda ctx: ('GET', f"/api/devices/{ctx.pick('device_ids')}/series", None)),
+    ('logs', lambda ctx: ('GET', '/api/logs', None)),
+    ('logs_deep_page', lambda ctx: ('GET', '/api/logs?page=50', None)),
+    ('logs_by_device', lambda ctx: ('GET', '/api/logs?' + urlencode({'device_id': ctx.pick('device_ids')}), None)),
+    ('logs_by_operation', lambda ctx: (
+        'GET', '/api/logs?' + urlencode({'operation': ctx.rng.choice(LOG_OPERATIONS)}), None)),
+    ('logs_export', lambda ctx: (
+        'GET', '/api/logs/export?' + urlencode({'format': 'ndjson', 'device_id': ctx.pick('device_ids')}), None)),
+    ('log_detail', lambda ctx: ('GET', f"/api/logs/{ctx.pick('log_ids')}", None)),
+    ('turn_on', lambda ctx: ('POST', f"/api/devices/{ctx.pick('device_ids')}/turn-on", None)),
+    ('turn_off', lambda ctx: ('POST', f"/api/devices/{ctx.pick('device_ids')}/turn-off", None)),
+    ('connect', lambda ctx: ('POST', f"/api/devices/{ctx.pick('device_ids')}/connect", None)),
+    ('disconnect', lambda ctx: ('POST', f"/api/devices/{ctx.pick('device_ids')}/disconnect", None)),
+    ('bulk_command', lambda ctx: (
+        'POST', '/api/devices/bulk-command',
+        {'command': ctx.rng.choice(('turn-on', 'turn-off')), 'class_id': ctx.pick('class_ids')})),
+    ('update_device', lambda ctx: (
+        'PUT', f"/api/devices/{ctx.pick('device_ids')}", {'device_name': f'设备{ctx.rng.randrange(100000)}'})),
+    ('update_class', lambda ctx: (
+        'PUT', f"/api/classes/{ctx.pick('class_ids')}", {'description': f'更新{ctx.rng.randrange(100000)}'})),
+    ('assign_devices', _assign_request),
+    ('create_class', lambda ctx: (
+        'POST', '/api/classes', {'class_name': f'压测{ctx.sequence()}班', 'class_room': '教学楼1-101'})),
+    ('delete_class', lambda ctx: ('DELETE', f"/api/classes/{ctx.take('classes') or 0}", None)),
+    ('create_device', lambda ctx: (
+        'POST', '/api/devices', {'device_id': f'bench-{ctx.sequence()}', 'device_name': '压测设备',
+                                 'device_type': 'light', 'class_id': ctx.pick('class_ids')})),
+    ('delete_device', lambda ctx: ('DELETE', f"/api/devices/{ctx.take('devices') or 'missing'}", None)),
+    ('import_dry_run', lambda ctx: ('POST', '/api/import?format=json&dry_run=1', _import_body(ctx))),
+    ('pool_stats', lambda ctx: ('GET', '/api/db/pool-stats', None)),
+    ('log_writer', lambda ctx: ('GET', '/api/system/log-writer', None)),
+    ('background_tasks', lambda ctx: ('GET', '/api/system/background-tasks', None)),
+    ('retention_status', lambda ctx: ('GET', '/api/system/retention', None)),
+    ('registry', lambda ctx: ('GET', '/api/system/registry', None)),
+    ('boot', lambda ctx: ('GET', '/api/system/boot', None)),
+    ('event_stats', lambda ctx: ('GET', '/api/system/events', None)),
+    ('metrics', lambda ctx: ('GET', '/metrics', None))
+]
+
+
+def _remember_created(ctx, method, path, body, status, data):
+    """记录新建的班级和设备, 供之后的删除接口使用"""
+    if method != 'POST' or status != 201:
+        return
+    if path == '/api/classes':
+        ctx.remember('classes', json.loads(data)['class_id'])
+    elif path == '/api/devices':
+        ctx.remember('devices', body['device_id'])
+
+
+def _auth_headers(app):
+    """/metrics需要的令牌(METRICS_TOKEN), 随每个请求发送"""
+    token = app.config.get('METRICS_TOKEN')
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+
+def percentile(values, fraction):
+    """最近秩法分位数, values需已排序"""
+    if not values:
+        return 0.0
+    index = max(int(len(values) * fraction + 0.999999) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def _bench_headers(app, counter):
+    """每个请求的请求头和查询计数标识"""
+    headers = _auth_headers(app)
+    if counter is None:
+        return headers, None
+    key = counter.new_key()
+    headers['X-Bench-Request'] = key
+    return headers, key
+
+
+def _query_count(counter, key):
+    return counter.pop(key) if counter is not None else None
+
+
+class _TestClientDriver:
+    """通过Flask测试客户端发送请求(不经过网络和WSGI服务器)"""
+
+    def __init__(self, app, username, counter=None):
+        self._app = app
+        self._username = username
+        self._counter = counter
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._app.test_client()
+            with client.session_transaction() as session:
+                session['username'] = self._username
+            self._local.client = client
+        return client
+
+    def request(self, method, path, body):
+        headers, key = _bench_headers(self._app, self._counter)
+        response = self._client().open(path, method=method, json=body, headers=headers)
+        try:
+            data = response.get_data()
+        finally:
+            response.close()
+        return response.status_code, data, _query_count(self._counter, key)
+
+    def close(self):
+        pass
+
+
+class _ServerDriver:
+    """在本机启动多线程WSGI服务器(werkzeug), 通过HTTP发送请求"""
+
+    def __init__(self, app, username, password, counter=None):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self._server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bench-server', daemon=True)
+        self._thread.start()
+        self.port = self._server.server_port
+        self._app = app
+        self._counter = counter
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        connection.request('POST', '/login', urlencode({'username': username, 'password': password}),
+                           {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = connection.getresponse()
+        response.read()
+        self._cookie = response.getheader('Set-Cookie', '').split(';', 1)[0]
+        connection.close()
+        if not self._cookie:
+            raise RuntimeError('登录失败, 无法获取会话Cookie')
+
+    def request(self, method, path, body):
+        headers, key = _bench_headers(self._app, self._counter)
+        headers['Cookie'] = self._cookie
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            status, data = response.status, response.read()
+        finally:
+            connection.close()
+        return status, data, _query_count(self._counter, key)
+
+    def close(self):
+        self._server.shutdown()
+        self._thread.join()
+
+
+def endpoint_benchmark(app, ctx, mode='client', requests=100, concurrency=8, endpoints=None,
+                       username='admin', password='admin123', counter=None):
+    """
+    依次压测各接口, 每个接口用concurrency个线程共发送requests个请求
+
+    Args:
+        mode: client(Flask测试客户端) / server(本机WSGI服务器, 包含HTTP解析和网络开销)
+        endpoints: 只压测指定名称的接口, 默认全部
+        counter: 已安装到数据库后端的QueryCounter, 应用需在请求开始时调用counter.begin(X-Bench-Request请求头)
+
+    Returns:
+        rows: [{'endpoint', 'requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries'}]
+        queries为每个请求的平均查询数(包括流式响应发送响应体时的查询), 没有counter时为None
+    """
+    selected = [item for item in ENDPOINTS if endpoints is None or item[0] in endpoints]
+    if mode == 'server':
+        driver = _ServerDriver(app, username, password, counter)
+    else:
+        driver = _TestClientDriver(app, username, counter)
+
+    def call(build):
+        method, path, body = build(ctx)
+        started = time.perf_counter()
+        status, data, queries = driver.request(method, path, body)
+        elapsed = time.perf_counter() - started
+        _remember_created(ctx, method, path, body, status, data)
+        return elapsed, status, queries
+
+    rows = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+            for name, build in selected:
+                started = time.perf_counter()
+                results = list(executor.map(lambda _: call(build), range(requests)))
+                wall = time.perf_counter() - started
+
+                latencies = sorted(result[0] * 1000 for result in results)
+                queries = [result[2] for result in results if result[2] is not None]
+                rows.append({
+                    'endpoint': name,
+                    'requests': len(results),
+                    'errors': sum(1 for result in results if result[1] >= 400),
+                    'throughput': len(results) / wall if wall else 0.0,
+                    'p50_ms': percentile(latencies, 0.50),
+                    'p95_ms': percentile(latencies, 0.95),
+                    'p99_ms': percentile(latencies, 0.99),
+                    'queries': sum(queries) / len(queries) if queries else None
+                })
+    finally:
+        driver.close()
+    return rows
+
+
+def compare_with_baseline(rows, baseline, tolerance=0.2, min_delta_ms=1.0):
+    """
+    与基线结果比较
+
+    - p95延迟超过基线(1 + tolerance)倍且多于min_delta_ms毫秒
+    - 吞吐量低于基线(1 - tolerance)倍
+    - 每个请求的平均查询数比基线多0.5次以上
+    - 出错的请求比基线多
+
+    Args:
+        baseline: {接口名称: 结果行}, 即save_baseline保存的内容
+
+    Returns:
+        regressions: ['<接口>: <说明>']
+    """
+    regressions = []
+    for row in rows:
+        base = baseline.get(row['endpoint'])
+        if base is None:
+            continue
+        name = row['endpoint']
+        if row['p95_ms'] > base['p95_ms'] * (1 + tolerance) and row['p95_ms'] - base['p95_ms'] > min_delta_ms:
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f}ms -> {row['p95_ms']:.2f}ms")
+        if row['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐量 {base['throughput']:.1f}/s -> {row['throughput']:.1f}/s")
+        if row['queries'] is not None and base.get('queries') is not None and row['queries'] > base['queries'] + 0.5:
+            regressions.append(f"{name}: 查询数 {base['queries']:.1f} -> {row['queries']:.1f}")
+        if row['errors'] > base.get('errors', 0):
+            regressions.append(f"{name}: 错误数 {base.get('errors', 0)} -> {row['errors']}")
+    return regressions
+
+
+def load_baseline(path, mode):
+    """读取基线文件中指定模式的结果, 文件不存在时返回None"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return data.get(mode)
+
+
+def save_baseline(path, mode, rows, params):
+    """
+    把结果按模式写入基线文件(保留其他模式的结果)
+
+    有出错请求的结果不能作为基线(否则之后只能发现错误数的变化), 此时抛出ValueError, 不修改基线文件
+    """
+    erroring = [row['endpoint'] for row in rows if row['errors']]
+    if erroring:
+        raise ValueError(f"以下接口有出错的请求, 未保存{mode}模式的基线: {', '.join(erroring)}")
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    data[mode] = {row['endpoint']: row for row in rows}
+    data.setdefault('params', {})[mode] = params
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    线程安全的有界TTL缓存
+
+    - max_size: 最大条目数, 超出时淘汰最久未使用的条目
+    - ttl: 条目存活秒数, 过期条目在读取时视为未命中
+    """
+
+    def __init__(self, max_size=256, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0
+            }
+
+
+class DataVersions:
+    """
+    进程内的数据版本号, 用于列表接口的条件请求(ETag/Last-Modified)
+
+    - 每个数据集合(如devices、classes、logs)有一个单调递增的版本号
+    - 写操作提交后调用bump()使版本号加一并记录修改时间
+    - 列表接口在查询数据库之前读取版本号, 保证返回的ETag不会比数据新
+    """
+
+    def __init__(self, names):
+        now = time.time()
+        self._lock = threading.Lock()
+        self._versions = {name: 0 for name in names}
+        self._modified = {name: now for name in names}
+
+    def bump(self, *names):
+        now = time.time()
+        with self._lock:
+            for name in names:
+                self._versions[name] += 1
+                self._modified[name] = now
+
+    def get(self, *names):
+        """
+        Returns:
+            (versions, last_modified): 各集合的版本号元组, 以及其中最近的修改时间(秒)
+        """
+        with self._lock:
+            return (tuple(self._versions[name] for name in names),
+                    max(self._modified[name] for name in names))
+
+    def stats(self):
+        with self._lock:
+            return {name: {'version': self._versions[name], 'modified_at': self._modified[name]}
+                    for name in self._versions}
@@ -0,0 +1,52 @@
+"""
+响应压缩
+
+- 按请求头Accept-Encoding协商brotli(安装了brotli时)或gzip
+- 只压缩超过min_size字节的非流式响应, 已编码、304等无响应体的响应不处理
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli是可选依赖
+    brotli = None
+
+# 服务器支持的编码, 客户端权重相同时优先使用靠前的编码
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0使相同内容的压缩结果相同
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def compress_response(response, accept_encodings, min_size=1024, gzip_level=6, brotli_quality=4):
+    """
+    按协商结果压缩响应体, 并设置Content-Encoding和Vary
+
+    Args:
+        response: Flask响应对象
+        accept_encodings: request.accept_encodings
+
+    Returns:
+        使用的编码, 未压缩时返回None
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers):
+        return None
+
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return None
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return None
+
+    response.set_data(compress(data, encoding, gzip_level, brotli_quality))
+    response.headers['Content-Encoding'] = encoding
+    return encoding
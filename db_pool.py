@@ -0,0 +1,288 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(Exception):
+    """在等待超时时间内未能从连接池获取到连接"""
+
+
+class ConnectionThreadError(RuntimeError):
+    """连接在借出它的线程之外被使用"""
+
+
+class ConnectionPool:
+    """
+    有界、线程安全的数据库连接池
+
+    - min_size: 连接池预热时建立的最少连接数
+    - max_size: 同时存在(空闲+借出)的最大连接数
+    - timeout: 连接池耗尽时等待空闲连接的最长秒数
+    - max_lifetime: 连接最长存活秒数, 超过后归还时关闭并重建
+    - ping_interval: 连接空闲超过该秒数后, 复用前执行一次存活检查
+
+    线程安全:
+    - pyodbc.threadsafety为1: 线程之间可以共享模块, 不能共享连接和游标;
+      sqlite3连接以check_same_thread=False打开, 同样不能被多个线程同时使用
+    - 连接池保证一个连接同一时间只借给一个线程, 借出的连接不能交给其他线程使用
+      (请求内的PooledConnection会检查, 跨线程使用时抛出ConnectionThreadError)
+    - 连接不能跨进程使用: 多进程部署时每个worker在fork之后创建自己的连接池
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, ping_interval=30.0, ping_sql='SELECT 1'):
+        if max_size < 1:
+            raise ValueError('max_size必须大于0')
+        if min_size < 0 or min_size > max_size:
+            raise ValueError('min_size必须在0和max_size之间')
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self.ping_sql = ping_sql
+
+        # 空闲连接: (连接, 创建时间, 最近归还时间)
+        self._idle = deque()
+        # 借出连接: id(连接) -> 创建时间
+        self._in_use = {}
+        self._opening = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+
+        # 统计信息
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'acquired': 0,
+            'released': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'ping_failures': 0,
+            'recycled': 0
+        }
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _close_raw(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['connections_closed'] += 1
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.ping_sql)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _expired(self, created_at, now):
+        return self.max_lifetime and now - created_at >= self.max_lifetime
+
+    def prefill(self):
+        """建立连接直到空闲连接数达到min_size"""
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) >= self.min_size or self._size() >= self.max_size:
+                    return
+                self._opening += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._opening -= 1
+                self._stats['connections_created'] += 1
+                self._idle.append((conn, now, now))
+                self._cond.notify()
+
+    def acquire(self):
+        """
+        从连接池借出一个连接
+
+        优先复用空闲连接(必要时做存活检查和寿命回收);
+        连接数未达上限时新建连接; 否则等待其他请求归还, 超时抛出PoolTimeoutError
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError('连接池已关闭')
+
+                while not self._idle and self._size() >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f'等待数据库连接超时({self.timeout}秒, 连接池上限{self.max_size})')
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    self._in_use[id(conn)] = created_at
+                    opening = False
+                else:
+                    conn = None
+                    self._opening += 1
+                    opening = True
+
+            now = time.monotonic()
+            if not opening:
+                # 超过最大存活时间的连接直接回收
+                if self._expired(created_at, now):
+                    self._discard(conn, recycled=True)
+                    continue
+                # 空闲较久的连接在复用前检查存活
+                if now - released_at >= self.ping_interval and not self._is_alive(conn):
+                    with self._cond:
+                        self._stats['ping_failures'] += 1
+                    self._discard(conn)
+                    continue
+            else:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use[id(conn)] = created_at
+                    self._stats['connections_created'] += 1
+
+            with self._cond:
+                self._stats['acquired'] += 1
+                if waited:
+                    wait_time = time.monotonic() - started
+                    self._stats['waits'] += 1
+                    self._stats['wait_time_total'] += wait_time
+                    self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            return conn
+
+    def _discard(self, conn, recycled=False):
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            if recycled:
+                self._stats['recycled'] += 1
+            self._cond.notify()
+        self._close_raw(conn)
+
+    def release(self, conn, broken=False):
+        """
+        归还连接
+
+        未提交的事务会被回滚; 已损坏或超过寿命的连接直接关闭
+        """
+        with self._cond:
+            created_at = self._in_use.get(id(conn))
+        if created_at is None:
+            # 不属于本连接池的连接
+            self._close_raw(conn)
+            return
+
+        if not broken:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+
+        now = time.monotonic()
+        if broken or self._closed or self._expired(created_at, now):
+            self._discard(conn, recycled=not broken and not self._closed)
+            return
+
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            self._idle.append((conn, created_at, now))
+            self._stats['released'] += 1
+            self._cond.notify()
+
+    def close(self):
+        """关闭连接池及所有空闲连接, 借出的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_raw(conn)
+
+    def stats(self):
+        """返回连接池当前状态和累计统计"""
+        with self._cond:
+            result = dict(self._stats)
+            result.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'size': self._size()
+            })
+        result['wait_time_avg'] = (result['wait_time_total'] / result['waits']) if result['waits'] else 0.0
+        return result
+
+
+class PooledConnection:
+    """
+    请求范围内使用的连接包装
+
+    路由中原有的conn.close()调用不会真正关闭连接,
+    连接在请求结束时(teardown)统一归还连接池。
+    只能在创建它的线程中使用(pyodbc连接不是线程安全的)
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_broken', False)
+        object.__setattr__(self, '_owner', threading.get_ident())
+
+    def close(self):
+        # 由teardown负责归还, 这里保持空操作
+        pass
+
+    def mark_broken(self):
+        object.__setattr__(self, '_broken', True)
+
+    def release(self):
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        self._pool.release(conn, broken=self._broken)
+
+    def _check_thread(self):
+        if threading.get_ident() != self._owner:
+            raise ConnectionThreadError('数据库连接不能在借出它的线程之外使用')
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise RuntimeError('连接已归还连接池')
+        self._check_thread()
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        self._check_thread()
+        setattr(self._conn, name, value)
@@ -0,0 +1,325 @@
+"""
+设备控制命令下发
+
+- 命令按教室(班级)排队, 每个教室同时下发的命令数不超过class_concurrency, 避免压垮教室网关
+- 同一设备尚未下发的命令被新命令取代(如先开后关, 下发前只保留关), 取代的命令不下发也不记录日志
+- 同一设备同时只有一条命令在下发, 保证按提交顺序生效
+- 下发失败(transport抛出TransportError)时按指数退避重试, 达到max_attempts次后放弃并调用on_failed
+- 设备确认(transport.send正常返回)后才调用on_ack更新设备状态和写入操作日志
+
+传输方式(transport)需实现send(command): 设备确认后返回, 失败或超时抛出TransportError;
+SimulatorTransport在本地模拟网关的延迟和失败, 用于开发和测试
+
+命令只保存在进程内存中, 进程退出时close()最多等待timeout秒, 仍未下发的命令丢弃
+"""
+import heapq
+import importlib
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class TransportError(Exception):
+    """下发失败(网关无响应、超时、设备未确认), 可以重试"""
+
+
+class DispatcherClosedError(RuntimeError):
+    """调度器已停止, 不再接受命令"""
+
+
+class DeviceCommand:
+    """
+    一条待下发的命令
+
+    Attributes:
+        command: connect / disconnect / turn-on / turn-off
+        status: 命令生效后的设备状态(ON / OFF)
+        attempts: 已下发的次数
+    """
+
+    def __init__(self, device_id, class_id, command, status):
+        self.device_id = device_id
+        self.class_id = class_id
+        self.command = command
+        self.status = status
+        self.attempts = 0
+        self.submitted_at = time.monotonic()
+        self.not_before = 0.0  # 重试退避期间不下发
+
+
+class _Classroom:
+    def __init__(self):
+        # device_id -> DeviceCommand, 按提交顺序下发; 被同一教室的新命令取代时保留原来的位置
+        self.pending = OrderedDict()
+        self.in_flight = set()  # 本教室正在下发的设备ID, 用于并发限制
+
+
+class CommandDispatcher:
+    """
+    按教室限流的命令调度器
+
+    Args:
+        transport: 传输方式, send(command)
+        on_ack: 设备确认后以命令为参数调用(在下发线程中, 调用期间同一设备的下一条命令不会下发)
+        on_failed: 放弃重试后以(命令, 异常)为参数调用
+        class_concurrency: 每个教室同时下发的命令数
+        workers: 下发线程数(所有教室共用)
+        max_attempts: 每条命令最多下发的次数
+        backoff: 第一次重试前等待的秒数, 之后每次翻倍(加随机抖动)
+        backoff_max: 重试等待的最长秒数
+    """
+
+    def __init__(self, transport, on_ack, on_failed=None, class_concurrency=4, workers=32,
+                 max_attempts=5, backoff=0.5, backoff_max=30.0):
+        self.transport = transport
+        self._on_ack = on_ack
+        self._on_failed = on_failed
+        self.class_concurrency = class_concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._classes = {}
+        # 按设备索引的等待下发和正在下发的命令(不分教室), 设备换了教室也只保留一条等待的命令,
+        # 且上一条命令下发完成前不会下发下一条
+        self._pending = {}
+        self._in_flight = {}
+        self._runnable = set()  # 可能有命令可以下发的教室
+        self._timers = []  # (到期时间, 序号, class_id), 重试退避结束后重新检查该教室
+        self._sequence = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='command-sender')
+        self._thread = None
+        self._closed = False
+
+        self._stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'dispatched': 0,
+            'acked': 0,
+            'retries': 0,
+            'failed': 0,
+            'dropped': 0,
+            'ack_errors': 0
+        }
+        self._errors = deque(maxlen=20)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='command-dispatcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, device_id, class_id, command, status):
+        """
+        提交命令
+
+        Returns:
+            'queued', 或'coalesced'(取代了该设备尚未下发的命令)
+        """
+        with self._cond:
+            if self._closed:
+                raise DispatcherClosedError('命令调度器已停止')
+            self._ensure_started()
+            room = self._classes.get(class_id)
+            if room is None:
+                room = self._classes[class_id] = _Classroom()
+            previous = self._pending.get(device_id)
+            if previous is not None and previous.class_id != class_id:
+                # 设备已换到其他教室, 从原教室的队列中移除
+                del self._classes[previous.class_id].pending[device_id]
+            result = 'coalesced' if previous is not None else 'queued'
+            command = DeviceCommand(device_id, class_id, command, status)
+            room.pending[device_id] = self._pending[device_id] = command
+            self._stats['submitted'] += 1
+            if result == 'coalesced':
+                self._stats['coalesced'] += 1
+            self._runnable.add(class_id)
+            self._cond.notify()
+        return result
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    self._runnable.add(heapq.heappop(self._timers)[2])
+                for class_id in self._runnable:
+                    self._dispatch_class(class_id, now)
+                self._runnable.clear()
+                if self._closed and not self._busy():
+                    self._cond.notify_all()
+                    return
+                timeout = self._timers[0][0] - now if self._timers else None
+                self._cond.wait(timeout)
+
+    def _dispatch_class(self, class_id, now):
+        """在教室的并发限制内下发可以下发的命令(持有锁时调用)"""
+        room = self._classes[class_id]
+        for device_id, command in list(room.pending.items()):
+            if len(room.in_flight) >= self.class_concurrency:
+                return
+            if device_id in self._in_flight or command.not_before > now:
+                continue
+            del room.pending[device_id]
+            del self._pending[device_id]
+            room.in_flight.add(device_id)
+            self._in_flight[device_id] = command
+            self._stats['dispatched'] += 1
+            self._executor.submit(self._send, command)
+
+    def _send(self, command):
+        command.attempts += 1
+        try:
+            self.transport.send(command)
+        except TransportError as e:
+            self._finish(command, e)
+            return
+        except Exception as e:
+            print(f"下发设备命令时出错: {str(e)}")
+            self._finish(command, e, retry=False)
+            return
+
+        try:
+            self._on_ack(command)
+        except Exception as e:
+            print(f"设备命令确认处理出错: {str(e)}")
+            with self._cond:
+                self._stats['ack_errors'] += 1
+        self._finish(command, None)
+
+    def _finish(self, command, error, retry=True):
+        failed = False
+        with self._cond:
+            room = self._classes[command.class_id]
+            room.in_flight.discard(command.device_id)
+            del self._in_flight[command.device_id]
+            waiting = self._pending.get(command.device_id)
+            if waiting is not None:
+                # 该设备等待中的命令可能在其他教室的队列中
+                self._runnable.add(waiting.class_id)
+            if error is None:
+                self._stats['acked'] += 1
+            elif waiting is not None:
+                # 下发期间已有新命令, 不再重试
+                self._stats['coalesced'] += 1
+            elif retry and command.attempts < self.max_attempts and not self._closed:
+                delay = min(self.backoff * 2 ** (command.attempts - 1), self.backoff_max)
+                command.not_before = time.monotonic() + delay * random.uniform(0.5, 1.0)
+                room.pending[command.device_id] = self._pending[command.device_id] = command
+                heapq.heappush(self._timers, (command.not_before, next(self._sequence), command.class_id))
+                self._stats['retries'] += 1
+            else:
+                failed = True
+                self._stats['failed'] += 1
+                self._errors.appendleft({
+                    'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'device_id': command.device_id,
+                    'command': command.command,
+                    'attempts': command.attempts,
+                    'error': str(error)
+                })
+            self._runnable.add(command.class_id)
+            self._cond.notify_all()
+
+        if failed and self._on_failed is not None:
+            try:
+                self._on_failed(command, error)
+            except Exception as e:
+                print(f"设备命令失败处理出错: {str(e)}")
+
+    def _busy(self):
+        return bool(self._pending or self._in_flight)
+
+    def close(self, timeout=10.0):
+        """停止接受命令, 等待已提交的命令下发完成(不再安排新的重试), 超时后丢弃剩余命令"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while self._busy():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            dropped = len(self._pending)
+            self._pending.clear()
+            for room in self._classes.values():
+                room.pending.clear()
+            self._stats['dropped'] += dropped
+            self._cond.notify_all()
+        if dropped:
+            print(f"命令调度器停止, 丢弃{dropped}条未下发的命令")
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._cond:
+            result = dict(self._stats)
+            result['pending'] = len(self._pending)
+            result['in_flight'] = len(self._in_flight)
+            result['busy_classes'] = sum(1 for room in self._classes.values() if room.pending or room.in_flight)
+            result['recent_failures'] = list(self._errors)
+        result['transport'] = getattr(self.transport, 'name', type(self.transport).__name__)
+        result['class_concurrency'] = self.class_concurrency
+        result['running'] = self._thread is not None and self._thread.is_alive()
+        return result
+
+
+class SimulatorTransport:
+    """
+    本地模拟网关: 每条命令等待latency秒(加0~jitter秒随机抖动)后确认, 按failure_rate的概率失败
+
+    记录每个教室同时处理的最大命令数和确认的命令, 用于验证并发限制、合并和重试
+    """
+    name = 'simulator'
+
+    def __init__(self, latency=0.05, jitter=0.02, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._active = {}
+        self.max_active = {}  # class_id -> 同时处理的最大命令数
+        self.acked = deque(maxlen=10000)  # (device_id, command, attempts)
+        self.failures = 0
+
+    def send(self, command):
+        with self._lock:
+            active = self._active.get(command.class_id, 0) + 1
+            self._active[command.class_id] = active
+            self.max_active[command.class_id] = max(self.max_active.get(command.class_id, 0), active)
+            failed = self._random.random() < self.failure_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        try:
+            time.sleep(delay)
+            with self._lock:
+                if failed:
+                    self.failures += 1
+                else:
+                    self.acked.append((command.device_id, command.command, command.attempts))
+            if failed:
+                raise TransportError('模拟网关无响应')
+        finally:
+            with self._lock:
+                self._active[command.class_id] -= 1
+
+
+def create_transport(config):
+    """
+    按DEVICE_TRANSPORT配置创建传输方式
+
+    - simulator: SimulatorTransport(SIMULATOR_LATENCY / SIMULATOR_FAILURE_RATE)
+    - 模块:工厂函数, 如"gateway:create_transport": 以app.config为参数调用工厂函数
+    """
+    spec = config['DEVICE_TRANSPORT']
+    if spec == 'simulator':
+        return SimulatorTransport(latency=config['SIMULATOR_LATENCY'],
+                                  failure_rate=config['SIMULATOR_FAILURE_RATE'])
+    module_name, _, factory = spec.partition(':')
+    if not module_name or not factory:
+        raise ValueError(f"DEVICE_TRANSPORT格式不正确: {spec}")
+    return getattr(importlib.import_module(module_name), factory)(config)
@@ -0,0 +1,115 @@
+import itertools
+import json
+import queue
+import threading
+
+
+class EventBroker:
+    """
+    进程内事件分发, 用于Server-Sent Events推送
+
+    - 每个订阅者持有一个有界队列, 队列满时丢弃该订阅者最旧的事件
+    - 订阅时可指定班级ID集合, 只接收涉及这些班级的事件
+    - 只能分发本进程内发布的事件; 多进程部署时各worker的订阅者只收到本worker的写操作
+    - close()结束所有事件流(worker平滑退出时调用), 客户端按retry自动重连到其他worker
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.dropped = 0
+        self.closed = False
+
+    def subscribe(self, class_ids=None):
+        """
+        Args:
+            class_ids: 关注的班级ID集合, None表示接收全部事件; 0表示未分配班级
+
+        Returns:
+            订阅者队列, 使用完毕后调用unsubscribe
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[subscriber] = set(class_ids) if class_ids is not None else None
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def publish(self, event, data, class_ids=()):
+        """
+        发布事件
+
+        Args:
+            event: 事件类型
+            data: 可JSON序列化的事件内容
+            class_ids: 事件涉及的班级ID(None会被视为0, 即未分配班级)
+        """
+        class_ids = {class_id or 0 for class_id in class_ids}
+        message = (next(self._ids), event, json.dumps(data, ensure_ascii=False, default=str))
+        with self._lock:
+            targets = [subscriber for subscriber, interest in self._subscribers.items()
+                       if interest is None or interest & class_ids]
+            self.published += 1
+
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # 客户端消费过慢时丢弃最旧的事件, 客户端可据此重新加载
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    pass
+                with self._lock:
+                    self.dropped += 1
+
+    def close(self):
+        """结束所有事件流, 之后的订阅立即结束"""
+        with self._lock:
+            self.closed = True
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            # 用None通知stream结束, 队列已满时丢弃最旧的事件腾出位置
+            while True:
+                try:
+                    subscriber.put_nowait(None)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def stream(self, subscriber, heartbeat=15.0, retry=3000):
+        """
+        生成SSE文本流, 超过heartbeat秒没有事件时发送注释行作为心跳
+        """
+        yield f'retry: {retry}\n\n'
+        while not self.closed:
+            try:
+                message = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if message is None:
+                return
+            event_id, event, data = message
+            yield f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'closed': self.closed
+            }
@@ -0,0 +1,5 @@
+"""gunicorn配置文件: 在项目目录执行gunicorn app:app时自动加载, 与flask serve使用相同的SERVE_*配置"""
+from app import app
+from server import gunicorn_options
+
+globals().update(gunicorn_options(app.config))
@@ -0,0 +1,378 @@
+"""
+班级和设备批量导入
+
+- load_records: 解析CSV或JSON文件
+- plan_import: 在内存中校验, 批量查询已有的班级和设备, 生成导入计划(也就是dry-run的差异)
+- apply_import: 按计划用executemany分批写入, 每批一个事务
+
+JSON格式: {"classes": [...], "devices": [...]}, 或者只包含班级/设备的数组
+CSV格式: 每个文件只包含一种记录, 表头包含device_id时视为设备, 否则视为班级
+设备通过class_id或class_name引用班级, class_name可以引用同一文件中新建的班级
+设备的class_id为0表示不分配班级(upsert时取消已有的分配), class_id和class_name都为空时班级保持不变
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+CLASS_FIELDS = ('class_name', 'class_room', 'description')
+DEVICE_FIELDS = ('device_id', 'device_name', 'device_type', 'current_status', 'class_id')
+DEVICE_STATUSES = ('ON', 'OFF')
+
+# 字段最大长度, 与表结构一致
+FIELD_LENGTHS = {
+    'class_name': 100,
+    'class_room': 100,
+    'device_id': 50,
+    'device_name': 100,
+    'device_type': 50
+}
+
+
+class ImportFormatError(ValueError):
+    """导入文件无法解析"""
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def load_records(content, file_format, kind=None):
+    """
+    解析导入文件
+
+    Args:
+        content: 文件内容(str或bytes)
+        file_format: csv / json
+        kind: CSV文件的记录类型(classes / devices), 不指定时按表头判断
+
+    Returns:
+        (classes, devices): 记录列表, 每条记录带有_row(文件中的行号或数组下标, 从1开始)
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    elif content.startswith('\ufeff'):
+        content = content[1:]
+
+    if file_format == 'json':
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise ImportFormatError(f'JSON格式不正确: {str(e)}')
+        if isinstance(data, list):
+            if kind is None:
+                kind = 'devices' if data and isinstance(data[0], dict) and 'device_id' in data[0] else 'classes'
+            data = {kind: data}
+        if not isinstance(data, dict):
+            raise ImportFormatError('JSON文件应为对象或数组')
+        classes, devices = data.get('classes') or [], data.get('devices') or []
+        if not isinstance(classes, list) or not isinstance(devices, list):
+            raise ImportFormatError('classes和devices应为数组')
+        if not all(isinstance(item, dict) for item in classes + devices):
+            raise ImportFormatError('每条记录应为对象')
+        return ([dict(item, _row=i + 1) for i, item in enumerate(classes)],
+                [dict(item, _row=i + 1) for i, item in enumerate(devices)])
+
+    if file_format == 'csv':
+        reader = csv.DictReader(io.StringIO(content))
+        if not reader.fieldnames:
+            raise ImportFormatError('CSV文件缺少表头')
+        if kind is None:
+            kind = 'devices' if 'device_id' in reader.fieldnames else 'classes'
+        # 表头是第1行, 数据从第2行开始
+        records = [dict(row, _row=i + 2) for i, row in enumerate(reader)]
+        return (records, []) if kind == 'classes' else ([], records)
+
+    raise ImportFormatError('导入格式只能为csv或json')
+
+
+def _select_in(cursor, query, values, chunk_size):
+    """按chunk_size分批执行带IN (...)的查询, 返回全部结果"""
+    rows = []
+    values = list(values)
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        cursor.execute(query.format(placeholders=', '.join('?' * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _check_lengths(record, errors, kind, key):
+    for field, length in FIELD_LENGTHS.items():
+        if field in record and len(record[field]) > length:
+            errors.append({'kind': kind, 'row': record['_row'], 'key': key,
+                           'error': f'{field}长度不能超过{length}'})
+            return False
+    return True
+
+
+def _diff(record, existing, fields):
+    """返回{字段: [原值, 新值]}"""
+    return {field: [existing[field], record[field]] for field in fields
+            if record[field] != existing[field]}
+
+
+def plan_import(cursor, classes, devices, mode='insert', chunk_size=500):
+    """
+    校验记录并与数据库中已有的数据对比
+
+    Args:
+        mode: insert(已存在的班级/设备报错) / upsert(已存在的更新有变化的字段)
+
+    Returns:
+        plan: {
+            'mode': mode,
+            'classes': {'create': [...], 'update': [...], 'unchanged': [...]},
+            'devices': {'create': [...], 'update': [...], 'unchanged': [...]},
+            'errors': [{'kind', 'row', 'key', 'error'}]
+        }
+    """
+    errors = []
+    plan = {
+        'mode': mode,
+        'classes': {'create': [], 'update': [], 'unchanged': []},
+        'devices': {'create': [], 'update': [], 'unchanged': []},
+        'errors': errors
+    }
+
+    # 校验班级
+    valid_classes = {}
+    for item in classes:
+        record = {'_row': item['_row']}
+        for field in CLASS_FIELDS:
+            record[field] = _text(item.get(field))
+        name = record['class_name']
+        if not name:
+            errors.append({'kind': 'class', 'row': record['_row'], 'key': None, 'error': '班级名称不能为空'})
+        elif name in valid_classes:
+            errors.append({'kind': 'class', 'row': record['_row'], 'key': name, 'error': '班级名称在文件中重复'})
+        elif _check_lengths(record, errors, 'class', name):
+            valid_classes[name] = record
+
+    # 校验设备
+    valid_devices = {}
+    for item in devices:
+        record = {'_row': item['_row']}
+        for field in ('device_id', 'device_name', 'device_type', 'current_status', 'class_name'):
+            record[field] = _text(item.get(field))
+        record['current_status'] = record['current_status'].upper() or 'OFF'
+        # upsert时未提供(缺少或为空)的状态和班级保持不变; class_id为0表示取消分配班级
+        record['_keep_status'] = not _text(item.get('current_status'))
+        record['_keep_class'] = not _text(item.get('class_id')) and not _text(item.get('class_name'))
+        class_id = _text(item.get('class_id'))
+        device_id = record['device_id']
+        error = None
+        if not device_id or not record['device_name'] or not record['device_type']:
+            error = '设备ID、名称和类型不能为空'
+        elif device_id in valid_devices:
+            error = '设备ID在文件中重复'
+        elif record['current_status'] not in DEVICE_STATUSES:
+            error = '设备状态只能为ON或OFF'
+        else:
+            try:
+                record['class_id'] = int(class_id) if class_id and class_id != '0' else None
+            except ValueError:
+                error = '班级ID格式不正确'
+        if error:
+            errors.append({'kind': 'device', 'row': record['_row'], 'key': device_id or None, 'error': error})
+        elif _check_lengths(record, errors, 'device', device_id):
+            valid_devices[device_id] = record
+
+    # 批量查询已有的班级(按名称)
+    existing_classes = {}
+    names = set(valid_classes) | {record['class_name'] for record in valid_devices.values() if record['class_name']}
+    for row in _select_in(cursor, 'SELECT class_id, class_name, class_room, description FROM classes '
+                                  'WHERE class_name IN ({placeholders})', names, chunk_size):
+        existing_classes[row[1]] = {'class_id': row[0], 'class_name': row[1],
+                                    'class_room': row[2] or '', 'description': row[3] or ''}
+
+    for name, record in valid_classes.items():
+        existing = existing_classes.get(name)
+        if existing is None:
+            plan['classes']['create'].append(record)
+        elif mode != 'upsert':
+            errors.append({'kind': 'class', 'row': record['_row'], 'key': name, 'error': '班级名称已存在'})
+        else:
+            changes = _diff(record, existing, ('class_room', 'description'))
+            if changes:
+                plan['classes']['update'].append(dict(record, _changes=changes))
+            else:
+                plan['classes']['unchanged'].append(name)
+
+    # 批量检查按ID引用的班级
+    referenced_ids = {record['class_id'] for record in valid_devices.values() if record['class_id']}
+    known_ids = {row[0] for row in _select_in(cursor, 'SELECT class_id FROM classes WHERE class_id IN ({placeholders})',
+                                               referenced_ids, chunk_size)}
+    creating = {record['class_name'] for record in plan['classes']['create']}
+
+    # 批量查询已有的设备
+    existing_devices = {}
+    for row in _select_in(cursor, 'SELECT device_id, device_name, device_type, current_status, class_id FROM devices '
+                                  'WHERE device_id IN ({placeholders})', valid_devices, chunk_size):
+        existing_devices[row[0]] = dict(zip(DEVICE_FIELDS, row))
+
+    for device_id, record in valid_devices.items():
+        # 解析班级引用: class_name优先, 引用新建班级时写入时再确定ID
+        name = record.pop('class_name')
+        error = None
+        if name:
+            if name in existing_classes:
+                record['class_id'] = existing_classes[name]['class_id']
+            elif name in creating:
+                record['class_id'] = None
+                record['_class_name'] = name
+            else:
+                error = f'班级{name}不存在'
+        elif record['class_id'] is not None and record['class_id'] not in known_ids:
+            error = '指定的班级不存在'
+        if error:
+            errors.append({'kind': 'device', 'row': record['_row'], 'key': device_id, 'error': error})
+            continue
+
+        existing = existing_devices.get(device_id)
+        keep_status, keep_class = record.pop('_keep_status'), record.pop('_keep_class')
+        if existing is not None:
+            if keep_status:
+                record['current_status'] = existing['current_status']
+            if keep_class:
+                record['class_id'] = existing['class_id']
+        if existing is None:
+            plan['devices']['create'].append(record)
+        elif mode != 'upsert':
+            errors.append({'kind': 'device', 'row': record['_row'], 'key': device_id, 'error': '设备ID已存在'})
+        else:
+            changes = _diff(record, existing, DEVICE_FIELDS[1:])
+            if '_class_name' in record:
+                changes['class_id'] = [existing['class_id'], record['_class_name']]
+            if changes:
+                plan['devices']['update'].append(dict(record, _changes=changes, _old_class_id=existing['class_id']))
+            else:
+                plan['devices']['unchanged'].append(device_id)
+
+    return plan
+
+
+def summarize_plan(plan):
+    """dry-run结果: 每类记录的新增/更新/不变数量和明细"""
+    summary = {'mode': plan['mode'], 'errors': sorted(plan['errors'], key=lambda e: (e['kind'], e['row']))}
+    for kind, key in (('classes', 'class_name'), ('devices', 'device_id')):
+        section = plan[kind]
+        summary[kind] = {
+            'create': [record[key] for record in section['create']],
+            'update': [{'key': record[key], 'changes': record['_changes']} for record in section['update']],
+            'unchanged': section['unchanged']
+        }
+    return summary
+
+
+def _write_chunks(conn, cursor, executemany, query, items, chunk_size, errors, kind, key):
+    """
+    分批写入, 每批一个事务; 整批失败时逐行重试, 记录出错的行
+
+    Args:
+        items: [(record, params)]
+
+    Returns:
+        写入成功的记录
+    """
+    written = []
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        try:
+            executemany(cursor, query, [params for _, params in chunk])
+            conn.commit()
+            written.extend(record for record, _ in chunk)
+            continue
+        except Exception:
+            conn.rollback()
+        for record, params in chunk:
+            try:
+                cursor.execute(query, params)
+                conn.commit()
+                written.append(record)
+            except Exception as e:
+                conn.rollback()
+                errors.append({'kind': kind, 'row': record['_row'], 'key': record[key], 'error': str(e)})
+    return written
+
+
+def apply_import(conn, plan, executemany, chunk_size=500):
+    """
+    按导入计划写入数据库
+
+    Args:
+        executemany: 批量执行函数(cursor, query, rows), 如app.executemany
+        chunk_size: 每个事务写入的行数
+
+    Returns:
+        result: {'classes': {'created', 'updated'}, 'devices': {'created', 'updated'},
+                 'errors': [...], 'class_ids': 受影响的班级ID}
+    """
+    cursor = conn.cursor()
+    now = datetime.now().replace(microsecond=0)
+    errors = list(plan['errors'])
+    class_ids = set()
+
+    # 班级: 新增和更新
+    created_classes = _write_chunks(
+        conn, cursor, executemany,
+        'INSERT INTO classes (class_name, class_room, description, update_time) VALUES (?, ?, ?, ?)',
+        [(record, (record['class_name'], record['class_room'], record['description'], now))
+         for record in plan['classes']['create']],
+        chunk_size, errors, 'class', 'class_name')
+    updated_classes = _write_chunks(
+        conn, cursor, executemany,
+        'UPDATE classes SET class_room = ?, description = ?, update_time = ? WHERE class_name = ?',
+        [(record, (record['class_room'], record['description'], now, record['class_name']))
+         for record in plan['classes']['update']],
+        chunk_size, errors, 'class', 'class_name')
+
+    # 一次查询得到新建班级的ID, 不再逐个读取LAST_INSERT_ID()
+    new_class_ids = {row[1]: row[0] for row in _select_in(
+        cursor, 'SELECT class_id, class_name FROM classes WHERE class_name IN ({placeholders})',
+        [record['class_name'] for record in created_classes], chunk_size)}
+
+    def resolve(records):
+        resolved = []
+        for record in records:
+            name = record.get('_class_name')
+            if name is not None:
+                if name not in new_class_ids:
+                    errors.append({'kind': 'device', 'row': record['_row'], 'key': record['device_id'],
+                                   'error': f'班级{name}创建失败'})
+                    continue
+                record = dict(record, class_id=new_class_ids[name])
+            resolved.append(record)
+        return resolved
+
+    # 设备: 新增和更新
+    created_devices = _write_chunks(
+        conn, cursor, executemany,
+        'INSERT INTO devices (device_id, device_name, device_type, current_status, class_id, update_time) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [(record, (record['device_id'], record['device_name'], record['device_type'],
+                   record['current_status'], record['class_id'], now))
+         for record in resolve(plan['devices']['create'])],
+        chunk_size, errors, 'device', 'device_id')
+    updated_devices = _write_chunks(
+        conn, cursor, executemany,
+        'UPDATE devices SET device_name = ?, device_type = ?, current_status = ?, class_id = ? WHERE device_id = ?',
+        [(record, (record['device_name'], record['device_type'], record['current_status'],
+                   record['class_id'], record['device_id']))
+         for record in resolve(plan['devices']['update'])],
+        chunk_size, errors, 'device', 'device_id')
+
+    for record in created_devices + updated_devices:
+        class_ids.add(record['class_id'])
+        if '_old_class_id' in record:
+            class_ids.add(record['_old_class_id'])
+
+    return {
+        'classes': {'created': len(created_classes), 'updated': len(updated_classes)},
+        'devices': {'created': len(created_devices), 'updated': len(updated_devices)},
+        'errors': sorted(errors, key=lambda e: (e['kind'], e['row'])),
+        'class_ids': class_ids,
+        'device_ids': [record['device_id'] for record in created_devices + updated_devices]
+    }
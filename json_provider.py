@@ -0,0 +1,58 @@
+"""
+可替换的JSON序列化
+
+- 安装了orjson时使用orjson序列化, 否则退回Flask默认的json实现
+- datetime_format: http(默认, 与Flask默认格式一致, 如"Mon, 01 Jan 2024 08:00:00 GMT")
+  或iso(orjson原生处理, 如"2024-01-01T08:00:00", 最快)
+- orjson总是输出UTF-8, 不转义中文(ensure_ascii不生效)
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson是可选依赖
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    datetime_format = 'http'
+
+    @property
+    def backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    def _options(self, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if self.datetime_format != 'iso':
+            # 交给default按HTTP日期格式序列化, 保持与原接口一致
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return option
+
+    def dumps_bytes(self, obj, pretty=False):
+        """序列化为UTF-8字节串"""
+        if orjson is None:
+            kwargs = {'indent': 2} if pretty else {'separators': (',', ':')}
+            return super().dumps(obj, **kwargs).encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=self._options(pretty))
+
+    def dumps(self, obj, **kwargs):
+        # 指定了json.dumps专用参数(如cls)时使用默认实现
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, pretty=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self.dumps_bytes(obj, pretty) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class AsyncLogWriter:
+    """
+    操作日志异步写入器(write-behind)
+
+    - 日志先放入进程内队列, 由后台线程批量写入operation_logs表
+    - 队列中的日志数达到batch_size或距上次写入超过flush_interval秒时写入一批
+    - 队列已满时submit返回未入队的日志, 由调用方改为同步写入
+    - 进程退出时close()会写入队列中剩余的日志
+    - on_written: 每批写入成功后以写入的日志为参数调用(如更新数据版本号)
+    """
+
+    def __init__(self, get_pool, queue_size=10000, batch_size=200, flush_interval=1.0, on_written=None):
+        self._get_pool = get_pool
+        self._on_written = on_written
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'rejected': 0,
+            'failed': 0,
+            'flushes': 0,
+            'flush_time_total': 0.0,
+            'flush_time_max': 0.0,
+            'last_flush_seconds': None,
+            'last_flush_rows': 0
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='async-log-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, entries):
+        """
+        提交日志
+
+        Args:
+            entries: [(device_id, operation)] 或 [(device_id, operation, operation_time)]
+
+        Returns:
+            未能放入队列的日志(队列已满或写入器已关闭), 调用方需同步写入
+        """
+        now = datetime.now().replace(microsecond=0)
+        rows = [tuple(entry) if len(entry) == 3 else (entry[0], entry[1], now) for entry in entries]
+        if self._stop.is_set():
+            return rows
+
+        self._ensure_started()
+        accepted = 0
+        try:
+            for row in rows:
+                self._queue.put_nowait(row)
+                accepted += 1
+        except queue.Full:
+            pass
+
+        with self._stats_lock:
+            self._stats['enqueued'] += accepted
+            self._stats['rejected'] += len(rows) - accepted
+        return rows[accepted:]
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(self.flush_interval)
+            if batch:
+                self._write(batch)
+        # 退出前写入剩余日志
+        while True:
+            batch = self._drain(0)
+            if not batch:
+                break
+            self._write(batch)
+
+    def _drain(self, timeout):
+        """等待直到凑满一批或超时, 返回取出的日志"""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stop.is_set():
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            pool = self._get_pool()
+            conn = pool.acquire()
+        except Exception as e:
+            print(f"写入操作日志时获取数据库连接失败: {str(e)}")
+            with self._stats_lock:
+                self._stats['failed'] += len(rows)
+            return
+        broken = False
+        written = 0
+        try:
+            cursor = conn.cursor()
+            try:
+                values = ', '.join(['(?, ?, ?)'] * len(rows))
+                params = [value for row in rows for value in row]
+                cursor.execute(f'INSERT INTO operation_logs (device_id, operation, operation_time) VALUES {values}',
+                               params)
+                conn.commit()
+                written = len(rows)
+            except Exception as e:
+                # 整批写入失败(如设备已删除导致外键错误)时逐条写入, 避免一条坏数据拖累整批
+                print(f"批量写入操作日志失败, 改为逐条写入: {str(e)}")
+                conn.rollback()
+                for row in rows:
+                    try:
+                        cursor.execute('INSERT INTO operation_logs (device_id, operation, operation_time) VALUES (?, ?, ?)',
+                                       row)
+                        conn.commit()
+                        written += 1
+                    except Exception:
+                        conn.rollback()
+        except Exception as e:
+            print(f"写入操作日志时出错: {str(e)}")
+            broken = True
+        finally:
+            pool.release(conn, broken=broken)
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['failed'] += len(rows) - written
+            self._stats['flushes'] += 1
+            self._stats['flush_time_total'] += elapsed
+            self._stats['flush_time_max'] = max(self._stats['flush_time_max'], elapsed)
+            self._stats['last_flush_seconds'] = elapsed
+            self._stats['last_flush_rows'] = len(rows)
+
+        if written and self._on_written is not None:
+            try:
+                self._on_written(rows)
+            except Exception as e:
+                print(f"操作日志写入回调出错: {str(e)}")
+
+    def close(self, timeout=10.0):
+        """停止后台线程并写入队列中剩余的日志"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # 后台线程未启动或已退出时在当前线程写入剩余日志
+        while True:
+            batch = self._drain(0)
+            if not batch:
+                break
+            self._write(batch)
+
+    def stats(self):
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['queue_depth'] = self._queue.qsize()
+        result['queue_size'] = self._queue.maxsize
+        result['running'] = self._thread is not None and self._thread.is_alive()
+        result['flush_time_avg'] = (result['flush_time_total'] / result['flushes']) if result['flushes'] else 0.0
+        return result
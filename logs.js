@@ -3,6 +3,8 @@ let logs = [];
 let currentPage = 1;
 let pageSize = 10;
 let totalPages = 1;
+// 各页起始游标, 顺序翻页时使用游标分页而不是OFFSET
+let pageCursors = {};
 let filters = {
     device_id: '',
     operation: '',
@@ -18,6 +20,7 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('searchBtn').addEventListener('click', applyFilters);
     document.getElementById('resetBtn').addEventListener('click', resetFilters);
     document.getElementById('clearLogsBtn').addEventListener('click', clearLogs);
+    document.getElementById('exportLogsBtn').addEventListener('click', exportLogs);
     
     // 导航菜单事件
     document.getElementById('classManagement').addEventListener('click', function(e) {
@@ -71,6 +74,11 @@ function loadLogs() {
         page_size: pageSize
     };
     
+    // 已知该页起始游标时使用游标分页
+    if (pageCursors[currentPage]) {
+        params.after = pageCursors[currentPage];
+    }
+    
     // 添加筛选条件
     if (filters.device_id) {
         params.device_id = filters.device_id;
@@ -87,6 +95,11 @@ function loadLogs() {
             logs = response.data.logs;
             totalPages = response.data.total_pages;
             
+            // 记录下一页的起始游标
+            if (response.data.next_cursor) {
+                pageCursors[currentPage + 1] = response.data.next_cursor;
+            }
+            
             // 更新总记录数
             document.getElementById('totalLogs').textContent = response.data.total_count;
             
@@ -201,6 +214,7 @@ function applyFilters() {
     
     // 重置到第一页
     currentPage = 1;
+    pageCursors = {};
     
     // 重新加载数据
     loadLogs();
@@ -220,29 +234,70 @@ function resetFilters() {
     
     // 重置到第一页
     currentPage = 1;
+    pageCursors = {};
     
     // 重新加载数据
     loadLogs();
 }
 
+// 按当前筛选条件导出日志(CSV, 由服务器流式生成)
+function exportLogs() {
+    const params = new URLSearchParams({format: 'csv'});
+    Object.keys(filters).forEach(function(key) {
+        if (filters[key]) {
+            params.append(key, filters[key]);
+        }
+    });
+    window.location.href = `/api/logs/export?${params.toString()}`;
+}
+
 // 清空日志
 function clearLogs() {
     if (!confirm('确定要清空所有日志记录吗？此操作不可恢复！')) {
         return;
     }
     
+    const clearBtn = document.getElementById('clearLogsBtn');
+    clearBtn.disabled = true;
     axios.delete('/api/logs')
         .then(function(response) {
-            // 重新加载数据
-            loadLogs();
-            showAlert('日志已清空', 'success');
+            // 日志在后台分批删除, 完成后再重新加载
+            showAlert('日志清理中...', 'info');
+            waitForPurge(clearBtn);
         })
         .catch(function(error) {
+            clearBtn.disabled = false;
             console.error('清空日志失败:', error);
             showAlert('清空日志失败: ' + (error.response?.data?.error || error.message), 'danger');
         });
 }
 
+// 轮询清理进度, 任务结束后重新加载日志
+function waitForPurge(clearBtn) {
+    axios.get('/api/system/retention')
+        .then(function(response) {
+            const progress = response.data;
+            if (progress.running) {
+                setTimeout(function() { waitForPurge(clearBtn); }, 1000);
+                return;
+            }
+            clearBtn.disabled = false;
+            currentPage = 1;
+            pageCursors = {};
+            loadLogs();
+            if (progress.last_error) {
+                showAlert('清空日志失败: ' + progress.last_error, 'danger');
+            } else {
+                showAlert(`日志已清空, 共删除${progress.deleted.operation_logs || 0}条`, 'success');
+            }
+        })
+        .catch(function(error) {
+            clearBtn.disabled = false;
+            console.error('查询清理进度失败:', error);
+            showAlert('查询清理进度失败: ' + (error.response?.data?.error || error.message), 'danger');
+        });
+}
+
 // 显示日志详情
 function showLogDetail(logId) {
     axios.get(`/api/logs/${logId}`)
@@ -2,6 +2,7 @@
 let currentClassId = null;
 let classes = [];
 let devices = [];
+let eventSource = null;
 
 // DOM 加载完成后执行
 document.addEventListener('DOMContentLoaded', function() {
@@ -175,6 +176,92 @@ function selectClass(classId) {
     
     // 加载该教室的设备
     loadDevices(classId);
+    
+    // 订阅该教室的设备变化
+    subscribeEvents(classId);
+}
+
+// 订阅设备变化推送(Server-Sent Events), 收到事件后原地更新设备卡片
+function subscribeEvents(classId) {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+    if (!window.EventSource) {
+        return;
+    }
+    
+    const url = classId === 'undefined' ? '/api/events' : `/api/events?class_id=${classId}`;
+    eventSource = new EventSource(url);
+    
+    // 设备状态变化: 只更新对应卡片的状态和按钮
+    eventSource.addEventListener('status', function(e) {
+        const data = JSON.parse(e.data);
+        data.devices.forEach(function(item) {
+            applyDeviceStatus(item.device_id, data.status);
+        });
+    });
+    
+    // 设备信息修改: 仍属于当前列表时原地更新, 否则重新加载列表
+    eventSource.addEventListener('device', function(e) {
+        const data = JSON.parse(e.data);
+        const device = devices.find(d => d.device_id == data.device_id);
+        if (device && belongsToCurrentClass(data.class_id)) {
+            const classroom = classes.find(c => c.class_id == data.class_id);
+            Object.assign(device, {
+                device_name: data.device_name,
+                device_type: data.device_type,
+                current_status: data.current_status,
+                class_id: data.class_id,
+                class_name: classroom ? classroom.class_name : ''
+            });
+            renderDevicePanel();
+        } else if (device || belongsToCurrentClass(data.class_id)) {
+            loadDevices(currentClassId);
+        }
+    });
+    
+    // 设备分配变化会改变列表成员, 重新加载当前列表
+    eventSource.addEventListener('assigned', function(e) {
+        loadDevices(currentClassId);
+    });
+    
+    // 设备命令多次下发失败后放弃, 设备状态保持不变
+    eventSource.addEventListener('command_failed', function(e) {
+        const data = JSON.parse(e.data);
+        showAlert(`设备${data.device_id}命令下发失败: ${data.error}`, 'danger');
+    });
+}
+
+// 判断班级ID是否属于当前显示的列表
+function belongsToCurrentClass(classId) {
+    if (currentClassId === 'undefined') {
+        return true;
+    }
+    return (classId || 0) == currentClassId;
+}
+
+// 更新设备状态并刷新对应的卡片
+function applyDeviceStatus(deviceId, status) {
+    const device = devices.find(d => d.device_id == deviceId);
+    if (!device) {
+        return;
+    }
+    device.current_status = status;
+    
+    const card = document.querySelector(`#devicePanel [data-device-id="${CSS.escape(String(deviceId))}"]`);
+    if (!card) {
+        return;
+    }
+    const isConnected = status === 'ON';
+    const statusDot = card.querySelector('.device-status');
+    statusDot.classList.toggle('status-on', isConnected);
+    statusDot.classList.toggle('status-off', !isConnected);
+    
+    const powerBtn = card.querySelector('.power-btn');
+    powerBtn.classList.toggle('btn-danger', isConnected);
+    powerBtn.classList.toggle('btn-success', !isConnected);
+    powerBtn.textContent = isConnected ? '关闭设备' : '开启设备';
 }
 
 // 加载设备
@@ -213,6 +300,7 @@ function renderDevicePanel() {
     devices.forEach(function(device) {
         const deviceCard = document.createElement('div');
         deviceCard.className = 'col-md-4 col-sm-6';
+        deviceCard.dataset.deviceId = device.device_id;
         
         // 设备图标
         let deviceIcon = '';
@@ -532,8 +620,13 @@ function deleteDevice(deviceId) {
 function turnOnDevice(deviceId) {
     axios.post(`/api/devices/${deviceId}/turn-on`)
         .then(function(response) {
+            // 202: 命令已交给调度器下发, 设备确认后通过status事件更新
+            if (response.status === 202) {
+                showAlert('开启命令已提交, 等待设备确认', 'info');
+                return;
+            }
             showAlert('设备已开启', 'success');
-            loadDevices(currentClassId);
+            applyDeviceStatus(deviceId, 'ON');
         })
         .catch(function(error) {
             console.error('开启设备失败:', error);
@@ -545,8 +638,13 @@ function turnOnDevice(deviceId) {
 function turnOffDevice(deviceId) {
     axios.post(`/api/devices/${deviceId}/turn-off`)
         .then(function(response) {
+            // 202: 命令已交给调度器下发, 设备确认后通过status事件更新
+            if (response.status === 202) {
+                showAlert('关闭命令已提交, 等待设备确认', 'info');
+                return;
+            }
             showAlert('设备已关闭', 'success');
-            loadDevices(currentClassId);
+            applyDeviceStatus(deviceId, 'OFF');
         })
         .catch(function(error) {
             console.error('关闭设备失败:', error);
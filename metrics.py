@@ -0,0 +1,253 @@
+"""
+请求级数据库统计和Prometheus指标
+
+- RequestStats: 一个请求内获取连接、执行SQL、读取结果和JSON序列化的耗时与次数, 生成Server-Timing响应头
+- InstrumentedConnection / InstrumentedCursor: 包装请求使用的连接和游标, 把耗时计入RequestStats
+- MetricsRegistry: 按接口统计的直方图和计数器, 以Prometheus文本格式输出
+
+指标保存在进程内存中, 多进程部署时每个worker分别统计, 由Prometheus按实例汇总
+"""
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ACQUIRE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+INF_LABEL = 'le="+Inf"'
+
+
+class RequestStats:
+    """一个请求的耗时统计(秒)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.acquire = 0.0  # 从连接池获取连接
+        self.db = 0.0  # 执行SQL、读取结果、提交/回滚
+        self.serialize = 0.0  # JSON序列化
+        self.queries = 0
+        self.rows = 0
+        # 启用慢查询日志时记录每条语句: [(sql, 参数, 耗时秒数, 是否executemany)]
+        self.statements = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        """
+        生成Server-Timing响应头, 时间单位为毫秒
+
+        app为总耗时减去获取连接、数据库和序列化之后剩余的部分(路由逻辑、模板等)
+        """
+        total = self.elapsed() if total is None else total
+        other = max(total - self.acquire - self.db - self.serialize, 0.0)
+        return ', '.join([
+            f'acquire;dur={self.acquire * 1000:.2f}',
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries, {self.rows} rows"',
+            f'serialize;dur={self.serialize * 1000:.2f}',
+            f'app;dur={other * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}'
+        ])
+
+
+class InstrumentedCursor:
+    """游标包装, execute/executemany计为查询, fetch*计入读取的行数"""
+
+    def __init__(self, cursor, stats):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_stats', stats)
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._stats.db += time.perf_counter() - started
+
+    def _run(self, func, args, many):
+        self._stats.queries += 1
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        finally:
+            duration = time.perf_counter() - started
+            self._stats.db += duration
+            if self._stats.statements is not None:
+                # pyodbc也支持把参数逐个传入execute(sql, a, b)
+                params = args[1] if len(args) == 2 else (args[1:] or None)
+                self._stats.statements.append((args[0], params, duration, many))
+        # pyodbc和sqlite3的execute都返回游标本身, 保持链式调用时仍经过包装
+        return self if result is self._cursor else result
+
+    def execute(self, *args):
+        return self._run(self._cursor.execute, args, False)
+
+    def executemany(self, *args):
+        return self._run(self._cursor.executemany, args, True)
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed(self._cursor.fetchmany, *args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    """连接包装, 返回InstrumentedCursor, 提交和回滚的耗时计入数据库耗时"""
+
+    def __init__(self, conn, stats):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_stats', stats)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self._stats)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            self._stats.db += time.perf_counter() - started
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            self._conn.rollback()
+        finally:
+            self._stats.db += time.perf_counter() - started
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数(不累加), 总和, 次数]
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, INF_LABEL)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {_format_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    按接口(Flask endpoint名称)和请求方法统计
+
+    - http_request_duration_seconds: 请求处理耗时(流式响应只统计到开始发送响应体)
+    - db_queries_per_request: 每个请求执行的SQL语句数
+    - db_rows_fetched_per_request: 每个请求读取的行数
+    - db_connection_acquire_seconds: 每个请求从连接池获取连接的耗时(没有使用数据库的请求不统计)
+    - http_requests_total: 按状态码统计的请求数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        labels = ('endpoint', 'method')
+        self.latency = Histogram('http_request_duration_seconds', '请求处理耗时(秒)', labels, LATENCY_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', '每个请求执行的SQL语句数', labels, QUERY_BUCKETS)
+        self.rows = Histogram('db_rows_fetched_per_request', '每个请求读取的行数', labels, ROW_BUCKETS)
+        self.acquire = Histogram('db_connection_acquire_seconds', '每个请求获取数据库连接的耗时(秒)',
+                                 labels, ACQUIRE_BUCKETS)
+        self.requests = Counter('http_requests_total', '请求数', ('endpoint', 'method', 'status'))
+
+    def observe(self, endpoint, method, status, stats, duration, used_db):
+        labels = (endpoint or 'none', method)
+        with self._lock:
+            self.latency.observe(labels, duration)
+            self.queries.observe(labels, stats.queries)
+            self.rows.observe(labels, stats.rows)
+            if used_db:
+                self.acquire.observe(labels, stats.acquire)
+            self.requests.inc(labels + (str(status),))
+
+    def render(self, gauges=None):
+        """
+        Args:
+            gauges: 额外输出的瞬时值 {(名称, 说明): 值}, 如连接池状态
+        """
+        lines = []
+        with self._lock:
+            for metric in (self.latency, self.queries, self.rows, self.acquire, self.requests):
+                lines.extend(metric.render())
+        for (name, description), value in (gauges or {}).items():
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {_format_number(value)}'])
+        return '\n'.join(lines) + '\n'
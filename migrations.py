@@ -0,0 +1,302 @@
+"""
+数据库结构迁移
+
+- schema_version表记录已执行的迁移版本
+- MIGRATIONS按版本号顺序执行, 每个迁移只执行一次
+- 新的表结构或索引变更应追加新的迁移, 不要修改已发布的迁移
+- 建表语句按MySQL编写, 其他数据库后端由backend.create_table转换
+"""
+from timeseries import METRICS
+
+# 所有表统一使用的字符集和排序规则
+TABLE_CHARSET = 'CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci'
+
+SCHEMA_VERSION_DDL = f'''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) {TABLE_CHARSET}
+'''
+
+CLASSES_DDL = f'''
+    CREATE TABLE IF NOT EXISTS classes (
+        class_id INT AUTO_INCREMENT PRIMARY KEY,
+        class_name VARCHAR(100) NOT NULL UNIQUE,
+        class_room VARCHAR(100),
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) {TABLE_CHARSET}
+'''
+
+# 创建设备表 - 确保device_id是VARCHAR(50)
+DEVICES_DDL = f'''
+    CREATE TABLE IF NOT EXISTS devices (
+        device_id VARCHAR(50) PRIMARY KEY,
+        device_name VARCHAR(100) NOT NULL,
+        device_type VARCHAR(50) NOT NULL,
+        current_status VARCHAR(20) DEFAULT 'OFF',
+        class_id INT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP{{fk}}
+    ) {TABLE_CHARSET}
+'''
+
+OPERATION_LOGS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS operation_logs (
+        log_id INT AUTO_INCREMENT PRIMARY KEY,
+        device_id VARCHAR(50) NOT NULL,
+        operation VARCHAR(50) NOT NULL,
+        operation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP{{fk}}
+    ) {TABLE_CHARSET} ENGINE=InnoDB
+'''
+
+DATA_RECORDS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS data_records (
+        record_id INT AUTO_INCREMENT PRIMARY KEY,
+        device_id VARCHAR(50) NOT NULL,
+        data_type VARCHAR(50) NOT NULL,
+        data_value VARCHAR(100) NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP{{fk}}
+    ) {TABLE_CHARSET} ENGINE=InnoDB
+'''
+
+CLASS_STATS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS class_device_stats (
+        class_id INT PRIMARY KEY,
+        device_count INT NOT NULL DEFAULT 0,
+        on_count INT NOT NULL DEFAULT 0,
+        off_count INT NOT NULL DEFAULT 0
+    ) {TABLE_CHARSET}
+'''
+
+
+METRICS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS metrics (
+        metric_code SMALLINT PRIMARY KEY,
+        metric_name VARCHAR(50) NOT NULL UNIQUE,
+        unit VARCHAR(20) NOT NULL DEFAULT ''
+    ) {TABLE_CHARSET}
+'''
+
+DEVICE_READINGS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS device_readings (
+        device_id VARCHAR(50) NOT NULL,
+        metric_code SMALLINT NOT NULL,
+        ts DATETIME NOT NULL,
+        value DOUBLE NOT NULL,
+        PRIMARY KEY (device_id, metric_code, ts),
+        KEY idx_device_readings_ts (ts)
+    ) {TABLE_CHARSET} ENGINE=InnoDB
+'''
+
+READING_ROLLUPS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS reading_rollups (
+        device_id VARCHAR(50) NOT NULL,
+        metric_code SMALLINT NOT NULL,
+        resolution INT NOT NULL,
+        bucket_start DATETIME NOT NULL,
+        min_value DOUBLE NOT NULL,
+        max_value DOUBLE NOT NULL,
+        sum_value DOUBLE NOT NULL,
+        sample_count INT NOT NULL,
+        PRIMARY KEY (device_id, metric_code, resolution, bucket_start),
+        KEY idx_reading_rollups_time (resolution, bucket_start)
+    ) {TABLE_CHARSET} ENGINE=InnoDB
+'''
+
+# 汇总任务进度: 每个粒度已汇总到的时间
+ROLLUP_STATE_DDL = f'''
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        resolution INT PRIMARY KEY,
+        computed_until DATETIME NOT NULL
+    ) {TABLE_CHARSET}
+'''
+
+
+def create_index(cursor, backend, table, name, columns):
+    """创建索引, 索引已存在时跳过"""
+    if backend.index_exists(cursor, table, name):
+        return False
+    cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+    return True
+
+
+def migration_001_base_tables(cursor, backend):
+    """创建基础表, 外键约束创建失败时退回到没有外键约束的表"""
+    fks = {
+        'devices': ',\n        FOREIGN KEY (class_id) REFERENCES classes (class_id) ON DELETE SET NULL',
+        'operation_logs': ',\n        FOREIGN KEY (device_id) REFERENCES devices (device_id) ON DELETE CASCADE',
+        'data_records': ',\n        FOREIGN KEY (device_id) REFERENCES devices (device_id) ON DELETE CASCADE'
+    }
+    backend.create_table(cursor, CLASSES_DDL)
+    try:
+        backend.create_table(cursor, DEVICES_DDL.format(fk=fks['devices']))
+        backend.create_table(cursor, OPERATION_LOGS_DDL.format(fk=fks['operation_logs']))
+        backend.create_table(cursor, DATA_RECORDS_DDL.format(fk=fks['data_records']))
+    except Exception as e:
+        print(f"创建带外键约束的表时出错: {str(e)}")
+        print("尝试创建没有外键约束的表...")
+        backend.create_table(cursor, DEVICES_DDL.format(fk=''))
+        backend.create_table(cursor, OPERATION_LOGS_DDL.format(fk=''))
+        backend.create_table(cursor, DATA_RECORDS_DDL.format(fk=''))
+        print("成功创建没有外键约束的表")
+
+
+def migration_002_class_stats(cursor, backend):
+    """创建班级设备统计表"""
+    backend.create_table(cursor, CLASS_STATS_DDL)
+
+
+def migration_003_unify_collation(cursor, backend):
+    """
+    统一各表字符集和排序规则
+
+    早期建表可能使用了服务器默认排序规则, 关联查询只能用BINARY比较,
+    统一后operation_logs与devices可以直接按device_id关联并使用索引(只对MySQL执行)
+    """
+    if backend.name != 'mysql':
+        return
+    for table in ('classes', 'devices', 'operation_logs', 'data_records'):
+        cursor.execute('''
+            SELECT table_collation FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = ?
+        ''', (table,))
+        row = cursor.fetchone()
+        if row and row[0] != 'utf8mb4_unicode_ci':
+            cursor.execute(f'ALTER TABLE {table} CONVERT TO {TABLE_CHARSET}')
+
+
+def migration_004_hot_query_indexes(cursor, backend):
+    """为高频查询添加复合索引"""
+    # 设备历史数据: WHERE device_id = ? ORDER BY timestamp DESC
+    create_index(cursor, backend, 'data_records', 'idx_data_records_device_time', 'device_id, timestamp')
+    # 日志按设备筛选 / 按操作筛选 / 按时间范围筛选, 均按(operation_time, log_id)倒序分页
+    create_index(cursor, backend, 'operation_logs', 'idx_logs_device_time', 'device_id, operation_time, log_id')
+    create_index(cursor, backend, 'operation_logs', 'idx_logs_operation_time', 'operation, operation_time, log_id')
+    create_index(cursor, backend, 'operation_logs', 'idx_logs_time', 'operation_time, log_id')
+    # 班级设备列表和班级汇总: WHERE class_id = ? / GROUP BY class_id, current_status
+    create_index(cursor, backend, 'devices', 'idx_devices_class_status', 'class_id, current_status')
+
+
+def migration_005_timeseries(cursor, backend):
+    """创建数值型时序读数表和分钟/小时汇总表"""
+    backend.create_table(cursor, METRICS_DDL)
+    backend.create_table(cursor, DEVICE_READINGS_DDL)
+    backend.create_table(cursor, READING_ROLLUPS_DDL)
+    backend.create_table(cursor, ROLLUP_STATE_DDL)
+    for name, (code, unit) in METRICS.items():
+        cursor.execute('SELECT COUNT(*) FROM metrics WHERE metric_code = ?', (code,))
+        if not cursor.fetchone()[0]:
+            cursor.execute('INSERT INTO metrics (metric_code, metric_name, unit) VALUES (?, ?, ?)',
+                           (code, name, unit))
+
+
+def migration_006_device_filter_indexes(cursor, backend):
+    """为设备列表的服务端筛选添加索引"""
+    # /api/devices?type=...&status=...
+    create_index(cursor, backend, 'devices', 'idx_devices_type_status', 'device_type, current_status')
+
+
+# 迁移列表: (版本号, 说明, 迁移函数), 按版本号递增
+MIGRATIONS = [
+    (1, '创建基础表', migration_001_base_tables),
+    (2, '创建班级设备统计表', migration_002_class_stats),
+    (3, '统一字符集和排序规则', migration_003_unify_collation),
+    (4, '高频查询索引', migration_004_hot_query_indexes),
+    (5, '时序读数和汇总表', migration_005_timeseries),
+    (6, '设备筛选索引', migration_006_device_filter_indexes)
+]
+
+
+def current_version(cursor, backend):
+    """返回已执行的最高迁移版本, 尚未执行任何迁移时返回0"""
+    backend.create_table(cursor, SCHEMA_VERSION_DDL)
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    row = cursor.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def migrate(conn, backend, target=None):
+    """
+    执行尚未执行的迁移
+
+    Args:
+        conn: 数据库连接
+        backend: 数据库后端(backends.py)
+        target: 目标版本, 默认为最新版本
+
+    Returns:
+        applied: 本次执行的迁移版本列表
+
+    MySQL的DDL会隐式提交, 因此每个迁移执行完成后立即记录版本,
+    迁移中途失败时已完成的迁移不会重复执行
+    """
+    cursor = conn.cursor()
+    version = current_version(cursor, backend)
+    conn.commit()
+
+    applied = []
+    for number, description, func in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        func(cursor, backend)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                       (number, description))
+        conn.commit()
+        applied.append(number)
+    return applied
+
+
+# 高频查询及其预期使用的索引: (名称, 查询语句, 参数, 表别名, 预期索引)
+HOT_QUERIES = [
+    ('设备历史数据',
+     'SELECT * FROM data_records WHERE device_id = ? ORDER BY timestamp DESC LIMIT 10',
+     ('__explain__',), 'data_records', 'idx_data_records_device_time'),
+    ('日志按设备筛选',
+     'SELECT l.log_id, d.device_name FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id '
+     'WHERE l.device_id = ? ORDER BY l.operation_time DESC, l.log_id DESC LIMIT 10',
+     ('__explain__',), 'l', 'idx_logs_device_time'),
+    ('日志按操作筛选',
+     'SELECT l.log_id, d.device_name FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id '
+     'WHERE l.operation = ? ORDER BY l.operation_time DESC, l.log_id DESC LIMIT 10',
+     ('__explain__',), 'l', 'idx_logs_operation_time'),
+    ('日志按日期筛选',
+     'SELECT l.log_id, d.device_name FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id '
+     'WHERE l.operation_time >= ? AND l.operation_time < ? ORDER BY l.operation_time DESC, l.log_id DESC LIMIT 10',
+     ('2000-01-01 00:00:00', '2000-01-02 00:00:00'), 'l', 'idx_logs_time'),
+    ('日志关联设备',
+     'SELECT l.log_id, d.device_name FROM operation_logs l LEFT JOIN devices d ON l.device_id = d.device_id '
+     'ORDER BY l.operation_time DESC, l.log_id DESC LIMIT 10',
+     (), 'd', 'PRIMARY'),
+    ('班级设备列表',
+     'SELECT * FROM devices WHERE class_id = ?',
+     (0,), 'devices', 'idx_devices_class_status'),
+    ('设备按类型筛选',
+     'SELECT device_id, device_name, current_status FROM devices WHERE device_type = ?',
+     ('__explain__',), 'devices', 'idx_devices_type_status')
+]
+
+
+def explain_hot_queries(cursor, backend):
+    """
+    对高频查询执行EXPLAIN(SQLite为EXPLAIN QUERY PLAN), 检查是否使用了预期索引
+
+    Returns:
+        results: [{'name', 'table', 'expected', 'key', 'type', 'ok'}]
+    """
+    results = []
+    for name, query, params, table, expected in HOT_QUERIES:
+        key, access_type = backend.explain(cursor, query, params, table)
+        results.append({
+            'name': name,
+            'table': table,
+            'expected': expected,
+            'key': key,
+            'type': access_type,
+            'ok': key == expected
+        })
+    return results
@@ -0,0 +1,176 @@
+"""
+慢查询日志和N+1检测(开发和灰度环境使用, 默认关闭)
+
+- 记录每个请求执行的每条SQL语句、耗时和参数结构(只记录参数类型, 不记录参数值)
+- 耗时超过slow_ms毫秒的语句记为慢查询
+- 同一请求内相同语句模板执行次数达到repeat_threshold时记为N+1
+  (模板把字面量替换为?, 并把IN (?, ?, ...)合并为IN (?+), 因此只是参数不同的语句视为同一模板)
+- 有问题的请求写入滚动日志文件, 最近的记录和按模板汇总的统计可在/debug/queries查看
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_LIST = re.compile(r'(\(\?\+\))(?:\s*,\s*\(\?\+\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_template(sql):
+    """把SQL语句归一化为模板"""
+    template = _WHITESPACE.sub(' ', sql).strip()
+    template = _STRING_LITERAL.sub('?', template)
+    template = _NUMBER_LITERAL.sub('?', template)
+    template = _PLACEHOLDER_LIST.sub('(?+)', template)
+    # 多行INSERT ... VALUES (...), (...)
+    return _VALUES_LIST.sub(r'\1, ...', template)
+
+
+def params_shape(params, many=False):
+    """
+    参数结构, 如"(str, int)"; executemany为"500 x (str, int)"
+    """
+    if many:
+        rows = list(params) if params is not None else []
+        return f'{len(rows)} x {params_shape(rows[0]) if rows else "()"}'
+    if params is None:
+        return '()'
+    if not isinstance(params, (list, tuple)):
+        params = (params,)
+    return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+
+
+class QueryLog:
+    """
+    分析请求内的SQL语句并保存结果
+
+    Args:
+        slow_ms: 慢查询阈值(毫秒)
+        repeat_threshold: 同一模板在一个请求内执行多少次记为N+1
+        history_size: 保留最近多少个有问题的请求
+        path: 滚动日志文件路径, 为空时不写文件
+    """
+
+    def __init__(self, slow_ms=100.0, repeat_threshold=5, history_size=200,
+                 path=None, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=history_size)
+        # 模板 -> {'calls', 'total_ms', 'max_ms', 'slow', 'n_plus_one', 'endpoints'}
+        self._templates = {}
+        self._requests = 0
+        self._flagged = 0
+
+        self._logger = None
+        if path:
+            self._logger = logging.getLogger(f'querylog.{id(self)}')
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+
+    def analyze(self, statements):
+        """
+        Args:
+            statements: [(sql, params, 耗时秒数, 是否executemany)]
+
+        Returns:
+            (templates, slow, repeated): 各语句的模板、慢查询列表和N+1列表
+        """
+        slow = []
+        templates = [statement_template(statement[0]) for statement in statements]
+        for template, (sql, params, duration, many) in zip(templates, statements):
+            if duration * 1000 >= self.slow_ms:
+                slow.append({'template': template, 'duration_ms': round(duration * 1000, 3),
+                             'params': params_shape(params, many)})
+        repeated = [{'template': template, 'count': count}
+                    for template, count in Counter(templates).most_common()
+                    if count >= self.repeat_threshold]
+        return templates, slow, repeated
+
+    def record(self, method, path, endpoint, status, statements, total):
+        """
+        记录一个请求的语句, 有慢查询或N+1时保存到最近记录并写入日志文件
+
+        Returns:
+            entry: 有问题时返回保存的记录, 否则返回None
+        """
+        templates, slow, repeated = self.analyze(statements)
+        endpoint = endpoint or 'none'
+
+        with self._lock:
+            self._requests += 1
+            slow_templates = Counter(item['template'] for item in slow)
+            repeated_templates = {item['template'] for item in repeated}
+            for template, (sql, params, duration, many) in zip(templates, statements):
+                item = self._templates.get(template)
+                if item is None:
+                    item = self._templates[template] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0,
+                                                        'n_plus_one': 0, 'endpoints': set()}
+                item['calls'] += 1
+                item['total_ms'] += duration * 1000
+                item['max_ms'] = max(item['max_ms'], duration * 1000)
+                item['endpoints'].add(endpoint)
+            for template, count in slow_templates.items():
+                self._templates[template]['slow'] += count
+            for template in repeated_templates:
+                self._templates[template]['n_plus_one'] += 1
+
+            if not (slow or repeated):
+                return None
+            self._flagged += 1
+            entry = {
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'method': method,
+                'path': path,
+                'endpoint': endpoint,
+                'status': status,
+                'duration_ms': round(total * 1000, 3),
+                'queries': len(statements),
+                'db_ms': round(sum(statement[2] for statement in statements) * 1000, 3),
+                'slow': slow,
+                'n_plus_one': repeated,
+                'statements': [{'template': template, 'duration_ms': round(duration * 1000, 3),
+                                'params': params_shape(params, many)}
+                               for template, (sql, params, duration, many) in zip(templates, statements)]
+            }
+            self._recent.appendleft(entry)
+
+        if self._logger is not None:
+            self._logger.info(json.dumps(entry, ensure_ascii=False))
+        return entry
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def summary(self, limit=50):
+        """按总耗时排序的语句模板统计"""
+        with self._lock:
+            items = [dict(item, template=template, endpoints=sorted(item['endpoints']),
+                          total_ms=round(item['total_ms'], 3), max_ms=round(item['max_ms'], 3))
+                     for template, item in self._templates.items()]
+            totals = {'requests': self._requests, 'flagged': self._flagged,
+                      'slow_ms': self.slow_ms, 'repeat_threshold': self.repeat_threshold}
+        items.sort(key=lambda item: item['total_ms'], reverse=True)
+        return totals, items[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._templates.clear()
+            self._requests = 0
+            self._flagged = 0
+
@@ -0,0 +1,211 @@
+"""
+数据保留策略和分批清理
+
+- 每次只删除一批(chunk_size行)并立即提交, 批次之间暂停pause秒,
+  避免一次大DELETE长时间锁表、产生巨大的undo日志
+- 有自增主键的表先按时间条件取出一批主键, 再按主键删除;
+  没有单列主键的表使用DELETE ... LIMIT(SQLite按rowid删除)
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class ChunkedPurger:
+    """
+    分批删除引擎, 同一时间只运行一个清理任务
+
+    Args:
+        connection: 返回数据库连接上下文管理器的函数(如app.pooled_connection)
+        backend: 数据库后端(backends.py), 提供带LIMIT的删除写法
+    """
+
+    def __init__(self, connection, backend, chunk_size=1000, pause=0.1):
+        self._connection = connection
+        self._backend = backend
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._run_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._progress = {
+            'running': False,
+            'job': None,
+            'table': None,
+            'deleted': {},
+            'chunks': 0,
+            'started_at': None,
+            'finished_at': None,
+            'last_error': None
+        }
+
+    def _update(self, **kwargs):
+        with self._state_lock:
+            self._progress.update(kwargs)
+
+    def _add_deleted(self, table, count):
+        with self._state_lock:
+            deleted = self._progress['deleted']
+            deleted[table] = deleted.get(table, 0) + count
+            self._progress['chunks'] += 1
+
+    def cancel(self):
+        """请求当前任务在下一批之前停止"""
+        self._cancel.set()
+
+    def is_running(self):
+        return self._run_lock.locked()
+
+    def run(self, job, policies):
+        """
+        依次执行清理策略, 已有任务运行时返回None
+
+        Args:
+            job: 任务名称, 用于进度展示
+            policies: [{'table', 'time_column', 'cutoff', 'pk', 'where', 'params'}]
+
+        Returns:
+            deleted: {表名: 删除行数}
+        """
+        if not self._acquire(job):
+            return None
+        return self._run_locked(policies)
+
+    def try_start(self, job, policies, on_done=None):
+        """
+        在后台线程中执行清理策略; 运行锁在启动线程之前取得, 返回True时任务一定会执行
+
+        Args:
+            on_done: 任务结束(包括出错)后在后台线程中调用
+
+        Returns:
+            started: 已有任务运行时返回False
+        """
+        if not self._acquire(job):
+            return False
+
+        def target():
+            try:
+                self._run_locked(policies)
+            except Exception as e:
+                print(f"清理任务{job}执行出错: {str(e)}")
+            finally:
+                if on_done is not None:
+                    on_done()
+
+        try:
+            threading.Thread(target=target, name=f'purge-{job}', daemon=True).start()
+        except Exception:
+            self._finish()
+            raise
+        return True
+
+    def _acquire(self, job):
+        """非阻塞地取得运行锁并重置进度"""
+        if not self._run_lock.acquire(blocking=False):
+            return False
+        self._cancel.clear()
+        self._update(running=True, job=job, table=None, deleted={}, chunks=0,
+                     started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     finished_at=None, last_error=None)
+        return True
+
+    def _finish(self):
+        self._update(running=False, table=None,
+                     finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self._run_lock.release()
+
+    def _run_locked(self, policies):
+        """持有运行锁时执行, 结束后释放"""
+        try:
+            for policy in policies:
+                if self._cancel.is_set():
+                    break
+                self._update(table=policy['table'])
+                self.purge(**policy)
+            return self.progress()['deleted']
+        except Exception as e:
+            self._update(last_error=str(e))
+            raise
+        finally:
+            self._finish()
+
+    def purge(self, table, time_column=None, cutoff=None, pk=None, where=None, params=()):
+        """
+        分批删除table中time_column早于cutoff的行; cutoff为None时删除全部行
+
+        Returns:
+            deleted: 删除的行数
+        """
+        conditions = []
+        condition_params = []
+        if cutoff is not None:
+            conditions.append(f'{time_column} < ?')
+            condition_params.append(cutoff)
+        if where:
+            conditions.append(where)
+            condition_params.extend(params)
+        where_sql = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        deleted = 0
+        while not self._cancel.is_set():
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                if pk:
+                    cursor.execute(f'SELECT {pk} FROM {table}{where_sql} ORDER BY {pk} LIMIT ?',
+                                   condition_params + [self.chunk_size])
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if not ids:
+                        break
+                    placeholders = ', '.join('?' * len(ids))
+                    cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({placeholders})', ids)
+                    count = len(ids)
+                else:
+                    cursor.execute(self._backend.delete_limit_sql(table, where_sql),
+                                   condition_params + [self.chunk_size])
+                    count = cursor.rowcount
+                conn.commit()
+
+            deleted += count
+            self._add_deleted(table, count)
+            if count < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return deleted
+
+    def progress(self):
+        with self._state_lock:
+            result = dict(self._progress)
+            result['deleted'] = dict(self._progress['deleted'])
+        result['chunk_size'] = self.chunk_size
+        result['pause'] = self.pause
+        return result
+
+
+def build_retention_policies(config, now=None):
+    """
+    按配置生成保留策略, 保留天数为0的表不清理
+
+    - RETENTION_LOGS_DAYS: operation_logs
+    - RETENTION_RAW_READINGS_DAYS: data_records和device_readings原始读数
+    - RETENTION_MINUTE_ROLLUPS_DAYS: 分钟汇总(小时汇总长期保留)
+    """
+    now = now or datetime.now()
+    specs = [
+        ('operation_logs', 'operation_time', 'log_id', None, (), config['RETENTION_LOGS_DAYS']),
+        ('data_records', 'timestamp', 'record_id', None, (), config['RETENTION_RAW_READINGS_DAYS']),
+        ('device_readings', 'ts', None, None, (), config['RETENTION_RAW_READINGS_DAYS']),
+        ('reading_rollups', 'bucket_start', None, 'resolution = ?', (60,), config['RETENTION_MINUTE_ROLLUPS_DAYS'])
+    ]
+    policies = []
+    for table, time_column, pk, where, params, days in specs:
+        if days and days > 0:
+            policies.append({
+                'table': table,
+                'time_column': time_column,
+                'cutoff': (now - timedelta(days=days)).replace(microsecond=0),
+                'pk': pk,
+                'where': where,
+                'params': list(params)
+            })
+    return policies
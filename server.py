@@ -0,0 +1,84 @@
+"""
+生产环境服务: gunicorn多进程 + 每个进程多线程(gthread)
+
+用法:
+    flask serve                    # 按SERVE_*配置启动, 可用--bind/--workers/--threads覆盖
+    gunicorn app:app               # 在项目目录执行时自动加载gunicorn.conf.py, 使用相同的配置和钩子
+
+进程和资源:
+- 主进程导入应用(SERVE_PRELOAD=1)后fork出worker, 主进程不建立数据库连接、不启动线程
+- 每个worker在post_fork中重新创建连接池、缓存、事件订阅和锁(app.init_worker)
+- 后台任务(采样、汇总、清理)只在持有BACKGROUND_LOCK_PATH文件锁的一个worker中运行
+
+平滑重启和停止:
+- kill -HUP <主进程>: 启动新的worker, 旧worker处理完进行中的请求后退出
+- kill -TERM <主进程>: worker停止接受新连接, 最多等待SERVE_GRACEFUL_TIMEOUT秒
+- worker收到TERM时先结束事件推送流并停止后台任务(app.begin_drain), 退出前写入剩余日志并关闭连接池
+
+gunicorn只支持Linux/macOS
+"""
+import signal
+import threading
+
+
+def gunicorn_options(config):
+    """按app.config生成gunicorn配置"""
+    return {
+        'bind': config['SERVE_BIND'],
+        'workers': config['SERVE_WORKERS'],
+        'worker_class': 'gthread',
+        'threads': config['SERVE_THREADS'],
+        'timeout': config['SERVE_TIMEOUT'],
+        'graceful_timeout': config['SERVE_GRACEFUL_TIMEOUT'],
+        'keepalive': config['SERVE_KEEPALIVE'],
+        'max_requests': config['SERVE_MAX_REQUESTS'],
+        'max_requests_jitter': config['SERVE_MAX_REQUESTS_JITTER'],
+        'preload_app': config['SERVE_PRELOAD'],
+        'accesslog': config['SERVE_ACCESS_LOG'] or None,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit
+    }
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
+
+
+def post_worker_init(worker):
+    """
+    收到TERM时先开始平滑退出, 再交给gunicorn的TERM处理(停止接受新连接并等待进行中的请求)
+
+    begin_drain需要等待后台任务线程结束, 放到单独的线程中执行, 信号处理函数立即返回
+    """
+    import app
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        threading.Thread(target=app.begin_drain, name='worker-drain', daemon=True).start()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_worker()
+
+
+def run(application, options):
+    """在当前进程中启动gunicorn主进程(阻塞直到服务停止)"""
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    ProductionServer().run()
@@ -0,0 +1,158 @@
+"""
+数据库后端测试
+
+每个用例分别在SQLite和MySQL上执行:
+- SQLite使用临时文件
+- MySQL只在设置了TEST_MYSQL_DSN(指向一个空的测试库)且安装了pyodbc时执行, 否则跳过
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from backends import MySQLBackend, SQLiteBackend
+from migrations import MIGRATIONS, TABLE_CHARSET, current_version, explain_hot_queries, migrate
+
+TEST_TABLE = 'backend_test_items'
+
+TEST_TABLE_DDL = f'''
+    CREATE TABLE IF NOT EXISTS {TEST_TABLE} (
+        item_id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(50) NOT NULL UNIQUE,
+        total INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_{TEST_TABLE}_total (total)
+    ) {TABLE_CHARSET} ENGINE=InnoDB
+'''
+
+OLD_TIME = datetime(2000, 1, 1)
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'test.db'))
+    dsn = os.environ.get('TEST_MYSQL_DSN')
+    if not dsn:
+        pytest.skip('未设置TEST_MYSQL_DSN')
+    pytest.importorskip('pyodbc')
+    return MySQLBackend(dsn)
+
+
+@pytest.fixture
+def conn(backend):
+    conn = backend.connect()
+    yield conn
+    conn.rollback()
+    conn.cursor().execute(f'DROP TABLE IF EXISTS {TEST_TABLE}')
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def cursor(backend, conn):
+    cursor = conn.cursor()
+    backend.create_table(cursor, TEST_TABLE_DDL)
+    conn.commit()
+    return cursor
+
+
+def insert_item(backend, cursor, name, total=0):
+    cursor.execute(f'INSERT INTO {TEST_TABLE} (name, total) VALUES (?, ?)', (name, total))
+    cursor.execute(backend.last_insert_id_sql)
+    return cursor.fetchone()[0]
+
+
+def fetch_item(cursor, name):
+    cursor.execute(f'SELECT item_id, total, created_at, update_time FROM {TEST_TABLE} WHERE name = ?', (name,))
+    return cursor.fetchone()
+
+
+def test_create_table_translates_ddl(backend, cursor):
+    assert backend.index_exists(cursor, TEST_TABLE, f'idx_{TEST_TABLE}_total')
+    assert not backend.index_exists(cursor, TEST_TABLE, 'idx_missing')
+
+    insert_item(backend, cursor, 'a')
+    item_id, total, created_at, update_time = fetch_item(cursor, 'a')
+    assert total == 0
+    assert isinstance(created_at, datetime)
+    assert isinstance(update_time, datetime)
+
+    # 再次执行建表语句不报错
+    backend.create_table(cursor, TEST_TABLE_DDL)
+
+
+def test_insert_id(backend, cursor):
+    first = insert_item(backend, cursor, 'a')
+    second = insert_item(backend, cursor, 'b')
+    assert second == first + 1
+    assert fetch_item(cursor, 'b')[0] == second
+
+
+def test_on_update_timestamp(backend, conn, cursor):
+    insert_item(backend, cursor, 'a')
+    # 显式设置的值保留
+    cursor.execute(f'UPDATE {TEST_TABLE} SET update_time = ? WHERE name = ?', (OLD_TIME, 'a'))
+    conn.commit()
+    assert fetch_item(cursor, 'a')[3] == OLD_TIME
+
+    # 修改其他列时自动更新为当前时间
+    cursor.execute(f'UPDATE {TEST_TABLE} SET total = 5 WHERE name = ?', ('a',))
+    conn.commit()
+    assert fetch_item(cursor, 'a')[3] > OLD_TIME
+
+    if backend.name == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (TEST_TABLE,))
+        assert [row[0] for row in cursor.fetchall()] == [f'trg_{TEST_TABLE}_update_time']
+
+
+def test_upsert(backend, cursor):
+    sql = backend.upsert_sql(TEST_TABLE, ('name', 'total'), ('name',), add=('total',))
+    cursor.execute(sql, ('a', 2))
+    cursor.execute(sql, ('a', 3))
+    assert fetch_item(cursor, 'a')[1] == 5
+
+    sql = backend.upsert_sql(TEST_TABLE, ('name', 'total'), ('name',), replace=('total',))
+    cursor.execute(sql, ('a', 1))
+    assert fetch_item(cursor, 'a')[1] == 1
+
+
+def test_duplicate_error(backend, cursor):
+    insert_item(backend, cursor, 'a')
+    with pytest.raises(backend.Error) as info:
+        insert_item(backend, cursor, 'a')
+    assert backend.is_duplicate_error(info.value)
+
+
+def test_delete_limit(backend, cursor):
+    for index in range(5):
+        insert_item(backend, cursor, f'item{index}', total=index % 2)
+    cursor.execute(backend.delete_limit_sql(TEST_TABLE, ' WHERE total = ?'), (0, 2))
+    assert cursor.rowcount == 2
+    cursor.execute(f'SELECT COUNT(*) FROM {TEST_TABLE} WHERE total = 0')
+    assert cursor.fetchone()[0] == 1
+
+
+def test_migrations(backend, conn):
+    cursor = conn.cursor()
+    if current_version(cursor, backend) != 0:
+        pytest.skip('测试库不是空库')
+    latest = MIGRATIONS[-1][0]
+
+    assert migrate(conn, backend, target=2) == [1, 2]
+    assert migrate(conn, backend) == list(range(3, latest + 1))
+    assert migrate(conn, backend) == []
+    assert current_version(cursor, backend) == latest
+
+    # 迁移创建的表同样有ON UPDATE行为
+    cursor.execute("INSERT INTO devices (device_id, device_name, device_type) VALUES ('d1', '设备1', 'light')")
+    cursor.execute('UPDATE devices SET update_time = ? WHERE device_id = ?', (OLD_TIME, 'd1'))
+    cursor.execute("UPDATE devices SET current_status = 'ON' WHERE device_id = 'd1'")
+    cursor.execute("SELECT current_status, update_time FROM devices WHERE device_id = 'd1'")
+    status, update_time = cursor.fetchone()
+    assert status == 'ON' and update_time > OLD_TIME
+    conn.rollback()
+
+    failed = [result for result in explain_hot_queries(cursor, backend) if not result['ok']]
+    assert failed == []
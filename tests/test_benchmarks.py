@@ -0,0 +1,96 @@
+"""基准测试工具的测试: 基线比较、基线保存和按请求的查询计数"""
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from benchmarks import QueryCounter, compare_with_baseline, load_baseline, save_baseline
+
+
+def make_row(endpoint, p95_ms=10.0, throughput=100.0, queries=2.0, errors=0):
+    return {'endpoint': endpoint, 'requests': 100, 'errors': errors, 'throughput': throughput,
+            'p50_ms': p95_ms / 2, 'p95_ms': p95_ms, 'p99_ms': p95_ms * 2, 'queries': queries}
+
+
+BASELINE = {'devices': make_row('devices')}
+
+
+def test_compare_within_tolerance():
+    assert compare_with_baseline([make_row('devices', p95_ms=11.5, throughput=85.0, queries=2.5)], BASELINE) == []
+
+
+def test_compare_ignores_new_endpoints():
+    assert compare_with_baseline([make_row('classes', p95_ms=1000.0)], BASELINE) == []
+
+
+@pytest.mark.parametrize('row, expected', [
+    (make_row('devices', p95_ms=20.0), 'devices: p95 10.00ms -> 20.00ms'),
+    (make_row('devices', throughput=50.0), 'devices: 吞吐量 100.0/s -> 50.0/s'),
+    (make_row('devices', queries=3.0), 'devices: 查询数 2.0 -> 3.0'),
+    (make_row('devices', errors=1), 'devices: 错误数 0 -> 1')
+])
+def test_compare_reports_regressions(row, expected):
+    assert compare_with_baseline([row], BASELINE) == [expected]
+
+
+def test_compare_min_delta():
+    # 基线很快的接口, 相对退化超过tolerance但绝对值小于min_delta_ms时不算退化
+    baseline = {'boot': make_row('boot', p95_ms=0.5)}
+    assert compare_with_baseline([make_row('boot', p95_ms=1.2)], baseline) == []
+    assert compare_with_baseline([make_row('boot', p95_ms=2.0)], baseline) == ['boot: p95 0.50ms -> 2.00ms']
+
+
+def test_compare_without_query_counts():
+    assert compare_with_baseline([make_row('devices', queries=None)], BASELINE) == []
+
+
+def test_save_and_load_baseline(tmp_path):
+    path = str(tmp_path / 'nested' / 'baseline.json')
+    assert load_baseline(path, 'client') is None
+    save_baseline(path, 'client', [make_row('devices')], {'requests': 100})
+    save_baseline(path, 'server', [make_row('classes')], {'requests': 50})
+    assert load_baseline(path, 'client') == BASELINE
+    assert set(load_baseline(path, 'server')) == {'classes'}
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['params'] == {'client': {'requests': 100}, 'server': {'requests': 50}}
+
+
+def test_save_baseline_refuses_errors(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    save_baseline(path, 'client', [make_row('devices')], {})
+    with pytest.raises(ValueError, match='metrics'):
+        save_baseline(path, 'client', [make_row('devices', p95_ms=50.0), make_row('metrics', errors=3)], {})
+    # 原有基线保持不变
+    assert load_baseline(path, 'client') == BASELINE
+
+
+def test_query_counter_counts_per_request():
+    counter = QueryCounter()
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.set_trace_callback(counter.trace)
+    conn.execute('CREATE TABLE t (x INT)')
+
+    def handle(key, count):
+        counter.begin(key)
+        for value in range(count):
+            conn.execute('INSERT INTO t VALUES (?)', (value,))
+            conn.execute('SELECT COUNT(*) FROM t').fetchone()
+
+    thread = threading.Thread(target=handle, args=('a', 3))
+    thread.start()
+    thread.join()
+    handle('b', 2)
+
+    assert counter.pop('a') == 6
+    assert counter.pop('b') == 4
+    assert counter.pop('a') is None
+
+    # 流式响应发送响应体时的查询仍计入该请求
+    def body():
+        yield conn.execute('SELECT 2').fetchone()
+
+    counter.begin('c')
+    conn.execute('SELECT 1')
+    list(body())
+    assert counter.pop('c') == 2
@@ -0,0 +1,145 @@
+"""
+命令调度器测试
+
+使用SimulatorTransport(固定seed, 不加抖动)模拟网关, 用较长的latency让命令在断言期间保持下发中
+"""
+import time
+
+import pytest
+
+from dispatcher import CommandDispatcher, DispatcherClosedError, SimulatorTransport, TransportError
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.005)
+
+
+class Recorder:
+    """记录on_ack / on_failed的调用"""
+
+    def __init__(self):
+        self.acked = []
+        self.failed = []
+
+    def on_ack(self, command):
+        self.acked.append((command.device_id, command.class_id, command.command))
+
+    def on_failed(self, command, error):
+        self.failed.append((command, error))
+
+
+def create_dispatcher(transport, recorder, **kwargs):
+    return CommandDispatcher(transport, recorder.on_ack, recorder.on_failed, **kwargs)
+
+
+def in_flight(dispatcher, count):
+    return lambda: dispatcher.stats()['in_flight'] == count
+
+
+def test_class_concurrency_limit():
+    transport = SimulatorTransport(latency=0.02, jitter=0, seed=1)
+    recorder = Recorder()
+    dispatcher = create_dispatcher(transport, recorder, class_concurrency=2, workers=16)
+    for class_id in (1, 2):
+        for index in range(8):
+            assert dispatcher.submit(f'd{class_id}-{index}', class_id, 'turn-on', 'ON') == 'queued'
+    dispatcher.close(timeout=10)
+
+    assert transport.max_active == {1: 2, 2: 2}
+    assert len(transport.acked) == 16
+
+    stats = dispatcher.stats()
+    assert stats['submitted'] == stats['dispatched'] == stats['acked'] == 16
+    assert stats['pending'] == stats['in_flight'] == stats['busy_classes'] == 0
+    assert stats['transport'] == 'simulator'
+    assert stats['class_concurrency'] == 2
+
+
+def test_coalesce_pending_commands():
+    transport = SimulatorTransport(latency=0.2, jitter=0, seed=1)
+    recorder = Recorder()
+    dispatcher = create_dispatcher(transport, recorder, class_concurrency=1)
+    dispatcher.submit('blocker', 1, 'turn-on', 'ON')
+    wait_until(in_flight(dispatcher, 1))
+
+    # 教室的并发已占满, 后续命令等待下发, 同一设备只保留最后一条
+    assert dispatcher.submit('d1', 1, 'turn-on', 'ON') == 'queued'
+    assert dispatcher.submit('d1', 1, 'turn-off', 'OFF') == 'coalesced'
+    assert dispatcher.submit('d1', 1, 'turn-on', 'ON') == 'coalesced'
+    dispatcher.close(timeout=10)
+
+    assert list(transport.acked) == [('blocker', 'turn-on', 1), ('d1', 'turn-on', 1)]
+    assert recorder.acked == [('blocker', 1, 'turn-on'), ('d1', 1, 'turn-on')]
+    stats = dispatcher.stats()
+    assert (stats['submitted'], stats['coalesced'], stats['dispatched'], stats['acked']) == (4, 2, 2, 2)
+
+
+def test_device_order_across_class_change():
+    transport = SimulatorTransport(latency=0.2, jitter=0, seed=1)
+    recorder = Recorder()
+    dispatcher = create_dispatcher(transport, recorder, class_concurrency=4)
+    dispatcher.submit('d1', 1, 'turn-on', 'ON')
+    wait_until(in_flight(dispatcher, 1))
+
+    # 设备换到其他教室后提交的命令, 在上一条命令确认前不下发; 等待中的命令只保留一条
+    assert dispatcher.submit('d1', 2, 'turn-off', 'OFF') == 'queued'
+    assert dispatcher.submit('d1', 3, 'turn-on', 'ON') == 'coalesced'
+    time.sleep(0.05)
+    stats = dispatcher.stats()
+    assert (stats['pending'], stats['in_flight']) == (1, 1)
+    dispatcher.close(timeout=10)
+
+    assert recorder.acked == [('d1', 1, 'turn-on'), ('d1', 3, 'turn-on')]
+    assert 2 not in transport.max_active
+    assert dispatcher.stats()['busy_classes'] == 0
+
+
+def test_retry_with_backoff_then_fail():
+    transport = SimulatorTransport(latency=0, jitter=0, failure_rate=1.0, seed=1)
+    recorder = Recorder()
+    dispatcher = create_dispatcher(transport, recorder, max_attempts=3, backoff=0.01, backoff_max=0.02)
+    dispatcher.submit('d1', 1, 'turn-on', 'ON')
+    wait_until(lambda: recorder.failed)
+
+    command, error = recorder.failed[0]
+    assert command.device_id == 'd1' and command.attempts == 3
+    assert isinstance(error, TransportError)
+    assert recorder.acked == []
+    assert transport.failures == 3
+
+    stats = dispatcher.stats()
+    assert (stats['dispatched'], stats['retries'], stats['failed'], stats['acked']) == (3, 2, 1, 0)
+    assert stats['recent_failures'][0]['device_id'] == 'd1'
+    assert stats['recent_failures'][0]['attempts'] == 3
+    dispatcher.close(timeout=10)
+
+
+def test_seeded_failures_are_retried():
+    transport = SimulatorTransport(latency=0.005, jitter=0, failure_rate=0.3, seed=7)
+    recorder = Recorder()
+    dispatcher = create_dispatcher(transport, recorder, class_concurrency=2, max_attempts=20,
+                                   backoff=0.001, backoff_max=0.005)
+    devices = [(f'd{index}', index % 3) for index in range(30)]
+    for device_id, class_id in devices:
+        dispatcher.submit(device_id, class_id, 'turn-on', 'ON')
+    wait_until(lambda: dispatcher.stats()['acked'] + dispatcher.stats()['failed'] == len(devices))
+
+    stats = dispatcher.stats()
+    assert transport.failures > 0
+    assert stats['retries'] + stats['failed'] == transport.failures
+    assert stats['acked'] == len(transport.acked) == len(recorder.acked)
+    assert sorted(recorder.acked) == sorted((device_id, class_id, 'turn-on') for device_id, class_id in devices)
+    assert all(count <= 2 for count in transport.max_active.values())
+    dispatcher.close(timeout=10)
+
+
+def test_closed_dispatcher_rejects_commands():
+    dispatcher = create_dispatcher(SimulatorTransport(latency=0, jitter=0), Recorder())
+    dispatcher.close(timeout=1)
+    with pytest.raises(DispatcherClosedError):
+        dispatcher.submit('d1', 1, 'turn-on', 'ON')
+    assert not dispatcher.stats()['running']
@@ -0,0 +1,163 @@
+"""
+设备读数时序存储
+
+- device_readings: 原始读数, 每行一个数值(DOUBLE), 用小整数metric_code表示指标
+- reading_rollups: 按分钟(60)和小时(3600)汇总的min/max/sum/count
+- metrics: 指标代码、名称和单位
+"""
+import re
+from datetime import datetime, timedelta
+
+# 指标定义: 名称(与data_records.data_type一致) -> (指标代码, 单位)
+METRICS = {
+    '状态': (1, ''),
+    '亮度': (2, '%'),
+    '功率': (3, 'W'),
+    '温度': (4, '°C'),
+    '对比度': (5, '%'),
+    '运行时间': (6, '小时')
+}
+METRIC_NAMES = {code: name for name, (code, _) in METRICS.items()}
+
+# 汇总粒度(秒), 从细到粗
+ROLLUP_RESOLUTIONS = (60, 3600)
+
+_NUMBER_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)')
+
+
+def parse_reading(data_type, data_value):
+    """
+    把读数字符串转换为(指标代码, 数值)
+
+    - "23°C" -> (4, 23.0), "35W" -> (3, 35.0)
+    - 状态读数ON/OFF转换为1/0
+    - 未定义的指标或无法解析的值返回None
+    """
+    metric = METRICS.get(data_type)
+    if metric is None:
+        return None
+    code = metric[0]
+    if data_type == '状态':
+        return code, 1.0 if str(data_value).upper() == 'ON' else 0.0
+    match = _NUMBER_PATTERN.match(str(data_value))
+    if match is None:
+        return None
+    return code, float(match.group(1))
+
+
+def build_reading_rows(samples):
+    """
+    Args:
+        samples: [(device_id, data, timestamp)]
+
+    Returns:
+        rows: [(device_id, metric_code, ts, value)]
+    """
+    rows = []
+    for device_id, data, timestamp in samples:
+        for key, value in data.items():
+            parsed = parse_reading(key, value)
+            if parsed is not None:
+                rows.append((device_id, parsed[0], timestamp, parsed[1]))
+    return rows
+
+
+def floor_time(value, seconds):
+    """把时间向下取整到seconds的整数倍"""
+    epoch = datetime(1970, 1, 1)
+    offset = int((value - epoch).total_seconds()) // seconds * seconds
+    return epoch + timedelta(seconds=offset)
+
+
+def _as_datetime(value):
+    """分桶表达式的结果在SQLite中是文本"""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def refresh_rollup(cursor, backend, resolution, start, end):
+    """
+    重新计算[start, end)范围内resolution粒度的汇总
+
+    - 分钟汇总由device_readings计算
+    - 更粗的汇总由上一级汇总合并, 不再扫描原始读数
+    - backend: 数据库后端(backends.py), 提供分桶表达式和upsert写法
+    """
+    index = ROLLUP_RESOLUTIONS.index(resolution)
+    if index == 0:
+        bucket = backend.bucket_expr('ts', resolution)
+        select = f'''
+            SELECT device_id, metric_code, {resolution}, {bucket},
+                   MIN(value), MAX(value), SUM(value), COUNT(*)
+            FROM device_readings
+            WHERE ts >= ? AND ts < ?
+            GROUP BY device_id, metric_code, {bucket}
+        '''
+        params = [start, end]
+    else:
+        bucket = backend.bucket_expr('bucket_start', resolution)
+        select = f'''
+            SELECT device_id, metric_code, {resolution}, {bucket},
+                   MIN(min_value), MAX(max_value), SUM(sum_value), SUM(sample_count)
+            FROM reading_rollups
+            WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ?
+            GROUP BY device_id, metric_code, {bucket}
+        '''
+        params = [ROLLUP_RESOLUTIONS[index - 1], start, end]
+
+    cursor.execute(backend.upsert_sql(
+        'reading_rollups',
+        ('device_id', 'metric_code', 'resolution', 'bucket_start', 'min_value', 'max_value', 'sum_value', 'sample_count'),
+        ('device_id', 'metric_code', 'resolution', 'bucket_start'),
+        replace=('min_value', 'max_value', 'sum_value', 'sample_count'),
+        select=select
+    ), params)
+
+
+def choose_source(step):
+    """
+    选择满足step的最粗数据源(step必须是汇总粒度的整数倍, 才能按桶合并)
+
+    Returns:
+        resolution: 汇总粒度(秒), 0表示原始读数
+    """
+    resolution = 0
+    for candidate in ROLLUP_RESOLUTIONS:
+        if step >= candidate and step % candidate == 0:
+            resolution = candidate
+    return resolution
+
+
+def query_series(cursor, backend, device_id, start, end, step, metric_codes=None):
+    """
+    查询[start, end)范围内按step秒聚合的读数
+
+    Returns:
+        (resolution, rows): rows为[(metric_code, bucket_start, min, max, sum, count)]
+    """
+    resolution = choose_source(step)
+    if resolution == 0:
+        bucket = backend.bucket_expr('ts', step)
+        query = f'''
+            SELECT metric_code, {bucket} AS bucket_time,
+                   MIN(value), MAX(value), SUM(value), COUNT(*)
+            FROM device_readings
+            WHERE device_id = ? AND ts >= ? AND ts < ?
+        '''
+        params = [device_id, start, end]
+    else:
+        bucket = backend.bucket_expr('bucket_start', step)
+        query = f'''
+            SELECT metric_code, {bucket} AS bucket_time,
+                   MIN(min_value), MAX(max_value), SUM(sum_value), SUM(sample_count)
+            FROM reading_rollups
+            WHERE device_id = ? AND resolution = ? AND bucket_start >= ? AND bucket_start < ?
+        '''
+        params = [device_id, resolution, start, end]
+
+    if metric_codes:
+        query += f" AND metric_code IN ({', '.join('?' * len(metric_codes))})"
+        params.extend(metric_codes)
+    query += f' GROUP BY metric_code, {bucket} ORDER BY metric_code, bucket_time'
+
+    cursor.execute(query, params)
+    return resolution, [(row[0], _as_datetime(row[1])) + tuple(row[2:]) for row in cursor.fetchall()]